@@ -0,0 +1,7 @@
+#!/bin/bash
+
+DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
+
+. $DIR/setEnv.sh
+
+python -m proteomics.scripts.export_taxon_peptides $@
@@ -82,9 +82,36 @@ DEFAULT_DIGEST_DEFINITION = {
     'min_acids': 6,
 }
 
+# Maximum number of peptide sequence -> id mappings to keep in memory while
+# ingesting.
+PEPTIDE_ID_CACHE_SIZE = int(5e6)
+
 SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.environ.get(
     'PROTEOMICS_DB', '/tmp/testProteomics.db.sqlite')
 
+# Directory for peptide search indexes, which are built from the db.
+SEARCH_INDEX_DIR = os.environ.get(
+    'PROTEOMICS_INDEX_DIR', 
+    os.environ.get('PROTEOMICS_DB', '/tmp/testProteomics.db.sqlite')
+    + '.indexes')
+
+# SQLite PRAGMA settings applied to each new db connection.
+# See http://www.sqlite.org/pragma.html .
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # Negative values are in KiB, so this is ~200MB of page cache.
+    'cache_size': -200000,
+    'mmap_size': 2**30,
+    'temp_store': 'MEMORY',
+}
+
+# SQLite PRAGMA settings used during bulk loads. These trade durability for
+# speed: if the machine crashes during a bulk load, the db may be corrupted.
+SQLITE_BULK_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+}
+
 # secrets.py (if it exists) can override any of the items above.
 try:
     from .secrets import *
@@ -7,17 +7,79 @@ modular, flexible, and fast.
 
 from proteomics import models
 from proteomics import config
+from proteomics.util.sequence_hash import get_sequence_hash
+from proteomics.util.distance import get_composition, format_composition
 from sqlalchemy import (MetaData, Table, Column, Integer, String, ForeignKey,
-                       DateTime, Float)
+                       DateTime, Float, BigInteger, LargeBinary)
 from sqlalchemy.orm import mapper, relationship
 from sqlalchemy import create_engine, MetaData
-from sqlalchemy.sql import text
+from sqlalchemy.sql import text, select, bindparam, func
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm import object_session 
 from sqlalchemy.orm.util import has_identity 
+from sqlalchemy import event
+from sqlalchemy import inspect
+from contextlib import contextmanager
+
+
+def set_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in sorted(pragmas.items()):
+        cursor.execute("PRAGMA %s = %s" % (name, value))
+    cursor.close()
+
+def get_sqlite_pragmas(dbapi_connection, names):
+    pragmas = {}
+    cursor = dbapi_connection.cursor()
+    for name in names:
+        pragmas[name] = cursor.execute("PRAGMA %s" % name).fetchone()[0]
+    cursor.close()
+    return pragmas
+
+def apply_sqlite_profile(engine, pragmas=None):
+    """ Apply SQLite PRAGMA settings to each new connection of an engine.
+    Defaults to config.SQLITE_PRAGMAS. """
+    if engine.dialect.name != 'sqlite':
+        return
+    if pragmas is None:
+        pragmas = config.SQLITE_PRAGMAS
+    def on_connect(dbapi_connection, connection_record):
+        set_sqlite_pragmas(dbapi_connection, pragmas)
+    event.listen(engine, 'connect', on_connect)
+
+@contextmanager
+def bulk_load_mode(connection, pragmas=None):
+    """ Relax durability settings on a connection for the duration of a
+    bulk load. On exit the original settings are restored, and the WAL
+    (if any) is checkpointed into the main db file.
+    Defaults to config.SQLITE_BULK_LOAD_PRAGMAS.
+
+    The PRAGMA statements are sent on the DBAPI connection, and Python 2's
+    sqlite3 commits any open transaction before them. So the connection
+    must not be in a transaction on entry. If a transaction is still open
+    on exit, e.g. because the bulk load raised, the relaxed settings are
+    left in place rather than committing it. """
+    if connection.engine.dialect.name != 'sqlite':
+        yield connection
+        return
+    if connection.in_transaction():
+        raise ValueError("Can not switch to bulk load mode in a transaction,"
+                         " the PRAGMA statements would commit it")
+    if pragmas is None:
+        pragmas = config.SQLITE_BULK_LOAD_PRAGMAS
+    dbapi_connection = connection.connection
+    original_pragmas = get_sqlite_pragmas(dbapi_connection, pragmas.keys())
+    set_sqlite_pragmas(dbapi_connection, pragmas)
+    try:
+        yield connection
+    finally:
+        if not connection.in_transaction():
+            set_sqlite_pragmas(dbapi_connection, original_pragmas)
+            connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
 
 
 engine = create_engine(config.SQLALCHEMY_DATABASE_URI)
+apply_sqlite_profile(engine)
 
 def get_connection():
     return engine.connect()
@@ -28,11 +90,147 @@ def get_session(bind=None):
     return sessionmaker(bind=bind)()
 
 def init_db(bind=engine):
+    upgrade_db(bind=bind)
+    # Restore any indexes which were dropped by an interrupted bulk load.
+    ensure_indexes(bind=bind)
+
+def upgrade_db(bind=engine):
+    """ Create any missing tables, and upgrade dbs which were created by
+    earlier versions of the schema. Does nothing to an up-to-date db. """
     metadata.create_all(bind=bind, checkfirst=True)
+    # Upgrade dbs created before sequence hash columns existed.
+    add_sequence_hashes(bind=bind)
+    # Upgrade dbs created before peptide taxon counts existed.
+    add_peptide_taxon_counts(bind=bind)
+    # Upgrade dbs created before peptide compositions were added at ingest.
+    add_peptide_compositions(bind=bind)
+    # This index was never used by peptide taxon count queries.
+    bind.execute(text(
+        "DROP INDEX IF EXISTS ix_peptide_taxon_count_digest_id_taxon_count"))
 
 def clear_db(bind=engine):
     metadata.drop_all(bind=bind)
 
+def add_sequence_hashes(bind=engine, batch_size=1e4):
+    """ Add and populate sequence_hash columns in the protein and peptide
+    tables, for dbs which were created before those columns existed. """
+    inspector = inspect(bind)
+    for table in [tables['Protein'], tables['Peptide']]:
+        column_names = [column['name'] for column in 
+                        inspector.get_columns(table.name)]
+        if 'sequence_hash' in column_names:
+            continue
+        bind.execute(text(
+            "ALTER TABLE %s ADD COLUMN sequence_hash BIGINT" % table.name))
+        q = select([table.c.id, table.c.sequence]).order_by(table.c.id)
+        last_id = None
+        while True:
+            batch_q = q
+            if last_id is not None:
+                batch_q = q.where(table.c.id > last_id)
+            rows = bind.execute(batch_q.limit(int(batch_size))).fetchall()
+            if not rows:
+                break
+            bind.execute(
+                table.update()
+                .where(table.c.id == bindparam('row_id'))
+                .values(sequence_hash=bindparam('row_hash')),
+                [{'row_id': row_id, 'row_hash': get_sequence_hash(sequence)}
+                 for row_id, sequence in rows]
+            )
+            last_id = rows[-1][0]
+
+def add_peptide_taxon_counts(bind=engine):
+    """ Populate the peptide_taxon_count table from taxon digest peptides,
+    for dbs which were created before that table existed. """
+    ptc = tables['PeptideTaxonCount']
+    tdp = tables['TaxonDigestPeptide']
+    td = tables['TaxonDigest']
+    if bind.execute(select([ptc.c.peptide_id]).limit(1)).first():
+        return
+    if not bind.execute(select([tdp.c.id]).limit(1)).first():
+        return
+    q = (
+        select([td.c.digest_id, tdp.c.peptide_id,
+                func.count(func.distinct(td.c.taxon_id))])
+        .select_from(tdp.join(td, td.c.id == tdp.c.taxon_digest_id))
+        .group_by(td.c.digest_id, tdp.c.peptide_id)
+    )
+    bind.execute(ptc.insert().from_select(
+        ['digest_id', 'peptide_id', 'taxon_count'], q))
+
+def get_peptide_composition_dict(peptide_id, sequence):
+    """ Get a peptide_composition row for a peptide. """
+    return {
+        'peptide_id': peptide_id,
+        'length': len(sequence),
+        'composition': format_composition(get_composition(sequence)),
+    }
+
+def add_peptide_compositions(bind=engine, batch_size=1e4):
+    """ Add peptide_composition rows for peptides which do not have them
+    yet. Peptides are never deleted and their ids only increase, so these
+    are the peptides with ids greater than the last composition's peptide
+    id. Returns the number of rows added. """
+    peptide = tables['Peptide']
+    composition = tables['PeptideComposition']
+    last_id = bind.execute(
+        select([func.max(composition.c.peptide_id)])).scalar() or 0
+    q = select([peptide.c.id, peptide.c.sequence]).order_by(peptide.c.id)
+    num_added = 0
+    while True:
+        rows = bind.execute(
+            q.where(peptide.c.id > last_id).limit(int(batch_size))
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(composition.insert(), [
+            get_peptide_composition_dict(peptide_id, sequence)
+            for peptide_id, sequence in rows])
+        num_added += len(rows)
+        last_id = rows[-1][0]
+    return num_added
+
+def get_existing_index_names(bind=engine):
+    inspector = inspect(bind)
+    index_names = set()
+    for table_name in inspector.get_table_names():
+        for index in inspector.get_indexes(table_name):
+            index_names.add(index['name'])
+    return index_names
+
+def get_deferrable_indexes():
+    """ Get secondary indexes which can be dropped during a bulk load, i.e.
+    all indexes except for those which ingest uses for its own lookups. """
+    deferrable_indexes = []
+    for table in metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in ingest_lookup_indexes:
+                deferrable_indexes.append(index)
+    return deferrable_indexes
+
+def drop_deferrable_indexes(bind=engine):
+    """ Drop deferrable indexes. Returns the dropped indexes. """
+    existing_index_names = get_existing_index_names(bind=bind)
+    dropped_indexes = []
+    for index in get_deferrable_indexes():
+        if index.name in existing_index_names:
+            index.drop(bind=bind)
+            dropped_indexes.append(index)
+    return dropped_indexes
+
+def ensure_indexes(bind=engine):
+    """ Create any indexes defined in the schema which do not exist in the
+    db. Returns the created indexes. """
+    existing_index_names = get_existing_index_names(bind=bind)
+    created_indexes = []
+    for table in metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing_index_names:
+                index.create(bind=bind)
+                created_indexes.append(index)
+    return created_indexes
+
 def get_session_w_external_trans(orig_session):
     con = orig_session.bind.connect()
     trans = con.begin()
@@ -66,6 +264,31 @@ def get_batched_results(q, batch_size):
                 batch = None
             yield row
 
+def get_keyset_batched_results(q, key_column, batch_size):
+    """ Return an iterator that batches query results, using keyset
+    pagination. Each batch is fetched with 'WHERE key > last_key ORDER BY key
+    LIMIT batch_size', so fetching a batch costs the same no matter how far
+    into the results it is. Unlike get_batched_results, no count query is
+    needed.
+    key_column must be unique within the results, sortable, and available on
+    each result row under its key name (e.g. Peptide.id -> row.id).
+    Any ordering on the query is replaced by ordering on the key column.
+    """
+    batch_size = int(batch_size)
+    ordered_q = q.order_by(None).order_by(key_column)
+    last_key = None
+    while True:
+        if last_key is None:
+            batch_q = ordered_q
+        else:
+            batch_q = ordered_q.filter(key_column > last_key)
+        batch = batch_q.limit(batch_size).all()
+        for row in batch:
+            yield row
+        if len(batch) < batch_size:
+            break
+        last_key = getattr(batch[-1], key_column.key)
+
 
 # Define tables.
 metadata = MetaData()
@@ -92,7 +315,8 @@ mapper(models.TaxonDigest, tables['TaxonDigest'], properties={
 tables['Protein'] = Table(
     'protein', metadata,
     Column('id', Integer, primary_key=True),
-    Column('sequence', String, index=True),
+    Column('sequence', String),
+    Column('sequence_hash', BigInteger, index=True, unique=True),
     Column('mass', Float),
 )
 mapper(models.Protein, tables['Protein'])
@@ -124,10 +348,21 @@ tables['Peptide'] = Table(
     'peptide', metadata,
     Column('id', Integer, primary_key=True),
     Column('sequence', String, index=True),
+    Column('sequence_hash', BigInteger, index=True, unique=True),
     Column('mass', Float),
 )
 mapper(models.Peptide, tables['Peptide'])
 
+tables['PeptideComposition'] = Table(
+    'peptide_composition', metadata,
+    Column('peptide_id', Integer, ForeignKey('peptide.id'), primary_key=True),
+    Column('length', Integer, index=True),
+    Column('composition', String),
+)
+mapper(models.PeptideComposition, tables['PeptideComposition'], properties={
+    'peptide': relationship(models.Peptide),
+})
+
 tables['ProteinDigestPeptide'] = Table(
     'protein_digest_peptide', metadata,
     Column('id', Integer, primary_key=True),
@@ -162,6 +397,73 @@ mapper(
     }
 )
 
+tables['TaxonDigestBitmap'] = Table(
+    'taxon_digest_bitmap', metadata,
+    Column('taxon_digest_id', Integer, ForeignKey('taxon_digest.id'),
+           primary_key=True),
+    Column('bitmap', LargeBinary),
+)
+mapper(models.TaxonDigestBitmap, tables['TaxonDigestBitmap'], properties={
+    'taxon_digest': relationship(models.TaxonDigest),
+})
+
+tables['TaxonDigestSketch'] = Table(
+    'taxon_digest_sketch', metadata,
+    Column('taxon_digest_id', Integer, ForeignKey('taxon_digest.id'),
+           primary_key=True),
+    Column('minhash', LargeBinary),
+    Column('hll', LargeBinary),
+)
+mapper(models.TaxonDigestSketch, tables['TaxonDigestSketch'], properties={
+    'taxon_digest': relationship(models.TaxonDigest),
+})
+
+tables['TaxonDigestGeneration'] = Table(
+    'taxon_digest_generation', metadata,
+    Column('taxon_digest_id', Integer, ForeignKey('taxon_digest.id'),
+           primary_key=True),
+    Column('generation', BigInteger),
+)
+mapper(models.TaxonDigestGeneration, tables['TaxonDigestGeneration'],
+       properties={
+           'taxon_digest': relationship(models.TaxonDigest),
+       })
+
+tables['RedundancyPairCount'] = Table(
+    'redundancy_pair_count', metadata,
+    Column('taxon_digest1_id', Integer, ForeignKey('taxon_digest.id'),
+           primary_key=True),
+    Column('taxon_digest2_id', Integer, ForeignKey('taxon_digest.id'),
+           primary_key=True, index=True),
+    Column('generation1', BigInteger),
+    Column('generation2', BigInteger),
+    Column('intersection_count', Integer),
+    Column('union_count', Integer),
+)
+mapper(models.RedundancyPairCount, tables['RedundancyPairCount'],
+       properties={
+           'taxon_digest1': relationship(
+               models.TaxonDigest,
+               primaryjoin=(tables['RedundancyPairCount'].c.taxon_digest1_id
+                            == tables['TaxonDigest'].c.id)),
+           'taxon_digest2': relationship(
+               models.TaxonDigest,
+               primaryjoin=(tables['RedundancyPairCount'].c.taxon_digest2_id
+                            == tables['TaxonDigest'].c.id)),
+       })
+
+tables['PeptideTaxonCount'] = Table(
+    'peptide_taxon_count', metadata,
+    Column('digest_id', Integer, ForeignKey('digest.id'), primary_key=True),
+    Column('peptide_id', Integer, ForeignKey('peptide.id'),
+           primary_key=True),
+    Column('taxon_count', Integer),
+)
+mapper(models.PeptideTaxonCount, tables['PeptideTaxonCount'], properties={
+    'digest': relationship(models.Digest),
+    'peptide': relationship(models.Peptide),
+})
+
 tables['Protease'] = Table(
     'protease', metadata,
     Column('id', String, primary_key=True),
@@ -180,3 +482,14 @@ tables['Digest'] = Table(
 mapper(models.Digest, tables['Digest'], properties={
     'protease': relationship(models.Protease),
 })
+
+# Indexes which are used by ingest for its own lookups, and so should be kept
+# during bulk loads: protein and peptide sequence hash lookups, checking
+# whether a protein has been digested, and reading peptides of digested
+# proteins.
+ingest_lookup_indexes = set([
+    'ix_protein_sequence_hash',
+    'ix_peptide_sequence_hash',
+    'ix_protein_digest_protein_id',
+    'ix_protein_digest_peptide_protein_digest_id',
+])
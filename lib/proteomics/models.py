@@ -24,9 +24,11 @@ class TaxonDigest(object):
         self.digest = digest
 
 class Protein(object):
-    def __init__(self, id=None, sequence=None, mass=None, metadata=None):
+    def __init__(self, id=None, sequence=None, mass=None, metadata=None,
+                 sequence_hash=None):
         self.id = id
         self.sequence = sequence
+        self.sequence_hash = sequence_hash
         self.mass = mass
         self.metadata = metadata
 
@@ -51,12 +53,24 @@ class TaxonProtein(object):
         self.metadata = metadata
 
 class Peptide(object):
-    def __init__(self, id=None, sequence=None, mass=None, metadata=None):
+    def __init__(self, id=None, sequence=None, mass=None, metadata=None,
+                 sequence_hash=None):
         self.id = id
         self.sequence = sequence
+        self.sequence_hash = sequence_hash
         self.mass = mass
         self.metadata = metadata
 
+class PeptideComposition(object):
+    """
+    A peptide composition holds a peptide's length and amino acid counts,
+    used to prune candidates in approximate sequence searches.
+    """
+    def __init__(self, peptide=None, length=None, composition=None):
+        self.peptide = peptide
+        self.length = length
+        self.composition = composition
+
 class ProteinDigestPeptide(object):
     """
     A protein digest peptide is a count of how many times a peptide 
@@ -79,6 +93,61 @@ class TaxonDigestPeptide(object):
         self.taxon_digest = taxon_digest
         self.count = count
 
+class TaxonDigestBitmap(object):
+    """
+    A taxon digest bitmap is a compressed bitmap of the ids of the peptides
+    in a taxon digest.
+    """
+    def __init__(self, taxon_digest=None, bitmap=None):
+        self.taxon_digest = taxon_digest
+        self.bitmap = bitmap
+
+class TaxonDigestSketch(object):
+    """
+    A taxon digest sketch holds a MinHash signature and a HyperLogLog of
+    the ids of the peptides in a taxon digest, for approximate redundancy
+    counts.
+    """
+    def __init__(self, taxon_digest=None, minhash=None, hll=None):
+        self.taxon_digest = taxon_digest
+        self.minhash = minhash
+        self.hll = hll
+
+class TaxonDigestGeneration(object):
+    """
+    A taxon digest generation is a random stamp assigned to a taxon digest
+    when it is ingested. Cached results for a taxon digest are only valid
+    for the generation they were computed for.
+    """
+    def __init__(self, taxon_digest=None, generation=None):
+        self.taxon_digest = taxon_digest
+        self.generation = generation
+
+class RedundancyPairCount(object):
+    """
+    A redundancy pair count is a cached count of the peptides in the
+    intersection and union of two taxon digests.
+    """
+    def __init__(self, taxon_digest1=None, taxon_digest2=None,
+                 generation1=None, generation2=None, intersection_count=None,
+                 union_count=None):
+        self.taxon_digest1 = taxon_digest1
+        self.taxon_digest2 = taxon_digest2
+        self.generation1 = generation1
+        self.generation2 = generation2
+        self.intersection_count = intersection_count
+        self.union_count = union_count
+
+class PeptideTaxonCount(object):
+    """
+    A peptide taxon count is the number of taxons whose digestion with
+    digest Y contains peptide X.
+    """
+    def __init__(self, digest=None, peptide=None, taxon_count=None):
+        self.digest = digest
+        self.peptide = peptide
+        self.taxon_count = taxon_count
+
 class Protease(object):
     def __init__(self, id=None, cleavage_rule=None):
         self.id = id
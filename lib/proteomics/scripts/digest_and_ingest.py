@@ -1,7 +1,8 @@
 """
 name: digest_and_ingest.py
 
-usage: digest_and_ingest.py [--digest-config=digest_config_file] fasta1 fasta2 ...
+usage: digest_and_ingest.py [--digest-config=digest_config_file]
+    [--num-workers=n] [--bulk-load] [--defer-indexes] fasta1 fasta2 ...
 
 commissioned by : Dr. Makoto Saito, 2013-03
 
@@ -34,6 +35,18 @@ argparser = argparse.ArgumentParser(description=(
 argparser.add_argument('--digest-def', help=(
     'JSON file containing a digest definition. If not provided, default digest'
     'will be used'))
+argparser.add_argument('--num-workers', type=int, default=1, help=(
+    'Number of worker processes to use for cleaving proteins. The main'
+    ' process will do all db writes. Default: 1 (no workers).'))
+argparser.add_argument('--bulk-load', action='store_true', help=(
+    'Relax db durability settings while loading, for speed. If the machine'
+    ' crashes during the load the db may be corrupted, so only use this'
+    ' for dbs which can be rebuilt.'))
+argparser.add_argument('--defer-indexes', action='store_true', help=(
+    'Drop secondary indexes while loading, and rebuild them at the end.'
+    ' This is faster for initial loads of many proteomes into a new db.'
+    ' If a run is interrupted, indexes are rebuilt by the next run or by'
+    ' initializing the db.'))
 argparser.add_argument('fasta_files', nargs='+',
                     help=('List of FASTA files containing protein sequences.'))
 """
@@ -68,6 +81,9 @@ def main():
         fasta_paths=fasta_files,
         digest=digest,
         get_connection=db.get_connection,
+        num_workers=args.num_workers,
+        bulk_load=args.bulk_load,
+        defer_indexes=args.defer_indexes,
     )
     stats = task.run()
     logger.info("Statistics on records created: %s" % stats)
@@ -0,0 +1,75 @@
+"""
+name: export_columnar.py
+
+usage: export_columnar.py --output-dir=output_dir [--format=parquet|arrow]
+    [--taxon-ids taxon_id ...]
+
+description: This script exports peptides, and the peptides in each taxon
+digest, to columnar Parquet or Arrow IPC files. See
+proteomics.services.columnar_export for the file layout.
+
+Assumptions:
+    - The redundancy db has already been created and is readable.
+    - pyarrow is installed.
+"""
+
+"""
+Imports and setup.
+"""
+from proteomics import db
+from proteomics.models import (Taxon, TaxonDigest)
+from proteomics.services import columnar_export
+import argparse
+import logging
+
+
+"""
+Process arguments.
+"""
+argparser = argparse.ArgumentParser(description=(
+    'Export peptides and taxon digest peptides to columnar files.'))
+argparser.add_argument('--output-dir', required=True, help=(
+    'Output directory. Columnar files will be written to this directory.'))
+argparser.add_argument('--format', default='parquet',
+                       choices=sorted(columnar_export.FORMATS.keys()),
+                       help=(
+                           "File format. 'parquet': compressed,"
+                           " dictionary-encoded Parquet files. 'arrow':"
+                           " uncompressed Arrow IPC files, which can be"
+                           " memory-mapped. Default: parquet."
+                       ))
+argparser.add_argument('--taxon-ids', nargs='*', help=(
+    'List of taxon IDs whose taxon digests to export. Default: all taxons.'))
+argparser.add_argument('--batch-size', type=int, default=int(1e5), help=(
+    'Number of rows to read from the db and write at a time.'
+    ' Default: 100000.'))
+
+"""
+Main method.
+"""
+def main():
+    args = argparser.parse_args()
+
+    logger = logging.getLogger('export_columnar')
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    session = db.get_session()
+
+    # Get the TaxonDigests.
+    q = session.query(TaxonDigest).join(Taxon)
+    if args.taxon_ids:
+        q = q.filter(Taxon.id.in_(args.taxon_ids))
+    taxon_digests = q.order_by(TaxonDigest.id).all()
+
+    try:
+        columnar_export.export_columnar(
+            session, args.output_dir, taxon_digests, format=args.format,
+            batch_size=args.batch_size, logger=logger)
+    except ImportError as e:
+        argparser.error(str(e))
+
+    logger.info("Done.")
+
+if __name__ == '__main__':
+    main()
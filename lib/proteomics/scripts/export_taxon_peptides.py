@@ -0,0 +1,90 @@
+"""
+name: export_taxon_peptides.py
+
+usage: export_taxon_peptides.py --taxon-id=taxon_id
+    [--sharing=unique|shared|all] [--output-file=output_file]
+
+description: This script exports the peptides in a taxon's digestion with the
+default digest, optionally filtered to peptides which are unique to the taxon
+or shared with other taxons in the db.
+
+Outputs: a CSV document whose rows contain:
+    peptide_sequence | taxon_count
+where taxon_count is the number of taxons whose digestion contains the
+peptide.
+
+Assumptions:
+    - The redundancy db has already been created and is readable.
+"""
+
+"""
+Imports and setup.
+"""
+from proteomics import config
+from proteomics import db
+from proteomics.models import (Taxon, TaxonDigest)
+from proteomics.services import peptide_taxon_count
+from proteomics.scripts.generate_redundancy_tables import get_digest
+import argparse
+import logging
+import csv
+import sys
+
+
+"""
+Process arguments.
+"""
+argparser = argparse.ArgumentParser(description=(
+    'Export the peptides in a taxon digest.'))
+argparser.add_argument('--taxon-id', required=True, help='Taxon ID')
+argparser.add_argument('--sharing', default='unique',
+                       choices=['unique', 'shared', 'all'],
+                       help=(
+                           "Which peptides to export. 'unique': peptides"
+                           " which are only in this taxon. 'shared':"
+                           " peptides which are also in other taxons."
+                           " 'all': all peptides. Default: unique."
+                       ))
+argparser.add_argument('--output-file', help=(
+    'Output CSV file. Default: stdout.'))
+
+"""
+Main method.
+"""
+def main():
+    args = argparser.parse_args()
+
+    logger = logging.getLogger('export_taxon_peptides')
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+    session = db.get_session()
+
+    # Get the TaxonDigest.
+    digest = get_digest(logger, config.DEFAULT_DIGEST_DEFINITION, session)
+    taxon_digest = (
+        session.query(TaxonDigest)
+        .filter(TaxonDigest.digest == digest)
+        .join(Taxon)
+        .filter(Taxon.id == args.taxon_id)
+    ).first()
+    if not taxon_digest:
+        raise Exception("No digest exists for taxon '%s'." % args.taxon_id)
+
+    if args.output_file:
+        output_file = open(args.output_file, 'wb')
+    else:
+        output_file = sys.stdout
+    try:
+        w = csv.writer(output_file)
+        w.writerow(['peptide', 'taxon_count'])
+        for peptide_id, sequence, taxon_count in \
+                peptide_taxon_count.get_taxon_digest_peptides(
+                    session, taxon_digest, sharing=args.sharing):
+            w.writerow([sequence, taxon_count])
+    finally:
+        if args.output_file:
+            output_file.close()
+
+if __name__ == '__main__':
+    main()
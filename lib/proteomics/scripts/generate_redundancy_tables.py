@@ -22,6 +22,7 @@ from proteomics.services import redundancy
 import argparse
 import logging
 import csv
+import gzip
 import os
 
 
@@ -40,6 +41,30 @@ argparser.add_argument('--taxon-ids', nargs='*', help=(
     ' --taxons-file option.'))
 argparser.add_argument('--output-dir', required=True, help=(
     'Output directory. CSV tables will be written to this directory.'))
+argparser.add_argument('--gzip', action='store_true', help=(
+    "Write gzipped CSV tables, e.g. 'intersection_counts.csv.gz'."))
+argparser.add_argument('--engine', default='sparse',
+                       choices=sorted(redundancy.COUNTERS.keys()),
+                       help=(
+                           "How peptides are counted. 'sparse' counts all"
+                           " pairs of taxons in a single pass over their"
+                           " peptides. 'bitmap' compares in-memory bitmaps"
+                           " of each taxon's peptide ids. 'sql' runs"
+                           " aggregate queries for each pair of taxons."
+                           " 'minhash' estimates counts from sketches of"
+                           " each taxon's peptides, for large sets of taxons."
+                           " Default: sparse."
+                       ))
+argparser.add_argument('--num-workers', type=int, default=1, help=(
+    "Number of processes to count pairs of taxons in, for the 'sql' engine."
+    " Default: 1."))
+argparser.add_argument('--sharing-tables', action='store_true', help=(
+    "Also generate the sharing_histogram and exclusive_intersection_counts"
+    " tables. These are counted exactly with a pass over all of the taxons'"
+    " peptides, even with the 'minhash' engine."))
+argparser.add_argument('--exact-pairs', nargs='*', default=[], help=(
+    "Pairs of taxon IDs to count exactly when using the 'minhash' engine,"
+    " as comma-separated 'taxon1,taxon2' values."))
 
 """
 Main method.
@@ -55,6 +80,10 @@ def main():
     if not (args.taxon_ids or args.taxon_id_file):
         raise Exception("Must provide --taxon-ids or --taxon-id-file option")
 
+    if args.exact_pairs and args.engine != 'minhash':
+        argparser.error("--exact-pairs can only be used with"
+                        " '--engine minhash'")
+
     session = db.get_session()
 
     # Get taxons.
@@ -75,22 +104,50 @@ def main():
         .filter(Taxon.id.in_(taxon_ids))
     ).all()
 
-    # Generate the redundancy tables.
-    tables = redundancy.generate_redundancy_tables(
-        session, taxon_digests, logger=logger)
+    # Get pairs of TaxonDigests to count exactly.
+    taxon_digests_by_taxon_id = dict(
+        [(td.taxon.id, td) for td in taxon_digests])
+    exact_pairs = []
+    for pair in args.exact_pairs:
+        pair_taxon_ids = pair.split(',')
+        if len(pair_taxon_ids) != 2:
+            argparser.error("Exact pairs must be of the form"
+                            " 'taxon1,taxon2', got '%s'" % pair)
+        for taxon_id in pair_taxon_ids:
+            if taxon_id not in taxon_digests_by_taxon_id:
+                argparser.error("Exact pair taxon '%s' is not one of the"
+                                " selected taxons" % taxon_id)
+        exact_pairs.append([taxon_digests_by_taxon_id[taxon_id]
+                            for taxon_id in pair_taxon_ids])
 
     # Create output dir if it does not exist.
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
-    # Output tables.
-    for table_id, table in tables.items():
-        table_file = os.path.join(args.output_dir, table_id + '.csv')
+    # Open a writer for each table.
+    sharing_tables = args.sharing_tables
+    files = {}
+    writers = {}
+    for table_id in redundancy.get_table_ids(sharing_tables):
+        if args.gzip:
+            table_file = os.path.join(args.output_dir, table_id + '.csv.gz')
+            files[table_id] = gzip.open(table_file, 'wb')
+        else:
+            table_file = os.path.join(args.output_dir, table_id + '.csv')
+            files[table_id] = open(table_file, 'wb')
         logger.info("Writing '%s'..." % table_file)
-        with open(table_file, 'wb') as f:
-            w = csv.writer(f)
-            for row in table:
-                w.writerow(row)
+        writers[table_id] = csv.writer(files[table_id])
+
+    # Generate the redundancy tables, writing rows as they are counted.
+    try:
+        for table_id, row in redundancy.generate_redundancy_rows(
+            session, taxon_digests, logger=logger, engine=args.engine,
+            exact_pairs=exact_pairs, num_workers=args.num_workers,
+            sharing_tables=sharing_tables):
+            writers[table_id].writerow(row)
+    finally:
+        for f in files.values():
+            f.close()
 
     logger.info("Done.")
 
@@ -1,7 +1,9 @@
 """
 name: query_by_sequence.py
 
-usage: query_by_sequence.py [--max-distance=0] sequence_file 
+usage: query_by_sequence.py [--max-distance=0] [--metric=levenshtein]
+    [--engine=engine]
+    [--sequence=sequence | --sequence-file=sequence_file]
 
 commissioned by : Dr. Makoto Saito, 2013-03
 
@@ -11,7 +13,7 @@ description: This script queries a peptides database for the given set of
 peptide sequences.
 
 Outputs: a CSV document to stdout whose rows contains:
-    query_sequence | taxon_id | levenshtein_distance | match_sequence
+    query_sequence | taxon_id | distance | match_sequence
 """
 
 """
@@ -19,11 +21,10 @@ Imports and setup.
 """
 from proteomics import db
 from proteomics import config
-from proteomics.models import (Peptide, TaxonDigestPeptide, TaxonDigest)
+from proteomics.services import query_by_sequence
 import argparse
 import logging
 import os
-from sqlalchemy.sql import func
 
 """
 Process arguments.
@@ -32,13 +33,41 @@ argparser = argparse.ArgumentParser(description=(
     'Query database for peptide sequences'))
 argparser.add_argument('--max-distance', type=int, nargs='?', default=0,
                        help=(
-                           'List of FASTA files containing protein sequences.'
+                           'Maximum distance between a query sequence and a'
+                           ' matching peptide. Default: 0.'
+                       ))
+argparser.add_argument('--metric', default='levenshtein',
+                       choices=['levenshtein', 'hamming'],
+                       help=(
+                           "Distance metric. 'levenshtein' counts"
+                           " substitutions, insertions and deletions."
+                           " 'hamming' only counts substitutions, so matches"
+                           " have the same length as the query."
+                           " Default: levenshtein."
                        ))
 argparser.add_argument('--sequence-file', help=(
     'File containing one amino acid sequence per line.'))
 
 argparser.add_argument('--sequence', help='Amino acid sequence')
 
+argparser.add_argument('--engine',
+                       choices=sorted(query_by_sequence.ENGINES.keys()),
+                       help=(
+                           "Search engine. 'bucket' compares each query"
+                           " with peptides of similar length and amino acid"
+                           " composition. 'batch' matches all queries in a"
+                           " single pass over the peptide table. 'scan'"
+                           " compares each query with every peptide."
+                           " 'bktree' searches a BK-tree index, which is"
+                           " built on first use and saved in the index dir."
+                           " 'qgram' searches a q-gram inverted index, also"
+                           " saved in the index dir. 'hamming' searches an"
+                           " index of peptide segments, for the hamming"
+                           " metric. Default: 'hamming' for the hamming"
+                           " metric, otherwise 'batch' for multiple"
+                           " sequences and 'bucket' for one sequence."
+                       ))
+
 """
 Main method.
 """
@@ -49,29 +78,7 @@ def main():
     logger.addHandler(logging.StreamHandler())
     logger.setLevel(logging.INFO)
 
-    # Define levenshtein function in SQLite.
-    try:
-        def levenshtein(s1,s2):
-            l1 = len(s1)
-            l2 = len(s2)
-            matrix = [range(l1 + 1)] * (l2 + 1)
-            for zz in range(l2 + 1):
-              matrix[zz] = range(zz,zz + l1 + 1)
-            for zz in range(0,l2):
-              for sz in range(0,l1):
-                if s1[sz] == s2[zz]:
-                  matrix[zz+1][sz+1] = min(matrix[zz+1][sz] + 1, matrix[zz][sz+1] + 1, matrix[zz][sz])
-                else:
-                  matrix[zz+1][sz+1] = min(matrix[zz+1][sz] + 1, matrix[zz][sz+1] + 1, matrix[zz][sz] + 1)
-            return matrix[l2][l1]
-
-        connection = db.get_connection()
-        connection.connection.create_function("LEVENSHTEIN", 2, levenshtein)
-    except Exception as e:
-        logger.exception('Could not define Levenshtein distance function: %s' % e)
-        raise e
-
-    session = db.get_session(bind=connection)
+    session = db.get_session()
 
     # Read in sequences to query.
     sequences = []
@@ -85,22 +92,42 @@ def main():
         argparser.error("Provide a query sequence via the '--sequence' option, "
                         "or a set of sequences via the --sequence-file option")
 
+    engine_id = args.engine
+    if not engine_id:
+        if args.metric == 'hamming':
+            engine_id = 'hamming'
+        elif len(sequences) > 1:
+            engine_id = 'batch'
+        else:
+            engine_id = 'bucket'
+    engine_class = query_by_sequence.ENGINES[engine_id]
+    if args.metric != 'hamming' and engine_class.metric == 'hamming':
+        argparser.error("The '%s' engine can only be used with"
+                        " '--metric hamming'" % engine_id)
+
+    # Exact queries are looked up directly, without a search engine.
+    if args.max_distance == 0:
+        engine = None
+        if args.engine:
+            logger.info("Exact query (max distance 0), looking up sequences"
+                        " directly instead of using the '%s' engine" % (
+                            args.engine))
+    else:
+        engine = engine_class(session, logger=logger)
+
     # Print headers. 
-    headers = ['query', 'taxon', 'lev_distance', 'match']
+    if args.metric == 'hamming':
+        distance_header = 'hamming_distance'
+    else:
+        distance_header = 'lev_distance'
+    headers = ['query', 'taxon', distance_header, 'match']
     print ','.join(headers)
 
     # Execute query for each sequence and print results.
-    for seq in sequences:
-        lev_dist = func.LEVENSHTEIN(Peptide.sequence, seq)
-        q = (session.query(TaxonDigest.taxon_id, lev_dist,
-                           Peptide.sequence)
-             .select_from(Peptide)
-             .join(TaxonDigestPeptide)
-             .join(TaxonDigest)
-             .filter(lev_dist <= args.max_distance)
-            )
-        for row in q:
-            print ','.join([str(s) for s in [seq] + list(row)])
+    for row in query_by_sequence.query_by_sequence(
+        session, sequences, max_distance=args.max_distance, engine=engine,
+        metric=args.metric):
+        print ','.join([str(s) for s in row])
 
 if __name__ == '__main__':
     main()
@@ -4,6 +4,10 @@ from proteomics.models import (Taxon, Protein,
                                TaxonDigest, Digest, Protease)
 from proteomics import db
 from proteomics.util.logging_util import LoggerLogHandler
+from proteomics.services.taxon_digest_bitmap import delete_taxon_digest_bitmap
+from proteomics.services.taxon_digest_sketch import delete_taxon_digest_sketch
+from proteomics.services.redundancy_cache import delete_taxon_digest_cache
+from proteomics.services import peptide_taxon_count
 import os
 import logging
 from sqlalchemy.orm import sessionmaker
@@ -45,13 +49,20 @@ class ClearTaxonDataTask(object):
             .filter(Taxon.id == taxon.id)
         )
 
-        # Delete TaxonDigestPeptides and TaxonDigests
+        # Decrement PeptideTaxonCounts, and delete TaxonDigestPeptides,
+        # TaxonDigestBitmaps, TaxonDigestSketches, cached redundancy counts
+        # and TaxonDigests
         for td in taxon_digests:
+            peptide_taxon_count.remove_taxon_digest_peptides(
+                self.session, td)
             (
                 self.session.query(TaxonDigestPeptide)
                 .filter(TaxonDigestPeptide.taxon_digest_id == td.id)
                 .delete()
             )
+            delete_taxon_digest_bitmap(self.session, td.id)
+            delete_taxon_digest_sketch(self.session, td.id)
+            delete_taxon_digest_cache(self.session, td.id)
             self.session.delete(td)
 
         # Delete TaxonProteins.
@@ -0,0 +1,179 @@
+"""
+Export peptide and taxon digest peptide data to columnar files, which can be
+memory-mapped and scanned without going through the db.
+
+Files are written in Parquet or Arrow IPC ('arrow') format:
+    peptides.<ext>: id | sequence | mass, sorted by id.
+    taxon_digest_peptides/digest_id=<digest id>/taxon_id=<taxon id>/
+        part-0.<ext>: taxon_id | peptide_id | count, sorted by peptide_id.
+The taxon digest peptide files are partitioned by digest and taxon in the
+'key=value' directory layout, so readers such as pyarrow.dataset can recover
+the digest and taxon ids from the paths.
+
+Low-cardinality columns, i.e. taxon_id, have dictionary types, and are
+dictionary-encoded in both formats. Other columns, such as the unique peptide
+ids and sequences, are written without dictionaries. Because the taxon_id
+column is a dictionary of strings, partitioned readers must infer partition
+keys as dictionaries too, e.g. pyarrow.parquet.read_table, or
+pyarrow.dataset with HivePartitioning.discover(infer_dictionary=True).
+
+Requires pyarrow, which is only imported when a file is written.
+"""
+from proteomics.models import (Peptide, TaxonDigest, TaxonDigestPeptide)
+from proteomics import db
+import logging
+import os
+
+
+FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+def get_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Columnar exports require pyarrow, install it with"
+                          " 'pip install pyarrow'")
+    return pyarrow
+
+def get_peptide_schema():
+    pa = get_pyarrow()
+    return pa.schema([
+        pa.field('id', pa.int64()),
+        pa.field('sequence', pa.string()),
+        pa.field('mass', pa.float64()),
+    ])
+
+def get_taxon_digest_peptide_schema():
+    pa = get_pyarrow()
+    return pa.schema([
+        pa.field('taxon_id', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('peptide_id', pa.int64()),
+        pa.field('count', pa.int32()),
+    ])
+
+def get_peptide_batches(session, batch_size=int(1e5)):
+    """ Yields [ids, sequences, masses] column lists for batches of
+    peptides, in id order. """
+    q = session.query(Peptide.id, Peptide.sequence, Peptide.mass)
+    return get_column_batches(
+        db.get_keyset_batched_results(q, Peptide.id, batch_size), 3,
+        batch_size)
+
+def get_taxon_digest_peptide_batches(session, taxon_digest,
+                                     batch_size=int(1e5)):
+    """ Yields [taxon_ids, peptide_ids, counts] column lists for batches of a
+    taxon digest's peptides, in peptide id order. """
+    q = (
+        session.query(TaxonDigest.taxon_id, TaxonDigestPeptide.peptide_id,
+                      TaxonDigestPeptide.count)
+        .select_from(TaxonDigestPeptide)
+        .join(TaxonDigest)
+        .filter(TaxonDigestPeptide.taxon_digest_id == taxon_digest.id)
+    )
+    return get_column_batches(
+        db.get_keyset_batched_results(
+            q, TaxonDigestPeptide.peptide_id, batch_size),
+        3, batch_size)
+
+def get_column_batches(rows, num_columns, batch_size):
+    """ Transpose rows into batches of column lists. """
+    columns = [[] for i in range(num_columns)]
+    for row in rows:
+        for i in range(num_columns):
+            columns[i].append(row[i])
+        if len(columns[0]) >= batch_size:
+            yield columns
+            columns = [[] for i in range(num_columns)]
+    if columns[0]:
+        yield columns
+
+def get_array(column, field):
+    """ Get an array of a column's values. Columns of dictionary-typed
+    fields are dictionary-encoded, with values in order of first
+    occurrence. """
+    pa = get_pyarrow()
+    if not pa.types.is_dictionary(field.type):
+        return pa.array(column, type=field.type)
+    codes = {}
+    indices = [codes.setdefault(value, len(codes)) for value in column]
+    values = sorted(codes.keys(), key=codes.get)
+    return pa.DictionaryArray.from_arrays(
+        pa.array(indices, type=field.type.index_type),
+        pa.array(values, type=field.type.value_type))
+
+def get_dictionary_field_names(schema):
+    pa = get_pyarrow()
+    return [field.name for field in schema
+            if pa.types.is_dictionary(field.type)]
+
+def get_taxon_digest_path(output_dir, taxon_digest, format='parquet'):
+    return os.path.join(
+        output_dir, 'taxon_digest_peptides',
+        'digest_id=%s' % taxon_digest.digest.id,
+        'taxon_id=%s' % taxon_digest.taxon.id,
+        'part-0' + FORMATS[format])
+
+def write_columnar_file(path, schema, batches, format='parquet'):
+    """ Write batches of column lists to a columnar file. The file is written
+    to a temporary path and then moved into place, so readers never see a
+    partial file. Returns the number of rows written. """
+    pa = get_pyarrow()
+    dir_path = os.path.dirname(path)
+    if dir_path and not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    tmp_path = path + '.tmp'
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(
+            tmp_path, schema,
+            use_dictionary=get_dictionary_field_names(schema))
+        sink = None
+        def write_batch(batch):
+            writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        sink = pa.OSFile(tmp_path, 'wb')
+        writer = pa.RecordBatchFileWriter(sink, schema)
+        write_batch = writer.write_batch
+    num_rows = 0
+    try:
+        for columns in batches:
+            arrays = [get_array(column, field)
+                      for column, field in zip(columns, schema)]
+            write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            num_rows += len(columns[0])
+    finally:
+        writer.close()
+        if sink is not None:
+            sink.close()
+    os.rename(tmp_path, path)
+    return num_rows
+
+def export_columnar(session, output_dir, taxon_digests, format='parquet',
+                    batch_size=int(1e5), logger=None):
+    """ Export the peptide table, and the peptides of each of the given
+    taxon digests, to columnar files in output_dir. """
+    if not logger:
+        logger = logging.getLogger()
+    if format not in FORMATS:
+        raise ValueError("Unknown format '%s', expected one of %s" % (
+            format, sorted(FORMATS.keys())))
+    get_pyarrow()
+
+    peptides_path = os.path.join(output_dir, 'peptides' + FORMATS[format])
+    logger.info("Writing '%s'..." % peptides_path)
+    num_peptides = write_columnar_file(
+        peptides_path, get_peptide_schema(),
+        get_peptide_batches(session, batch_size), format=format)
+    logger.info("Wrote %s peptides" % num_peptides)
+
+    for taxon_digest in taxon_digests:
+        path = get_taxon_digest_path(output_dir, taxon_digest, format=format)
+        logger.info("Writing '%s'..." % path)
+        write_columnar_file(
+            path, get_taxon_digest_peptide_schema(),
+            get_taxon_digest_peptide_batches(
+                session, taxon_digest, batch_size),
+            format=format)
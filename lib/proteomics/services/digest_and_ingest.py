@@ -1,26 +1,92 @@
 from proteomics.models import (Taxon, Protein, 
-                               TaxonProtein, ProteinDigest, Peptide, 
+                               ProteinDigest, Peptide, 
                                ProteinDigestPeptide, TaxonDigestPeptide, 
-                               TaxonDigest, Digest, Protease)
+                               TaxonDigest, Protease)
 from proteomics import db
-from proteomics.util.digest import cleave
+from proteomics.util.digest import get_cleaver
 from proteomics.util.logging_util import LoggerLogHandler
-from proteomics.util.mass import get_aa_sequence_mass
+from proteomics.util.mass import get_prefix_masses, get_span_mass
+from proteomics.util.sequence_hash import get_sequence_hash
 from proteomics.util import fasta
+from proteomics.services.peptide_id_cache import PeptideIdCache
+from proteomics.services.taxon_digest_bitmap import save_taxon_digest_bitmap
+from proteomics.services.taxon_digest_sketch import save_taxon_digest_sketch
+from proteomics.services.redundancy_cache import set_taxon_digest_generation
+from proteomics.services import peptide_taxon_count
 import os
+import gzip
 import hashlib
 import logging
+import multiprocessing
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
-from collections import defaultdict
+from collections import defaultdict, deque
+
+
+def digest_protein_batch(batch, cleavage_rule=None, max_missed_cleavages=0,
+                         min_acids=None, max_acids=None):
+    """ Cleave a batch of (metadata, sequence) protein records.
+    Returns one dict per record, containing the protein's mass, a histogram
+    of its peptide sequences, and the masses of those peptides.
+    This function does not touch the db, so that it can be run in worker
+    processes.
+    """
+    cleaver = get_cleaver(cleavage_rule, max_missed_cleavages, 
+                          min_acids=min_acids, max_acids=max_acids)
+    digested_batch = []
+    for metadata, sequence in batch:
+        record = {
+            'metadata': metadata,
+            'sequence': sequence,
+            'sequence_hash': get_sequence_hash(sequence),
+            'mass': None,
+            'error': None,
+            'peptide_histogram': {},
+            'peptide_masses': {},
+        }
+        digested_batch.append(record)
+        try:
+            prefix_masses = get_prefix_masses(sequence)
+        except Exception as e:
+            record['error'] = "%s: %s" % (e.__class__.__name__, e)
+            continue
+        record['mass'] = get_span_mass(prefix_masses, 0, len(sequence))
+        # Peptide masses are computed from the protein's prefix masses.
+        peptide_histogram = defaultdict(int)
+        peptide_masses = record['peptide_masses']
+        for start, end in cleaver.get_peptide_spans(sequence):
+            peptide_sequence = sequence[start:end]
+            peptide_histogram[peptide_sequence] += 1
+            if peptide_sequence not in peptide_masses:
+                peptide_masses[peptide_sequence] = get_span_mass(
+                    prefix_masses, start, end)
+        record['peptide_histogram'] = dict(peptide_histogram)
+    return digested_batch
 
 
 class DigestAndIngestTask(object):
     def __init__(self, logger=logging.getLogger(), fasta_paths=[], 
-                 digest=None, get_connection=None, **kwargs):
+                 digest=None, get_connection=None, num_workers=1, 
+                 peptide_id_cache=None, bulk_load=False, defer_indexes=False,
+                 **kwargs):
         self.logger = logger
         self.fasta_paths = fasta_paths
         self.digest = digest
+        # The peptide id cache can be shared between tasks which use the
+        # same db. If none is given, one will be created and warmed from
+        # the db when the task runs.
+        self.peptide_id_cache = peptide_id_cache
+        # If bulk_load is True, durability settings are relaxed while the
+        # task runs. See db.bulk_load_mode.
+        self.bulk_load = bulk_load
+        # If defer_indexes is True, indexes which ingest does not use itself
+        # are dropped while the task runs, and rebuilt at the end. This
+        # is much faster for initial loads of large amounts of data.
+        self.defer_indexes = defer_indexes
+        # If num_workers > 1, cleavage and mass calculations are done by a
+        # pool of worker processes. The task's own process is the only
+        # one that writes to the db.
+        self.num_workers = num_workers
 
         # Assign get_connection function.
         if not get_connection:
@@ -31,26 +97,87 @@ class DigestAndIngestTask(object):
 
     def run(self):
         # Get session.
-        self.session = db.get_session(bind=self.get_connection())
+        self.connection = self.get_connection()
+        self.session = db.get_session(bind=self.connection)
+
+        # Upgrade dbs created by earlier versions before reading or writing
+        # anything. This also adds compositions for peptides which were
+        # ingested without them, so that new peptides' compositions don't
+        # hide them from db.add_peptide_compositions.
+        db.upgrade_db(bind=self.session.connection())
+        self.session.commit()
         self.digest = self.session.merge(self.digest)
 
+        # Initialize peptide id cache.
+        if not self.peptide_id_cache:
+            self.peptide_id_cache = PeptideIdCache()
+            num_cached = self.peptide_id_cache.warm(self.session)
+            self.logger.info("Cached ids for %s existing peptides" % (
+                num_cached))
+
         # Initialize stats dict.
         self.stats = defaultdict(int)
 
+        # Start worker pool if using multiple workers.
+        self.pool = None
+        if self.num_workers > 1:
+            self.pool = multiprocessing.Pool(self.num_workers)
+
+        # Drop deferrable indexes, or restore indexes which were left
+        # dropped by an interrupted run.
+        if self.defer_indexes:
+            dropped_indexes = db.drop_deferrable_indexes(bind=self.connection)
+            self.session.commit()
+            self.logger.info("Dropped %s indexes, will rebuild at end." % (
+                len(dropped_indexes)))
+        else:
+            self.ensure_indexes()
+
         # Process FASTA files.
-        for path in self.fasta_paths:
-            self.process_fasta_file(path)
+        try:
+            if self.bulk_load:
+                self.logger.info("Using bulk load mode.")
+                with db.bulk_load_mode(self.connection):
+                    self.process_fasta_files()
+            else:
+                self.process_fasta_files()
+        except:
+            # Don't wait for queued batches to be digested.
+            if self.pool:
+                self.pool.terminate()
+            raise
+        else:
+            if self.pool:
+                self.pool.close()
+        finally:
+            if self.pool:
+                self.pool.join()
+            if self.defer_indexes:
+                self.session.rollback()
+                self.ensure_indexes()
 
         self.logger.info("Digest and ingest task complete.")
         return self.stats
 
+    def ensure_indexes(self):
+        created_indexes = db.ensure_indexes(bind=self.connection)
+        self.session.commit()
+        if created_indexes:
+            self.logger.info("Built indexes: %s" % (
+                ', '.join([index.name for index in created_indexes])))
+
+    def process_fasta_files(self):
+        for path in self.fasta_paths:
+            self.process_fasta_file(path)
+        self.session.commit()
+
     def process_fasta_file(self, path):
         base_msg = "Processing file '%s'..." % path
         file_logger = self.get_child_logger(id(path), base_msg,
                                             self.logger)
 
         # Get taxon from filename.
-        taxon_id = os.path.splitext(os.path.basename(path))[0]
+        taxon_id = self.get_taxon_id(path)
 
         # Get taxon object from db or create a new one.
         taxon = self.session.query(Taxon).get(taxon_id)
@@ -83,69 +210,78 @@ class DigestAndIngestTask(object):
             self.session.commit()
             self.stats['TaxonDigest'] += 1
 
-        # Process protein sequences in batches.
-        file_logger.info("Counting # of protein sequences...")
-        num_proteins = 0
-        for metadata, sequence in fasta.read(path):
-            num_proteins += 1
-        file_logger.info("%s total protein sequences." % num_proteins)
+        # Process protein sequences in batches, in a single pass over the
+        # file. Progress is estimated from the position in the (possibly
+        # compressed) file, so that we don't need to count proteins first.
+        file_size = os.path.getsize(path)
+        self.taxon_peptide_counts = defaultdict(int)
         batch_size = 500
         batch_counter = 0
-        batch = []
         protein_logger = self.get_child_logger(
             "%s_proteins" % id(file_logger), "Processing proteins...",
             file_logger
         )
         protein_logger.info("")
-        for metadata, sequence in fasta.read(path):
-            batch.append((metadata, sequence,))
-            batch_counter += 1
-            if (batch_counter % batch_size) == 0:
+        with open(path, 'rb') as raw_file:
+            if self.is_gzipped(path):
+                fasta_file = gzip.GzipFile(fileobj=raw_file)
+            else:
+                fasta_file = raw_file
+            protein_batches = self.get_protein_batches(
+                fasta.read(fasta_file), batch_size)
+            for batch in self.digest_protein_batches(protein_batches):
                 self.process_protein_batch(
                     batch, taxon, logger=protein_logger)
+                batch_counter += len(batch)
+                if file_size:
+                    pct_read = min(100.0, 100.0 * raw_file.tell()/file_size)
+                else:
+                    pct_read = 100.0
                 protein_logger.info(
-                    ("%s of %s (%.1f%%)") % (
-                        batch_counter, num_proteins, 
-                        100.0 * batch_counter/num_proteins
-                    )
-                )
-                batch = []
-        self.process_protein_batch(
-            batch, taxon, logger=protein_logger)
+                    ("%s proteins, ~%.1f%% of file") % (
+                        batch_counter, pct_read))
 
-        # Generate TaxonDigestPeptides
-        q = (
-            self.session.query(
-                Peptide.id, 
-                func.sum(ProteinDigestPeptide.count)
-            )
-            .select_from(Peptide)
-            .join(ProteinDigestPeptide)
-            .join(ProteinDigest)
-            .join(Digest)
-            .join(Protein)
-            .join(TaxonProtein)
-            .join(Taxon)
-            .filter(Taxon.id == taxon.id)
-            .filter(Digest.id == self.digest.id)
-            .group_by(Peptide.id)
-        )
-        batch_size = 1e4
+        # Generate TaxonDigestPeptides from the peptide counts which were
+        # accumulated while processing proteins.
+        batch_size = int(1e4)
         tdp_batch = []
-        tdp_counter = 0
-        for row in db.get_batched_results(q, batch_size):
-            tdp_counter += 1
-            tdp_batch.append(row)
-            if (tdp_counter % batch_size) == 0:
+        for peptide_id, count in self.taxon_peptide_counts.iteritems():
+            tdp_batch.append((peptide_id, count,))
+            if len(tdp_batch) == batch_size:
                 self.process_taxon_digest_peptide_batch(
                     taxon_digest, tdp_batch, logger=file_logger)
                 tdp_batch = []
         self.process_taxon_digest_peptide_batch(
             taxon_digest, tdp_batch, logger=file_logger)
-        self.stats['TaxonDigestPeptide'] += tdp_counter
+        self.stats['TaxonDigestPeptide'] += len(self.taxon_peptide_counts)
+
+        # Save the taxon digest's peptide bitmap and sketches, for
+        # redundancy analysis.
+        save_taxon_digest_bitmap(self.session, taxon_digest.id,
+                                 self.taxon_peptide_counts.iterkeys())
+        save_taxon_digest_sketch(self.session, taxon_digest.id,
+                                 self.taxon_peptide_counts.iterkeys())
+        set_taxon_digest_generation(self.session, taxon_digest.id)
+
+        # Update the number of taxons which contain each peptide.
+        peptide_taxon_count.add_taxon_digest_peptides(
+            self.session, taxon_digest, self.taxon_peptide_counts.iterkeys())
+        self.session.commit()
+        self.taxon_peptide_counts = None
 
         self.logger.info("Done processing file '%s'" % path)
 
+    def is_gzipped(self, path):
+        return path.endswith('.gz')
+
+    def get_taxon_id(self, path):
+        """ Get a taxon id from a FASTA file name, e.g. 'syn5802.fasta' or
+        'syn5802.fasta.gz' -> 'syn5802'. """
+        basename = os.path.basename(path)
+        if self.is_gzipped(basename):
+            basename = os.path.splitext(basename)[0]
+        return os.path.splitext(basename)[0]
+
     def get_checksum(self, path):
         sha1 = hashlib.sha1()
         with open(path, 'rb') as f:
@@ -155,21 +291,62 @@ class DigestAndIngestTask(object):
                 sha1.update(data)
         return sha1.hexdigest()
 
+    def get_protein_batches(self, proteins, batch_size):
+        """ Group (metadata, sequence) records into lists. """
+        batch = []
+        for metadata, sequence in proteins:
+            batch.append((metadata, sequence,))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def digest_protein_batches(self, protein_batches):
+        """ Digest protein batches, in worker processes if a pool exists.
+        Batches are yielded in their original order. Only a limited number
+        of batches are submitted ahead of the writer, to bound memory use.
+        """
+        digest_kwargs = {
+            'cleavage_rule': self.digest.protease.cleavage_rule,
+            'max_missed_cleavages': self.digest.max_missed_cleavages,
+            'min_acids': self.digest.min_acids,
+            'max_acids': self.digest.max_acids,
+        }
+        if not self.pool:
+            for batch in protein_batches:
+                yield digest_protein_batch(batch, **digest_kwargs)
+            return
+        pending = deque()
+        for batch in protein_batches:
+            pending.append(self.pool.apply_async(
+                digest_protein_batch, (batch,), digest_kwargs))
+            if len(pending) >= 2 * self.num_workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
     def process_protein_batch(self, batch, taxon, logger=None):
-        """ Process a batch of proteins with the given digest. """
+        """ Process a batch of digested protein records, as returned by
+        digest_protein_batch. """
         if not batch:
             return
         if not logger:
             logger = self.logger
-        # Get existing proteins by searching for sequences.
+        # Get existing proteins by searching for sequence hashes.
         existing_proteins = {}
+        batch_sequences = set([record['sequence'] for record in batch])
+        colliding_hashes = set()
         for protein in (
             self.session.query(Protein)
-            .filter(Protein.sequence.in_(
-                [sequence for metadata, sequence in batch])
+            .filter(Protein.sequence_hash.in_(
+                [record['sequence_hash'] for record in batch])
             )
         ):
-            existing_proteins[protein.sequence] = protein
+            if protein.sequence in batch_sequences:
+                existing_proteins[protein.sequence] = protein
+            else:
+                colliding_hashes.add(protein.sequence_hash)
 
         # Initialize collection of undigested proteins.
         undigested_proteins = {}
@@ -190,14 +367,21 @@ class DigestAndIngestTask(object):
         # Create proteins which do not exist in the db and add to undigested
         # collection.
         num_new_proteins = 0
-        for metadata, sequence in batch:
+        records_by_sequence = {}
+        for record in batch:
+            sequence = record['sequence']
+            records_by_sequence[sequence] = record
             if sequence not in existing_proteins:
-                try:
-                    mass = get_aa_sequence_mass(sequence)
-                    protein = Protein(sequence=sequence, mass=mass)
-                except Exception as e:
-                    logger.exception("Error processing protein, skipping")
+                if record['error']:
+                    logger.error("Error processing protein, skipping: %s" % (
+                        record['error']))
                     continue
+                if record['sequence_hash'] in colliding_hashes:
+                    logger.error("Protein sequence hash collides with an"
+                                 " existing protein, skipping")
+                    continue
+                protein = Protein(sequence=sequence, mass=record['mass'],
+                                  sequence_hash=record['sequence_hash'])
                 self.session.add(protein)
                 num_new_proteins += 1
                 undigested_proteins[sequence] = protein
@@ -214,30 +398,41 @@ class DigestAndIngestTask(object):
             undigested_batch = {}
             peptide_counter = 0
             protein_digests = []
+            peptide_id_histograms = {}
             for protein in undigested_proteins.values():
                 protein_digest = ProteinDigest(protein=protein, 
                                                digest=self.digest)
                 protein_digests.append(protein_digest)
-                peptide_sequences = cleave(
-                    protein.sequence, 
-                    self.digest.protease.cleavage_rule, 
-                    self.digest.max_missed_cleavages,
-                    min_acids=self.digest.min_acids,
-                    max_acids=self.digest.max_acids,
-                )
-                peptide_counter += len(peptide_sequences)
+                record = records_by_sequence[protein.sequence]
+                peptide_counter += len(record['peptide_histogram'])
                 undigested_batch[protein] = {
-                    'peptide_sequences': peptide_sequences,
+                    'peptide_histogram': record['peptide_histogram'],
+                    'peptide_masses': record['peptide_masses'],
                     'protein_digest': protein_digest,
                 }
                 if (peptide_counter > 1e4):
-                    self.process_peptide_batch(undigested_batch, logger)
+                    peptide_id_histograms.update(self.process_peptide_batch(
+                        undigested_batch, logger))
+                    undigested_batch = {}
                     peptide_counter = 0
-            self.process_peptide_batch(undigested_batch, logger)
+            peptide_id_histograms.update(self.process_peptide_batch(
+                undigested_batch, logger))
+        else:
+            peptide_id_histograms = {}
+
+        # Get peptide histograms for proteins which were digested before
+        # this batch, e.g. proteins shared with other taxons.
+        previously_digested_ids = [protein.id for protein in 
+                                   digested_proteins.values()]
+        for i in range(0, len(previously_digested_ids), 500):
+            peptide_id_histograms.update(self.get_peptide_id_histograms(
+                previously_digested_ids[i:i+500]))
 
         # Create taxon protein instances in bulk.
         taxon_protein_dicts = []
-        for metadata, sequence in batch:
+        for record in batch:
+            metadata = record['metadata']
+            sequence = record['sequence']
             try:
                 protein = existing_proteins[sequence]
             except Exception as e:
@@ -249,24 +444,34 @@ class DigestAndIngestTask(object):
                 'taxon_id': taxon.id,
                 'metadata': metadata,
             })
+            # Add the protein's peptides to the taxon's peptide counts.
+            for peptide_id, count in peptide_id_histograms.get(
+                sequence, {}).iteritems():
+                self.taxon_peptide_counts[peptide_id] += count
         logger.info("Creating %s new taxon proteins..." % (
             len(taxon_protein_dicts)))
-        self.session.execute(
-            db.tables['TaxonProtein'].insert(), taxon_protein_dicts)
-        self.session.commit()
+        if taxon_protein_dicts:
+            self.session.execute(
+                db.tables['TaxonProtein'].insert(), taxon_protein_dicts)
+            self.session.commit()
         self.stats['TaxonProtein'] += len(taxon_protein_dicts)
 
     def process_peptide_batch(self, batch, logger=None):
+        """ Create protein digests and peptides for a batch of digested
+        proteins. Returns a dict of peptide id histograms, keyed by protein
+        sequence. """
+        if not batch:
+            return {}
         if not logger:
             logger = self.logger
 
         # Assemble combined peptide sequences and protein digests.
-        combined_peptide_sequences = set()
+        combined_peptide_masses = {}
         combined_protein_digests = []
         for protein, data in batch.items():
-            for sequence in data['peptide_sequences']:
-                combined_peptide_sequences.add(sequence)
+            combined_peptide_masses.update(data['peptide_masses'])
             combined_protein_digests.append(data['protein_digest'])
+        combined_peptide_sequences = combined_peptide_masses.keys()
 
         # Add protein digests to db.
         logger.info("Creating %s new protein digests..." % (
@@ -275,70 +480,68 @@ class DigestAndIngestTask(object):
         self.session.commit()
         self.stats['ProteinDigest'] += len(combined_protein_digests)
 
-        # Get existing peptides.
-        existing_peptides = {}
-        existing_peptides_batch = []
-        existing_peptides_counter = 0
+        # Get ids for existing peptides, from the cache if possible.
+        peptide_ids = {}
+        uncached_sequences = []
         for sequence in combined_peptide_sequences:
-            existing_peptides_counter += 1
-            existing_peptides_batch.append(sequence)
-            if (existing_peptides_counter % 500) == 0:
-                self.update_existing_peptides_(
-                    existing_peptides_batch, existing_peptides)
-                existing_peptides_batch = []
-        self.update_existing_peptides_(
-            existing_peptides_batch, existing_peptides)
-
-        # Create non-existent peptides in bulk.
+            peptide_id = self.peptide_id_cache.get(sequence)
+            if peptide_id is None:
+                uncached_sequences.append(sequence)
+            else:
+                peptide_ids[sequence] = peptide_id
+        if not self.peptide_id_cache.complete:
+            for i in range(0, len(uncached_sequences), 500):
+                self.update_peptide_ids_(
+                    uncached_sequences[i:i+500], peptide_ids)
+
+        # Create non-existent peptides in bulk. Ids are assigned here,
+        # so that we don't need to read them back after inserting.
         num_new_peptides = 0
         peptide_dicts = []
-        for sequence in combined_peptide_sequences:
-            if sequence not in existing_peptides:
+        next_peptide_id = (
+            self.session.query(func.max(Peptide.id)).scalar() or 0) + 1
+        for sequence in uncached_sequences:
+            if sequence not in peptide_ids:
                 num_new_peptides += 1
-                mass = get_aa_sequence_mass(sequence)
                 peptide_dicts.append({
+                    'id': next_peptide_id,
                     'sequence': sequence,
-                    'mass': mass,
+                    'sequence_hash': get_sequence_hash(sequence),
+                    'mass': combined_peptide_masses[sequence],
                 })
+                peptide_ids[sequence] = next_peptide_id
+                self.peptide_id_cache.set(sequence, next_peptide_id)
+                next_peptide_id += 1
         logger.info("Creating %s new peptides..." % num_new_peptides)
-        self.session.execute(db.tables['Peptide'].insert(), peptide_dicts)
-        self.session.commit()
+        if peptide_dicts:
+            self.session.execute(db.tables['Peptide'].insert(), peptide_dicts)
+            self.session.execute(
+                db.tables['PeptideComposition'].insert(),
+                [db.get_peptide_composition_dict(
+                    peptide_dict['id'], peptide_dict['sequence'])
+                 for peptide_dict in peptide_dicts])
+            self.session.commit()
         self.stats['Peptide'] += num_new_peptides
 
-        # Get newly created peptide objects and add to existing peptides.
-        created_peptides_batch = []
-        created_peptides_counter = 0
-        for peptide_dict in peptide_dicts:
-            created_peptides_counter += 1
-            created_peptides_batch.append(peptide_dict['sequence'])
-            if (created_peptides_counter % 500) == 0:
-                self.update_existing_peptides_(created_peptides_batch, 
-                                               existing_peptides)
-                created_peptides_batch = []
-        self.update_existing_peptides_(
-            created_peptides_batch, existing_peptides)
-
-        # Create histogram of peptide sequence occurences for each protein.
+        # Count peptide instances.
         num_peptide_instances = 0
         for protein, data in batch.items():
-            peptides_histogram = defaultdict(int)
-            for sequence in data['peptide_sequences']: 
-                peptides_histogram[sequence] += 1
-            data['peptide_histogram'] = peptides_histogram
-            # Update number of peptide instances.
-            num_peptide_instances += len(peptides_histogram)
+            num_peptide_instances += len(data['peptide_histogram'])
 
         # Create protein digest peptide instances in bulk.
         logger.info("Creating %s new protein digest peptides..." % (
             num_peptide_instances))
         pdp_batch = []
         pdp_counter = 0
+        peptide_id_histograms = {}
         for protein, data in batch.items():
+            peptide_id_histogram = {}
+            peptide_id_histograms[protein.sequence] = peptide_id_histogram
             for sequence, count in data['peptide_histogram'].items():
                 pdp_counter += 1
-                peptide = existing_peptides[sequence]
+                peptide_id_histogram[peptide_ids[sequence]] = count
                 pdp_batch.append({
-                    'peptide_id': peptide.id,
+                    'peptide_id': peptide_ids[sequence],
                     'protein_digest_id': data['protein_digest'].id,
                     'count': count,
                 })
@@ -347,21 +550,56 @@ class DigestAndIngestTask(object):
                         db.tables['ProteinDigestPeptide'].insert(),
                         pdp_batch)
                     self.session.commit()
-        self.session.execute(
-            db.tables['ProteinDigestPeptide'].insert(), pdp_batch)
-        self.session.commit()
+                    pdp_batch = []
+        if pdp_batch:
+            self.session.execute(
+                db.tables['ProteinDigestPeptide'].insert(), pdp_batch)
+            self.session.commit()
         self.stats['ProteinDigestPeptide'] += num_peptide_instances
+        return peptide_id_histograms
+
+    def get_peptide_id_histograms(self, protein_ids):
+        """ Get peptide id histograms for already digested proteins, keyed
+        by protein sequence. """
+        peptide_id_histograms = defaultdict(dict)
+        q = (
+            self.session.query(
+                Protein.sequence,
+                ProteinDigestPeptide.peptide_id,
+                ProteinDigestPeptide.count
+            )
+            .select_from(ProteinDigestPeptide)
+            .join(ProteinDigest)
+            .join(Protein)
+            .filter(ProteinDigest.digest_id == self.digest.id)
+            .filter(Protein.id.in_(protein_ids))
+        )
+        for sequence, peptide_id, count in q:
+            peptide_id_histograms[sequence][peptide_id] = count
+        return peptide_id_histograms
 
-    def update_existing_peptides_(self, sequences, existing_peptides):
+    def update_peptide_ids_(self, sequences, peptide_ids):
         if not sequences:
             return
-        for peptide in (
-            self.session.query(Peptide).filter(Peptide.sequence.in_(sequences))
+        sequences_by_hash = dict([(get_sequence_hash(sequence), sequence) 
+                                  for sequence in sequences])
+        for sequence_hash, sequence, peptide_id in (
+            self.session.query(Peptide.sequence_hash, Peptide.sequence, 
+                               Peptide.id)
+            .filter(Peptide.sequence_hash.in_(sequences_by_hash.keys()))
         ):
-            existing_peptides[peptide.sequence] = peptide
+            if sequences_by_hash[sequence_hash] != sequence:
+                raise Exception(
+                    "Peptide sequence hash for '%s' collides with existing"
+                    " peptide '%s'" % (sequences_by_hash[sequence_hash],
+                                       sequence))
+            peptide_ids[sequence] = peptide_id
+            self.peptide_id_cache.set(sequence, peptide_id)
 
     def process_taxon_digest_peptide_batch(self, taxon_digest, batch, 
                                              logger=None):
+        if not batch:
+            return
         if not logger:
             logger = self.logger
         dicts = []
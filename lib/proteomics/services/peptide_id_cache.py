@@ -0,0 +1,65 @@
+from proteomics.models import Peptide
+from proteomics import config
+from proteomics import db
+
+
+class PeptideIdCache(object):
+    """ A bounded map of peptide sequences to peptide ids.
+
+    Entries are kept in two generations of plain dicts. Lookups that hit the
+    old generation are promoted to the new generation, and when the new
+    generation fills up the old one is dropped. This approximates a
+    least-recently-used cache without per-entry bookkeeping.
+
+    If the cache has been warmed with the entire peptide table and nothing
+    has been evicted since, the cache is 'complete': a miss means that the
+    peptide does not exist in the db. This assumes that the cache's owner
+    is the only writer of peptides.
+    """
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = config.PEPTIDE_ID_CACHE_SIZE
+        self.generation_size = max(1, int(max_size)/2)
+        self.new_ids = {}
+        self.old_ids = {}
+        self.complete = False
+
+    def __len__(self):
+        return len(self.new_ids) + len(self.old_ids)
+
+    def __contains__(self, sequence):
+        return sequence in self.new_ids or sequence in self.old_ids
+
+    def get(self, sequence):
+        peptide_id = self.new_ids.get(sequence)
+        if peptide_id is None:
+            peptide_id = self.old_ids.pop(sequence, None)
+            if peptide_id is not None:
+                self.set(sequence, peptide_id)
+        return peptide_id
+
+    def set(self, sequence, peptide_id):
+        if len(self.new_ids) >= self.generation_size:
+            if self.old_ids:
+                self.complete = False
+            self.old_ids = self.new_ids
+            self.new_ids = {}
+        self.new_ids[sequence] = peptide_id
+
+    def warm(self, session, batch_size=int(1e4)):
+        """ Load (sequence, id) pairs from the peptide table, up to the
+        cache's capacity. """
+        self.new_ids = {}
+        self.old_ids = {}
+        self.complete = True
+        max_size = 2 * self.generation_size
+        q = session.query(Peptide.sequence, Peptide.id)
+        num_loaded = 0
+        for sequence, peptide_id in db.get_keyset_batched_results(
+            q, Peptide.id, batch_size):
+            if num_loaded >= max_size:
+                self.complete = False
+                break
+            self.set(sequence, peptide_id)
+            num_loaded += 1
+        return num_loaded
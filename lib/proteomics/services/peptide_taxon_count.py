@@ -0,0 +1,74 @@
+from proteomics import db
+from sqlalchemy.sql import select, bindparam, and_
+
+
+def add_taxon_digest_peptides(session, taxon_digest, peptide_ids,
+                              batch_size=int(1e4)):
+    """ Increment the taxon counts of the peptides in a new taxon digest. """
+    ptc = db.tables['PeptideTaxonCount']
+    insert = ptc.insert().prefix_with('OR IGNORE')
+    increment = (
+        ptc.update()
+        .where(ptc.c.digest_id == bindparam('row_digest_id'))
+        .where(ptc.c.peptide_id == bindparam('row_peptide_id'))
+        .values(taxon_count=ptc.c.taxon_count + 1)
+    )
+    peptide_ids = list(peptide_ids)
+    for i in range(0, len(peptide_ids), batch_size):
+        batch = peptide_ids[i:i+batch_size]
+        session.execute(insert, [
+            {'digest_id': taxon_digest.digest_id, 'peptide_id': peptide_id,
+             'taxon_count': 0}
+            for peptide_id in batch])
+        session.execute(increment, [
+            {'row_digest_id': taxon_digest.digest_id,
+             'row_peptide_id': peptide_id}
+            for peptide_id in batch])
+
+def remove_taxon_digest_peptides(session, taxon_digest):
+    """ Decrement the taxon counts of the peptides in a taxon digest which
+    is being deleted. Must be called before its taxon digest peptides are
+    deleted. """
+    ptc = db.tables['PeptideTaxonCount']
+    tdp = db.tables['TaxonDigestPeptide']
+    td_peptide_ids = (
+        select([tdp.c.peptide_id])
+        .where(tdp.c.taxon_digest_id == taxon_digest.id)
+    )
+    session.execute(
+        ptc.update()
+        .where(ptc.c.digest_id == taxon_digest.digest_id)
+        .where(ptc.c.peptide_id.in_(td_peptide_ids))
+        .values(taxon_count=ptc.c.taxon_count - 1))
+    session.execute(
+        ptc.delete()
+        .where(ptc.c.digest_id == taxon_digest.digest_id)
+        .where(ptc.c.peptide_id.in_(td_peptide_ids))
+        .where(ptc.c.taxon_count <= 0))
+
+def get_taxon_digest_peptides(session, taxon_digest, sharing='all'):
+    """ Yields (peptide id, peptide sequence, taxon count) for peptides in
+    a taxon digest, ordered by peptide id. Peptides are filtered by
+    sharing, one of 'unique' (only in this taxon), 'shared' (also in other
+    taxons) or 'all'. """
+    ptc = db.tables['PeptideTaxonCount']
+    tdp = db.tables['TaxonDigestPeptide']
+    peptide = db.tables['Peptide']
+    q = (
+        select([peptide.c.id, peptide.c.sequence, ptc.c.taxon_count])
+        .select_from(
+            tdp.join(ptc, and_(ptc.c.peptide_id == tdp.c.peptide_id,
+                               ptc.c.digest_id == taxon_digest.digest_id))
+            .join(peptide, peptide.c.id == tdp.c.peptide_id)
+        )
+        .where(tdp.c.taxon_digest_id == taxon_digest.id)
+        .order_by(tdp.c.peptide_id)
+    )
+    if sharing == 'unique':
+        q = q.where(ptc.c.taxon_count == 1)
+    elif sharing == 'shared':
+        q = q.where(ptc.c.taxon_count > 1)
+    elif sharing != 'all':
+        raise ValueError("Unknown sharing '%s'" % sharing)
+    for row in session.execute(q):
+        yield tuple(row)
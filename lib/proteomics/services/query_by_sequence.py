@@ -0,0 +1,512 @@
+from proteomics.models import (Peptide, PeptideComposition, 
+                               TaxonDigestPeptide, TaxonDigest)
+from proteomics import db
+from proteomics import config
+from proteomics.util.distance import (levenshtein, levenshtein_many, hamming,
+                                      get_deletion_neighborhood,
+                                      get_composition,
+                                      parse_composition,
+                                      composition_distance)
+from proteomics.util.bktree import BKTree
+from proteomics.util.qgram import QGramIndex
+from proteomics.util.hamming_index import HammingIndex
+from proteomics.util.sequence_hash import get_sequence_hash
+from sqlalchemy import Table, Column, String, BigInteger, MetaData
+from sqlalchemy.sql import func, select, and_
+from sqlalchemy.exc import DBAPIError
+from collections import defaultdict
+import logging
+import os
+
+
+def register_sql_functions(connection):
+    """ Define LEVENSHTEIN(s1, s2) and LEVENSHTEIN(s1, s2, max_distance)
+    functions in a SQLite connection. """
+    connection.connection.create_function("LEVENSHTEIN", 2, levenshtein)
+    connection.connection.create_function("LEVENSHTEIN", 3, levenshtein)
+
+def verify_candidates(sequence, candidates, max_distance):
+    """ Yields (peptide id, peptide sequence, distance) tuples for
+    (peptide id, peptide sequence) candidates within max_distance of a
+    sequence. """
+    distances = levenshtein_many(
+        sequence, [peptide_sequence for peptide_id, peptide_sequence
+                   in candidates], max_distance=max_distance)
+    for (peptide_id, peptide_sequence), distance in zip(
+        candidates, distances):
+        if distance <= max_distance:
+            yield (peptide_id, peptide_sequence, distance)
+
+def get_hamming_matches(sequence, matches, max_distance):
+    """ Get the (peptide id, peptide sequence, distance) matches which are
+    within max_distance substitutions of a sequence, with their Hamming
+    distances. Levenshtein distances are never greater than Hamming
+    distances, so Levenshtein matches are a superset of Hamming matches. """
+    hamming_matches = []
+    for peptide_id, peptide_sequence, distance in matches:
+        if len(peptide_sequence) != len(sequence):
+            continue
+        distance = hamming(sequence, peptide_sequence,
+                           max_distance=max_distance)
+        if distance <= max_distance:
+            hamming_matches.append((peptide_id, peptide_sequence, distance))
+    return hamming_matches
+
+def get_index_path(name):
+    return os.path.join(config.SEARCH_INDEX_DIR, name)
+
+class SearchEngine(object):
+    """ Base class for search engines. Engines find peptides within a max
+    distance of query sequences, per the engine's metric. """
+    metric = 'levenshtein'
+
+    def search(self, sequence, max_distance):
+        """ Yields (peptide id, peptide sequence, distance) tuples for
+        peptides within max_distance of a sequence. """
+        raise NotImplementedError
+
+    def search_many(self, sequences, max_distance):
+        """ Yields (sequence, matches) pairs for each of a list of sequences,
+        in order. Matches are lists of (peptide id, peptide sequence,
+        distance) tuples. """
+        for sequence in sequences:
+            yield sequence, list(self.search(sequence, max_distance))
+
+class ScanEngine(SearchEngine):
+    """ Compares query sequences against every peptide in the db. """
+    def __init__(self, session, logger=None, **kwargs):
+        self.session = session
+        register_sql_functions(session.connection())
+
+    def search(self, sequence, max_distance):
+        """ Yields (peptide id, peptide sequence, distance) tuples for
+        peptides within max_distance of a sequence. """
+        if max_distance == 0:
+            q = (
+                self.session.query(Peptide.id, Peptide.sequence)
+                .filter(Peptide.sequence_hash == get_sequence_hash(sequence))
+                .filter(Peptide.sequence == sequence)
+            )
+            for peptide_id, peptide_sequence in q:
+                yield (peptide_id, peptide_sequence, 0)
+            return
+        lev_dist = func.LEVENSHTEIN(sequence, Peptide.sequence, max_distance)
+        q = (
+            self.session.query(Peptide.id, Peptide.sequence, lev_dist)
+            .filter(lev_dist <= max_distance)
+        )
+        for peptide_id, peptide_sequence, distance in q:
+            yield (peptide_id, peptide_sequence, distance)
+
+class BucketEngine(SearchEngine):
+    """ Compares query sequences against peptides whose length and amino
+    acid composition could be within the max distance.
+
+    Lengths and composition signatures are kept in the peptide_composition
+    table, which is filled at ingest. Peptides within edit distance k of a
+    query differ in length by at most k, and in composition by at most 2k.
+    Only peptides which pass both filters have their edit distance
+    computed.
+
+    For dbs with peptides which were ingested without compositions, the
+    missing compositions are added when the engine is first used. If they
+    can not be added, e.g. because the db is read-only, the engine falls
+    back to scanning every peptide.
+    """
+    def __init__(self, session, logger=None, batch_size=1e4, **kwargs):
+        self.session = session
+        self.logger = logger or logging.getLogger()
+        self.batch_size = batch_size
+        self.synced = False
+        self.fallback_engine = None
+
+    def sync_compositions(self):
+        """ Add compositions for peptides which do not have them yet. """
+        try:
+            num_added = db.add_peptide_compositions(
+                bind=self.session.connection(), batch_size=self.batch_size)
+            if num_added:
+                self.session.commit()
+                self.logger.info("Added %s peptide compositions" % (
+                    num_added))
+        except DBAPIError as e:
+            self.session.rollback()
+            self.logger.info("Could not add missing peptide compositions"
+                             " (%s), scanning all peptides instead" % e)
+            self.fallback_engine = ScanEngine(self.session,
+                                              logger=self.logger)
+        self.synced = True
+
+    def search(self, sequence, max_distance):
+        """ Yields (peptide id, peptide sequence, distance) tuples for
+        peptides within max_distance of a sequence. """
+        if not self.synced:
+            self.sync_compositions()
+        if self.fallback_engine:
+            return self.fallback_engine.search(sequence, max_distance)
+        composition = get_composition(sequence)
+        max_composition_distance = 2 * max_distance
+        q = (
+            self.session.query(Peptide.id, Peptide.sequence,
+                               PeptideComposition.composition)
+            .join(PeptideComposition,
+                  PeptideComposition.peptide_id == Peptide.id)
+            .filter(PeptideComposition.length.between(
+                len(sequence) - max_distance, len(sequence) + max_distance))
+        )
+        candidates = []
+        for peptide_id, peptide_sequence, peptide_composition in q:
+            if composition_distance(
+                composition, parse_composition(peptide_composition)
+            ) <= max_composition_distance:
+                candidates.append((peptide_id, peptide_sequence))
+        return verify_candidates(sequence, candidates, max_distance)
+
+class PeptideIndexEngine(SearchEngine):
+    """ Base class for engines which search a persistent index of peptide
+    sequences.
+
+    Peptides are never deleted and their ids only increase, so an index is
+    brought up to date by adding peptides with ids greater than the last
+    id in the index. Peptides are shared by all digests, so one index
+    serves every digest. If the index does not match the db (e.g. the db
+    has been rebuilt), it is rebuilt from scratch.
+    """
+    index_name = None
+
+    def __init__(self, session, logger=None, index_path=None, **kwargs):
+        self.session = session
+        self.logger = logger or logging.getLogger()
+        self.index_path = index_path or get_index_path(self.index_name)
+        self.index = None
+
+    def new_index(self):
+        raise NotImplementedError
+
+    def add_to_index(self, index, peptide_id, sequence):
+        raise NotImplementedError
+
+    def save_index(self, index, path, **attrs):
+        index.save(path, **attrs)
+
+    def load_index(self, path):
+        return self.index_class.load(path)
+
+    def get_peptide_stamp(self, peptide_id):
+        """ Get a stamp that identifies the last peptide in an index. """
+        if not peptide_id:
+            return None
+        sequence = (
+            self.session.query(Peptide.sequence)
+            .filter(Peptide.id == peptide_id)
+        ).scalar()
+        if sequence is not None:
+            sequence = str(sequence)
+        return sequence
+
+    def update_index(self):
+        """ Load the index, and add any new peptides to it. """
+        index = None
+        last_peptide_id = 0
+        if os.path.exists(self.index_path):
+            index, attrs = self.load_index(self.index_path)
+            last_peptide_id = attrs.get('last_peptide_id', 0)
+            stamp = self.get_peptide_stamp(last_peptide_id)
+            if stamp != attrs.get('last_peptide_stamp'):
+                self.logger.info("Index '%s' does not match the db,"
+                                 " rebuilding..." % self.index_path)
+                index = None
+                last_peptide_id = 0
+        if index is None:
+            index = self.new_index()
+        q = (
+            self.session.query(Peptide.id, Peptide.sequence)
+            .filter(Peptide.id > last_peptide_id)
+        )
+        num_added = 0
+        for peptide_id, sequence in db.get_keyset_batched_results(
+            q, Peptide.id, 1e4):
+            self.add_to_index(index, peptide_id, str(sequence))
+            last_peptide_id = peptide_id
+            num_added += 1
+            if (num_added % 1e5) == 0:
+                self.logger.info("Indexed %s peptides..." % num_added)
+        if num_added:
+            self.logger.info("Added %s peptides to index '%s'" % (
+                num_added, self.index_path))
+            index_dir = os.path.dirname(self.index_path)
+            if index_dir and not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            self.save_index(
+                index, self.index_path, last_peptide_id=last_peptide_id,
+                last_peptide_stamp=self.get_peptide_stamp(last_peptide_id))
+        self.index = index
+
+    def search(self, sequence, max_distance):
+        if self.index is None:
+            self.update_index()
+        return self.search_index(sequence, max_distance)
+
+class BKTreeEngine(PeptideIndexEngine):
+    """ Searches a BK-tree of peptide sequences. Only subtrees which can
+    contain peptides within the max distance are visited. """
+    index_name = 'peptides.bktree'
+    index_class = BKTree
+
+    def new_index(self):
+        return BKTree()
+
+    def add_to_index(self, index, peptide_id, sequence):
+        index.add(sequence, peptide_id)
+
+    def search_index(self, sequence, max_distance):
+        return self.index.search(sequence, max_distance)
+
+class QGramEngine(PeptideIndexEngine):
+    """ Searches a q-gram inverted index of peptide sequences. Only
+    peptides which share enough q-grams with a query are compared with it.
+    Queries for which the q-gram lemma can not prune any peptides (short
+    queries, or large max distances) fall back to the bucket engine. """
+    index_name = 'peptides.qgram'
+    index_class = QGramIndex
+
+    def __init__(self, session, logger=None, index_path=None, q=3,
+                 **kwargs):
+        super(QGramEngine, self).__init__(
+            session, logger=logger, index_path=index_path, **kwargs)
+        self.q = q
+        self.fallback_engine = BucketEngine(session, logger=logger)
+
+    def new_index(self):
+        return QGramIndex(q=self.q)
+
+    def add_to_index(self, index, peptide_id, sequence):
+        index.add(sequence, peptide_id)
+
+    def search_index(self, sequence, max_distance):
+        candidate_ids = self.index.get_candidates(sequence, max_distance)
+        if candidate_ids is None:
+            for match in self.fallback_engine.search(sequence, max_distance):
+                yield match
+            return
+        for i in range(0, len(candidate_ids), 500):
+            q = (
+                self.session.query(Peptide.id, Peptide.sequence)
+                .filter(Peptide.id.in_(candidate_ids[i:i+500]))
+            )
+            for match in verify_candidates(sequence, q.all(), max_distance):
+                yield match
+
+class BatchEngine(SearchEngine):
+    """ Matches many query sequences in a single pass over the peptide
+    table.
+
+    For max distances up to max_neighborhood_distance, the k-deletion
+    neighborhoods of the queries are put in a dict. Each peptide's
+    neighborhood is looked up in the dict, and only queries which share a
+    neighborhood key with the peptide are compared with it. For larger max
+    distances each peptide is compared with the queries whose lengths are
+    within the max distance of its length.
+    """
+    def __init__(self, session, logger=None, batch_size=1e4,
+                 max_neighborhood_distance=2, **kwargs):
+        self.session = session
+        self.logger = logger or logging.getLogger()
+        self.batch_size = batch_size
+        self.max_neighborhood_distance = max_neighborhood_distance
+
+    def search(self, sequence, max_distance):
+        for sequence, matches in self.search_many([sequence], max_distance):
+            return matches
+
+    def search_many(self, sequences, max_distance):
+        sequences = list(sequences)
+        query_sequences = list(set(sequences))
+        if not query_sequences:
+            return
+        matches = defaultdict(list)
+
+        # Group queries by length.
+        queries_by_length = defaultdict(list)
+        for query in query_sequences:
+            queries_by_length[len(query)].append(query)
+        min_length = min(queries_by_length) - max_distance
+        max_length = max(queries_by_length) + max_distance
+
+        use_neighborhoods = (max_distance <= self.max_neighborhood_distance)
+        if use_neighborhoods:
+            queries_by_key = defaultdict(set)
+            for query in query_sequences:
+                for key in get_deletion_neighborhood(query, max_distance):
+                    queries_by_key[key].add(query)
+
+        q = self.session.query(Peptide.id, Peptide.sequence)
+        num_scanned = 0
+        for peptide_id, peptide_sequence in db.get_keyset_batched_results(
+            q, Peptide.id, self.batch_size):
+            num_scanned += 1
+            if (num_scanned % 1e6) == 0:
+                self.logger.info("Scanned %s peptides..." % num_scanned)
+            peptide_length = len(peptide_sequence)
+            if peptide_length < min_length or peptide_length > max_length:
+                continue
+            if use_neighborhoods:
+                candidate_queries = set()
+                for key in get_deletion_neighborhood(peptide_sequence,
+                                                     max_distance):
+                    candidate_queries.update(queries_by_key.get(key, ()))
+            else:
+                candidate_queries = []
+                for length in range(peptide_length - max_distance,
+                                    peptide_length + max_distance + 1):
+                    candidate_queries.extend(
+                        queries_by_length.get(length, []))
+            for query in candidate_queries:
+                distance = levenshtein(query, peptide_sequence,
+                                       max_distance=max_distance)
+                if distance <= max_distance:
+                    matches[query].append(
+                        (peptide_id, peptide_sequence, distance))
+
+        for sequence in sequences:
+            yield sequence, matches.get(sequence, [])
+
+class HammingEngine(PeptideIndexEngine):
+    """ Searches a segment index of peptide sequences for peptides which
+    differ from a query by at most max_distance substitutions. Queries
+    with max distances greater than the index's max distance fall back to
+    the bucket engine. """
+    index_name = 'peptides.hamming'
+    index_class = HammingIndex
+    metric = 'hamming'
+
+    def __init__(self, session, logger=None, index_path=None,
+                 max_index_distance=2, **kwargs):
+        super(HammingEngine, self).__init__(
+            session, logger=logger, index_path=index_path, **kwargs)
+        self.max_index_distance = max_index_distance
+        self.fallback_engine = BucketEngine(session, logger=logger)
+
+    def new_index(self):
+        return HammingIndex(max_distance=self.max_index_distance)
+
+    def add_to_index(self, index, peptide_id, sequence):
+        index.add(sequence, peptide_id)
+
+    def search_index(self, sequence, max_distance):
+        candidate_ids = self.index.get_candidates(sequence, max_distance)
+        if candidate_ids is None:
+            return get_hamming_matches(
+                sequence, self.fallback_engine.search(sequence, max_distance),
+                max_distance)
+        matches = []
+        for i in range(0, len(candidate_ids), 500):
+            q = (
+                self.session.query(Peptide.id, Peptide.sequence)
+                .filter(Peptide.id.in_(candidate_ids[i:i+500]))
+            )
+            for peptide_id, peptide_sequence in q:
+                distance = hamming(sequence, peptide_sequence,
+                                   max_distance=max_distance)
+                if distance <= max_distance:
+                    matches.append((peptide_id, peptide_sequence, distance))
+        return matches
+
+ENGINES = {
+    'scan': ScanEngine,
+    'bucket': BucketEngine,
+    'bktree': BKTreeEngine,
+    'qgram': QGramEngine,
+    'batch': BatchEngine,
+    'hamming': HammingEngine,
+}
+
+def get_taxon_ids_by_peptide_id(session, peptide_ids):
+    taxon_ids = defaultdict(list)
+    peptide_ids = list(peptide_ids)
+    for i in range(0, len(peptide_ids), 500):
+        q = (
+            session.query(TaxonDigestPeptide.peptide_id, TaxonDigest.taxon_id)
+            .join(TaxonDigest)
+            .filter(TaxonDigestPeptide.peptide_id.in_(peptide_ids[i:i+500]))
+        )
+        for peptide_id, taxon_id in q:
+            taxon_ids[peptide_id].append(taxon_id)
+    return taxon_ids
+
+# Temporary table of query sequences, for exact matching.
+query_sequence_table = Table(
+    'query_sequence', MetaData(),
+    Column('sequence', String),
+    Column('sequence_hash', BigInteger),
+    prefixes=['TEMPORARY'],
+)
+
+def query_exact_matches(session, sequences, batch_size=500):
+    """ Query the db for peptides which exactly match the given sequences.
+    The sequences are loaded into a temporary table, which is joined to the
+    peptide table on the indexed sequence hash in a single statement.
+    Yields [query sequence, taxon id, 0, matched sequence] rows. """
+    sequences = list(sequences)
+    connection = session.connection()
+    query_sequence_table.create(bind=connection)
+    try:
+        query_dicts = [{'sequence': sequence,
+                        'sequence_hash': get_sequence_hash(sequence)}
+                       for sequence in set(sequences)]
+        for i in range(0, len(query_dicts), batch_size):
+            connection.execute(query_sequence_table.insert(),
+                               query_dicts[i:i+batch_size])
+        peptide = db.tables['Peptide']
+        tdp = db.tables['TaxonDigestPeptide']
+        td = db.tables['TaxonDigest']
+        qs = query_sequence_table
+        q = (
+            select([qs.c.sequence, td.c.taxon_id])
+            .select_from(
+                qs.join(peptide, and_(
+                    peptide.c.sequence_hash == qs.c.sequence_hash,
+                    peptide.c.sequence == qs.c.sequence))
+                .join(tdp, tdp.c.peptide_id == peptide.c.id)
+                .join(td, td.c.id == tdp.c.taxon_digest_id)
+            )
+        )
+        taxon_ids = defaultdict(list)
+        for sequence, taxon_id in connection.execute(q):
+            taxon_ids[sequence].append(taxon_id)
+    finally:
+        query_sequence_table.drop(bind=connection)
+    for sequence in sequences:
+        for taxon_id in taxon_ids.get(sequence, []):
+            yield [sequence, taxon_id, 0, sequence]
+
+def query_by_sequence(session, sequences, max_distance=0, engine=None,
+                      metric='levenshtein'):
+    """ Query the db for peptides within max_distance of the given sequences,
+    per a 'levenshtein' or 'hamming' metric.
+    Exact queries go through query_exact_matches, bypassing any given
+    engine, other queries go through a search engine. Hamming queries
+    against an engine with a different metric use the engine's matches as
+    candidates.
+    Yields [query sequence, taxon id, distance, matched sequence] rows. """
+    if (engine is not None and metric != 'hamming'
+        and engine.metric == 'hamming'):
+        raise ValueError("Engine '%s' can only be used for Hamming queries"
+                         % engine.__class__.__name__)
+    if max_distance == 0:
+        for row in query_exact_matches(session, sequences):
+            yield row
+        return
+    if engine is None:
+        if metric == 'hamming':
+            engine = HammingEngine(session)
+        else:
+            engine = BucketEngine(session)
+    for sequence, matches in engine.search_many(sequences, max_distance):
+        if metric == 'hamming' and engine.metric != 'hamming':
+            matches = get_hamming_matches(sequence, matches, max_distance)
+        taxon_ids = get_taxon_ids_by_peptide_id(
+            session, [peptide_id for peptide_id, match, distance in matches])
+        for peptide_id, match, distance in matches:
+            for taxon_id in taxon_ids.get(peptide_id, []):
+                yield [sequence, taxon_id, distance, match]
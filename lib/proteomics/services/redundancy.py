@@ -1,7 +1,16 @@
 from proteomics.models import (TaxonDigestPeptide, TaxonDigest, Peptide)
-from sqlalchemy.sql import func
+from proteomics import db
+from proteomics.services.taxon_digest_bitmap import get_taxon_digest_bitmaps
+from proteomics.services.taxon_digest_sketch import get_taxon_digest_sketches
+from proteomics.services.redundancy_cache import (
+    get_taxon_digest_generations, get_cached_pair_counts,
+    save_cached_pair_counts)
+from sqlalchemy import create_engine
+from sqlalchemy.sql import func, select, text
+from collections import defaultdict
 import itertools
 import logging
+import multiprocessing
 
 
 def count_common_peptides(session=None, taxon_digests=[]):
@@ -29,102 +38,445 @@ def count_peptide_union(session=None, taxon_digests=[]):
     )
     return q.count()
 
-def generate_redundancy_tables(session=None, taxon_digests=[], logger=None):
+def get_peptide_taxon_digest_ids(session, taxon_digest_ids):
+    """ Yields (peptide id, sorted taxon digest ids) for each peptide in
+    the given taxon digests, in a single ordered pass over their taxon
+    digest peptides. """
+    tdp = db.tables['TaxonDigestPeptide']
+    q = (
+        select([tdp.c.peptide_id, tdp.c.taxon_digest_id])
+        .where(tdp.c.taxon_digest_id.in_(list(taxon_digest_ids)))
+        .order_by(tdp.c.peptide_id)
+    )
+    rows = session.execute(q)
+    for peptide_id, peptide_rows in itertools.groupby(
+        rows, key=lambda row: row[0]):
+        yield peptide_id, tuple(sorted(set([row[1] for row in peptide_rows])))
+
+def count_peptide_sharing(session=None, taxon_digests=[]):
+    """ Count how peptides are shared among taxon digests, in a single
+    pass. Returns:
+        - a {number of taxon digests: number of peptides} histogram of how
+          many of the taxon digests each peptide occurs in.
+        - a {sorted tuple of taxon digest ids: number of peptides} dict of
+          exclusive intersection counts, i.e. the number of peptides which
+          occur in exactly those taxon digests. Only subsets which occur
+          are included.
+    """
+    histogram = defaultdict(int)
+    subset_counts = defaultdict(int)
+    for peptide_id, ids in get_peptide_taxon_digest_ids(
+        session, [td.id for td in taxon_digests]):
+        histogram[len(ids)] += 1
+        subset_counts[ids] += 1
+    return dict(histogram), dict(subset_counts)
+
+def count_taxon_digest_ids(session, taxon_digest_ids):
+    """ Get (intersection count, union count) for the taxon digests with the
+    given ids. """
+    taxon_digests = [TaxonDigest(id=taxon_digest_id)
+                     for taxon_digest_id in set(taxon_digest_ids)]
+    if len(taxon_digests) == 1:
+        num_in_td = count_common_peptides(session, taxon_digests)
+        return num_in_td, num_in_td
+    return (count_common_peptides(session, taxon_digests),
+            count_peptide_union(session, taxon_digests))
+
+# Session used by count worker processes.
+_worker_session = None
+
+def init_count_worker(db_url):
+    """ Open a read-only connection for a count worker process. """
+    global _worker_session
+    connection = create_engine(db_url).connect()
+    connection.execute(text("PRAGMA query_only = ON"))
+    _worker_session = db.get_session(bind=connection)
+
+def count_taxon_digest_ids_worker(taxon_digest_ids):
+    return count_taxon_digest_ids(_worker_session, taxon_digest_ids)
+
+class Counter(object):
+    """ Base class for peptide counters. """
+    def count_individual(self, td):
+        """ Count the peptides in a taxon digest. """
+        raise NotImplementedError
+
+    def count_intersection_and_union(self, combo):
+        """ Get (intersection count, union count) for the peptides in a
+        combination of taxon digests. """
+        raise NotImplementedError
+
+    def iter_pair_counts(self, pairs):
+        """ Yields (pair, (intersection count, union count)) for each of an
+        iterable of pairs of taxon digests, in order, as they are counted.
+        """
+        for pair in pairs:
+            yield pair, self.count_intersection_and_union(pair)
+
+class SqlCounter(Counter):
+    """ Counts peptides with aggregate queries on taxon digest peptides.
+
+    Individual counts are made up front. Pair counts are made in blocks of
+    block_size pairs as iter_pair_counts is iterated over. Counts are
+    cached in the redundancy_pair_count table, keyed by taxon digest ids
+    and generations, so only pairs with new taxon digests are counted on
+    later runs. If num_workers > 1, counts are made in a pool of worker
+    processes, each with its own read-only connection.
+    """
+    def __init__(self, session, taxon_digests, logger=None, num_workers=1,
+                 use_cache=True, block_size=500, **kwargs):
+        self.session = session
+        self.logger = logger or logging.getLogger()
+        self.num_workers = num_workers
+        self.use_cache = use_cache
+        self.block_size = block_size
+        self.pool = None
+        taxon_digest_ids = sorted([td.id for td in taxon_digests])
+        if use_cache:
+            self.generations = get_taxon_digest_generations(
+                session, taxon_digest_ids)
+        else:
+            self.generations = {}
+        try:
+            individual_counts = self.get_counts(
+                [(taxon_digest_id, taxon_digest_id)
+                 for taxon_digest_id in taxon_digest_ids])
+        finally:
+            self.close_pool()
+        self.individual_counts = dict([
+            (key[0], counts[0])
+            for key, counts in individual_counts.iteritems()])
+
+    def get_counts(self, keys):
+        """ Get {key: (intersection count, union count)} for (taxon digest
+        id, taxon digest id) keys, from the cache or by counting. New counts
+        are cached. """
+        if self.use_cache:
+            counts = get_cached_pair_counts(self.session, self.generations,
+                                            keys=keys)
+        else:
+            counts = {}
+        uncounted_keys = sorted(set([key for key in keys
+                                     if key not in counts]))
+        self.logger.info("Found %s of %s counts in cache, counting %s" % (
+            len(keys) - len(uncounted_keys), len(keys), len(uncounted_keys)))
+        new_counts = self.count_pairs(uncounted_keys)
+        counts.update(new_counts)
+        if self.use_cache and new_counts:
+            save_cached_pair_counts(self.session, self.generations,
+                                    new_counts)
+            self.session.commit()
+        return counts
+
+    def get_pool(self):
+        """ Get the worker pool, or None if counting in this process. """
+        if self.num_workers <= 1:
+            return None
+        db_url = self.session.get_bind().engine.url
+        if db_url.database in (None, '', ':memory:'):
+            self.logger.info("Can not share an in-memory db with workers,"
+                             " counting in a single process")
+            self.num_workers = 1
+            return None
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(
+                self.num_workers, initializer=init_count_worker,
+                initargs=(str(db_url),))
+        return self.pool
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def count_pairs(self, keys):
+        """ Get {key: (intersection count, union count)} for (taxon digest
+        id, taxon digest id) keys. """
+        if not keys:
+            return {}
+        pool = self.get_pool()
+        if pool:
+            try:
+                counts = pool.map(
+                    count_taxon_digest_ids_worker, keys,
+                    chunksize=max(1, len(keys)/(4*self.num_workers)))
+            except:
+                pool.terminate()
+                self.pool = None
+                raise
+        else:
+            counts = [count_taxon_digest_ids(self.session, key)
+                      for key in keys]
+        return dict(zip(keys, counts))
+
+    def count_individual(self, td):
+        return self.individual_counts[td.id]
+
+    def count_intersection_and_union(self, combo):
+        if len(combo) == 2:
+            key = tuple(sorted([td.id for td in combo]))
+            return self.get_counts([key])[key]
+        return count_taxon_digest_ids(self.session, [td.id for td in combo])
+
+    def iter_pair_counts(self, pairs):
+        pairs = iter(pairs)
+        try:
+            while True:
+                block = list(itertools.islice(pairs, self.block_size))
+                if not block:
+                    break
+                keys = [tuple(sorted([td.id for td in pair]))
+                        for pair in block]
+                counts = self.get_counts(keys)
+                for pair, key in zip(block, keys):
+                    yield pair, counts[key]
+        finally:
+            self.close_pool()
+
+class BitmapCounter(Counter):
+    """ Counts peptides with in-memory operations on compressed bitmaps of
+    each taxon digest's peptide ids. Individual counts are cached in the
+    bitmaps, and pair unions follow from intersections by
+    inclusion-exclusion, so each pair costs one intersection count over
+    the id chunks which both taxon digests have peptides in. """
+    def __init__(self, session, taxon_digests, logger=None, **kwargs):
+        self.bitmaps = get_taxon_digest_bitmaps(
+            session, [td.id for td in taxon_digests], logger=logger)
+
+    def count_individual(self, td):
+        return len(self.bitmaps[td.id])
+
+    def count_intersection_and_union(self, combo):
+        if len(combo) == 2:
+            bitmap1, bitmap2 = [self.bitmaps[td.id] for td in combo]
+            num_in_intersection = bitmap1.intersection_count(bitmap2)
+            return (num_in_intersection,
+                    len(bitmap1) + len(bitmap2) - num_in_intersection)
+        intersection = self.bitmaps[combo[0].id]
+        union = intersection
+        for td in combo[1:]:
+            intersection &= self.bitmaps[td.id]
+            union |= self.bitmaps[td.id]
+        return len(intersection), len(union)
+
+class SparseCounter(Counter):
+    """ Counts peptides for all pairs of taxon digests in a single pass
+    over their taxon digest peptides.
+
+    The taxon digest peptides form a sparse peptide x taxon digest
+    incidence matrix A, and pair counts are the nonzero entries of A.At.
+    Peptides which occur in the same set of taxon digests, e.g. the
+    peptides of a gene shared by a clade, have identical rows of A. So the
+    pass only counts the peptides in each distinct set of taxon digests,
+    and each set then adds its count to every pair of taxon digests in it.
+    The diagonal holds individual counts, and unions follow by
+    inclusion-exclusion: |a U b| = |a| + |b| - |a ^ b|.
+    """
+    def __init__(self, session, taxon_digests, logger=None, **kwargs):
+        histogram, subset_counts = count_peptide_sharing(
+            session, taxon_digests)
+        self.individual_counts = defaultdict(int)
+        self.pair_counts = defaultdict(int)
+        for ids, count in subset_counts.iteritems():
+            for taxon_digest_id in ids:
+                self.individual_counts[taxon_digest_id] += count
+            for pair in itertools.combinations(ids, 2):
+                self.pair_counts[pair] += count
+
+    def count_individual(self, td):
+        return self.individual_counts.get(td.id, 0)
+
+    def count_intersection_and_union(self, combo):
+        if len(combo) != 2:
+            raise ValueError("The sparse counter only counts pairs of"
+                             " taxon digests")
+        id1, id2 = sorted([td.id for td in combo])
+        num_in_intersection = self.pair_counts.get((id1, id2), 0)
+        num_in_union = (self.individual_counts.get(id1, 0) +
+                        self.individual_counts.get(id2, 0) -
+                        num_in_intersection)
+        return num_in_intersection, num_in_union
+
+class MinHashCounter(Counter):
+    """ Estimates peptide counts from taxon digest sketches. Individual and
+    union counts are estimated with HyperLogLogs, and intersection counts
+    as the MinHash Jaccard similarity times the union count.
+
+    Pairs of taxon digests in exact_pairs, and the taxon digests in them,
+    are counted exactly with aggregate queries.
+    """
+    def __init__(self, session, taxon_digests, logger=None, exact_pairs=None,
+                 **kwargs):
+        self.sketches = get_taxon_digest_sketches(
+            session, [td.id for td in taxon_digests], logger=logger)
+        self.session = session
+        self.exact_pairs = set()
+        self.exact_taxon_digest_ids = set()
+        for pair in exact_pairs or []:
+            ids = tuple(sorted([td.id for td in pair]))
+            self.exact_pairs.add(ids)
+            self.exact_taxon_digest_ids.update(ids)
+
+    def count_individual(self, td):
+        if td.id in self.exact_taxon_digest_ids:
+            return count_taxon_digest_ids(self.session, [td.id])[0]
+        minhash, hll = self.sketches[td.id]
+        return int(round(hll.count()))
+
+    def count_intersection_and_union(self, combo):
+        if len(combo) != 2:
+            raise ValueError("The minhash counter only counts pairs of"
+                             " taxon digests")
+        if tuple(sorted([td.id for td in combo])) in self.exact_pairs:
+            return count_taxon_digest_ids(self.session,
+                                          [td.id for td in combo])
+        minhash1, hll1 = self.sketches[combo[0].id]
+        minhash2, hll2 = self.sketches[combo[1].id]
+        num_in_union = hll1.union(hll2).count()
+        num_in_intersection = minhash1.jaccard(minhash2) * num_in_union
+        return int(round(num_in_intersection)), int(round(num_in_union))
+
+COUNTERS = {
+    'sql': SqlCounter,
+    'bitmap': BitmapCounter,
+    'sparse': SparseCounter,
+    'minhash': MinHashCounter,
+}
+
+TABLE_IDS = ['individual_counts', 'intersection_counts', 'union_percents',
+             'individual_percents']
+SHARING_TABLE_IDS = ['sharing_histogram', 'exclusive_intersection_counts']
+
+def get_table_ids(sharing_tables=False):
+    """ Get the ids of the redundancy tables which will be generated. """
+    if sharing_tables:
+        return TABLE_IDS + SHARING_TABLE_IDS
+    return list(TABLE_IDS)
+
+def generate_redundancy_rows(session=None, taxon_digests=[], logger=None,
+                             engine='sparse', exact_pairs=None,
+                             num_workers=1, sharing_tables=False):
     """ 
-    Generates tables of:
-        - counts: counts of peptides in common between pairs of taxon digests
-        - union percents: |td1 ^ td2|/|td1 + td2|
-        - pairwise percents: |td1 ^ td2|/|td1|
+    Yields (table id, row) for the rows of the redundancy tables, as they
+    are counted:
+        - individual counts: |td|
+        - intersection counts: counts of peptides in common between pairs of
+          taxon digests, |td1 ^ td2|
+        - union percents: |td1 ^ td2|/|td1 U td2|
+        - individual percents: |td1 ^ td2|/|td1|
+    If sharing_tables is True, also yields rows of the following tables,
+    which are counted exactly for every engine, in a pass over all of the
+    taxon digests' peptides:
+        - sharing histogram: number of peptides which occur in exactly k of
+          the taxon digests, for k = 1..N
+        - exclusive intersection counts: number of peptides which occur in
+          exactly the given taxon digests, for each set of taxon digests
+          which occurs
+    Each pair of taxon digests is counted once, and pair rows are yielded
+    as their pairs are counted, so they can be written out as they are
+    yielded. Rows of a table are yielded in order, but rows of the
+    intersection counts, union percents and individual percents tables are
+    interleaved.
+
+    Individual count rows are ordered by taxon id. Intersection count and
+    union percent rows follow the pairs of itertools.combinations over
+    taxon_digests, in the given order, with each pair labeled in that
+    order. Individual percent rows are yielded with their pair, td1 ^ td2
+    over td1 and then over td2, rather than grouped by taxon as
+    generate_redundancy_tables used to, as that would mean holding every
+    pair's count until the end.
+
+    Counts are made by the counter for the given engine, one of 'sparse',
+    'bitmap', 'sql' or 'minhash'. The 'bitmap' and 'minhash' engines load a
+    bitmap or sketch per taxon digest and count each pair as it is reached.
+    The 'sql' engine counts pairs in blocks, caches their counts, and counts
+    in num_workers processes. The 'sparse' engine counts all pairs in a
+    single pass before the first row, and keeps the counts of pairs with
+    peptides in common in memory. The 'minhash' engine estimates counts,
+    except for the pairs of taxon digests in exact_pairs.
     """
 
     if not logger:
         logger = logging.getLogger()
 
-    # Generate pairs.
-    combinations = [c for c in itertools.combinations(taxon_digests, 2)]
-
-    # Get redundancies and sums by querying db.
-    # Calculate percents.
-    values = {
-        'intersection_counts': {},
-        'union_percents': {},
-        'individual_percents': {},
-        'individual_counts': {},
-    }
-    redundancies = {}
-    percents = {}
-    for combo in combinations:
-        logger.info("Counting peptides in common for %s" % (str([
+    counter = COUNTERS[engine](session, taxon_digests, logger=logger,
+                              exact_pairs=exact_pairs,
+                              num_workers=num_workers)
+
+    # Sort taxon digests.
+    sorted_taxon_digests = sorted(taxon_digests, key=lambda td: td.taxon.id)
+
+    # Individual counts table.
+    individual_counts = {}
+    for td in sorted_taxon_digests:
+        individual_counts[td.id] = counter.count_individual(td)
+        yield 'individual_counts', ["|%s|" % td.taxon.id,
+                                    individual_counts[td.id]]
+
+    # Intersection count, union percent and individual percent tables.
+    # The first two have one row per combination, the last one row per
+    # permutation.
+    pair_counts = counter.iter_pair_counts(
+        itertools.combinations(taxon_digests, 2))
+    for (td1, td2), (num_in_intersection, num_in_union) in pair_counts:
+        logger.info("Counted peptides in common for %s" % (str([
             "(taxon: %s, digest: %s)" % (
                 taxon_digest.taxon.id, taxon_digest.digest.id
-            ) for taxon_digest in combo])))
-        # Sorted combo for keying.
-        combo_key = get_td_combo_key(combo)
-        # Get intersection counts and union percentages.
-        num_in_intersection = count_common_peptides(session, combo)
-        num_in_union = count_peptide_union(session, combo)
+            ) for taxon_digest in (td1, td2)])))
+        intersection_label = '|%s ^ %s|' % (td1.taxon.id, td2.taxon.id)
+        yield 'intersection_counts', [intersection_label, num_in_intersection]
+
+        union_label = '|%s U %s|' % (td1.taxon.id, td2.taxon.id)
         if num_in_union:
-            percent_in_common = 100.0 * num_in_intersection/num_in_union
+            union_pct = 100.0 * num_in_intersection/num_in_union
         else:
-            percent_in_common = 0
-        values['intersection_counts'][combo_key] = num_in_intersection
-        values['union_percents'][combo_key] = percent_in_common
-        # Get individual counts and percentages.
-        for td in combo:
-            if td not in values['individual_counts']:
-                values['individual_counts'][td] = count_common_peptides(
-                    session, [td])
-            num_in_td = values['individual_counts'][td]
+            union_pct = 0
+        yield 'union_percents', ["%s/%s" % (intersection_label, union_label),
+                                 union_pct]
+
+        for td_a, td_b in [(td1, td2), (td2, td1)]:
+            num_in_td = individual_counts[td_a.id]
             if num_in_td:
-                values['individual_percents'][(td,combo_key,)] = \
-                        100.0 * num_in_intersection/num_in_td
+                label = "|%s ^ %s|/|%s|" % (td_a.taxon.id, td_b.taxon.id,
+                                            td_a.taxon.id)
+                yield 'individual_percents', [
+                    label, 100.0 * num_in_intersection/num_in_td]
 
-    # Sort taxon digests.
-    sorted_taxon_digests = sorted(taxon_digests, key=lambda td: td.taxon.id)
+    if sharing_tables:
+        if engine == 'minhash':
+            logger.info("Sharing tables are counted exactly, with a full"
+                        " pass over the taxon digests' peptides")
+        logger.info("Counting peptide sharing among taxon digests")
+        histogram, subset_counts = count_peptide_sharing(
+            session, taxon_digests)
 
-    # Assemble tables.
-    tables = {
-        'intersection_counts': [],
-        'union_percents': [],
-        'individual_percents': [],
-        'individual_counts': []
-    }
-
-    # Assemble individual counts table.
-    for i, td in enumerate(sorted_taxon_digests):
-        label = "|%s|" % td.taxon.id
-        value = values['individual_counts'][td]
-        tables['individual_counts'].append([label, value])
-
-    # Assemble intersection_count and union_pct tables.
-    # These tables have one row per combination.
-    for td1, td2 in combinations:
-        combo_key = get_td_combo_key((td1,td2,))
-        # Intersection count.
-        intersection_label = '|%s ^ %s|' % (td1.taxon.id, td2.taxon.id)
-        intersection_count = values['intersection_counts'][combo_key]
-        tables['intersection_counts'].append(
-            [intersection_label, intersection_count])
-        # Union percents.
-        union_label = '|%s U %s|' % (td1.taxon.id, td2.taxon.id)
-        union_pct_label = "%s/%s" % (intersection_label, union_label)
-        union_pct = values['union_percents'][combo_key]
-        tables['union_percents'].append([union_pct_label, union_pct])
-
-    # Assemble individual percents table.
-    # This table has one row per permutation.
-    for i, td1 in enumerate(sorted_taxon_digests):
-        for j, td2 in enumerate(sorted_taxon_digests):
-            combo_key = get_td_combo_key((td1,td2,))
-            pct_key = (td1,combo_key,)
-            if pct_key in values['individual_percents']:
-                label = "|%s ^ %s|/|%s|" % (td1.taxon.id, td2.taxon.id,
-                                            td1.taxon.id)
-                value = values['individual_percents'][pct_key]
-                tables['individual_percents'].append([label, value])
+        # Sharing histogram table.
+        # This table has one row per number of taxon digests.
+        for num_tds in range(1, len(taxon_digests) + 1):
+            label = "|in %s of %s|" % (num_tds, len(taxon_digests))
+            yield 'sharing_histogram', [label, histogram.get(num_tds, 0)]
 
-    return tables
+        # Exclusive intersection counts table.
+        # This table has one row per set of taxon digests which occurs.
+        taxon_ids_by_td_id = dict([(td.id, td.taxon.id)
+                                   for td in taxon_digests])
+        rows = []
+        for ids, count in subset_counts.iteritems():
+            taxon_ids = sorted([taxon_ids_by_td_id[td_id] for td_id in ids])
+            rows.append((len(taxon_ids), taxon_ids, count))
+        for num_taxon_ids, taxon_ids, count in sorted(rows):
+            yield 'exclusive_intersection_counts', [
+                "|%s| only" % ' ^ '.join(taxon_ids), count]
 
-def get_td_combo_key(td_combo):
-    """ Get a key for a taxon digest combo."""
-    return tuple(sorted(td_combo, key=lambda td: td.taxon.id))
+def generate_redundancy_tables(session=None, taxon_digests=[], logger=None,
+                               sharing_tables=False, **kwargs):
+    """ Get {table id: list of rows} for the rows from
+    generate_redundancy_rows. """
+    tables = dict([(table_id, [])
+                   for table_id in get_table_ids(sharing_tables)])
+    for table_id, row in generate_redundancy_rows(
+        session, taxon_digests, logger=logger, sharing_tables=sharing_tables,
+        **kwargs):
+        tables[table_id].append(row)
+    return tables
@@ -0,0 +1,118 @@
+from proteomics.models import (TaxonDigestGeneration, RedundancyPairCount)
+from proteomics import db
+from sqlalchemy.sql import or_, bindparam
+import random
+
+
+_random = random.SystemRandom()
+
+def new_generation():
+    return _random.getrandbits(63)
+
+def set_taxon_digest_generation(session, taxon_digest_id):
+    """ Assign a new generation to a taxon digest. Returns the generation. """
+    generation = new_generation()
+    generation_table = db.tables['TaxonDigestGeneration']
+    session.execute(
+        generation_table.delete()
+        .where(generation_table.c.taxon_digest_id == taxon_digest_id))
+    session.execute(generation_table.insert(), [{
+        'taxon_digest_id': taxon_digest_id,
+        'generation': generation,
+    }])
+    return generation
+
+def get_taxon_digest_generations(session, taxon_digest_ids):
+    """ Get {taxon digest id: generation} for the given taxon digests.
+    Taxon digests which were ingested before generations existed are
+    assigned one. """
+    taxon_digest_ids = list(taxon_digest_ids)
+    generations = {}
+    for i in range(0, len(taxon_digest_ids), 500):
+        q = (
+            session.query(TaxonDigestGeneration.taxon_digest_id,
+                          TaxonDigestGeneration.generation)
+            .filter(TaxonDigestGeneration.taxon_digest_id.in_(
+                taxon_digest_ids[i:i+500]))
+        )
+        generations.update(dict(q.all()))
+    missing_ids = [taxon_digest_id for taxon_digest_id in taxon_digest_ids
+                   if taxon_digest_id not in generations]
+    for taxon_digest_id in missing_ids:
+        generations[taxon_digest_id] = set_taxon_digest_generation(
+            session, taxon_digest_id)
+    if missing_ids:
+        session.commit()
+    return generations
+
+def get_cached_pair_counts(session, generations, keys=None):
+    """ Get {(taxon digest 1 id, taxon digest 2 id): (intersection count,
+    union count)} for cached pairs of the taxon digests in a {taxon digest
+    id: generation} dict, whose generations match. Pair keys are sorted by
+    id. Individual counts are cached as pairs of a taxon digest with
+    itself. If keys are given, only counts for those pairs are returned. """
+    if keys is not None:
+        keys = set(keys)
+        taxon_digest_ids = sorted(set([key[0] for key in keys]))
+        taxon_digest2_ids = sorted(set([key[1] for key in keys]))
+    else:
+        taxon_digest_ids = sorted(generations.keys())
+    pair_counts = {}
+    for i in range(0, len(taxon_digest_ids), 500):
+        q = (
+            session.query(RedundancyPairCount)
+            .filter(RedundancyPairCount.taxon_digest1_id.in_(
+                taxon_digest_ids[i:i+500]))
+        )
+        if keys is not None and len(taxon_digest2_ids) <= 500:
+            q = q.filter(RedundancyPairCount.taxon_digest2_id.in_(
+                taxon_digest2_ids))
+        for row in q:
+            if row.taxon_digest2_id not in generations:
+                continue
+            if keys is not None and \
+               (row.taxon_digest1_id, row.taxon_digest2_id) not in keys:
+                continue
+            if row.generation1 != generations[row.taxon_digest1_id] or \
+               row.generation2 != generations[row.taxon_digest2_id]:
+                continue
+            pair_counts[(row.taxon_digest1_id, row.taxon_digest2_id)] = (
+                row.intersection_count, row.union_count)
+    return pair_counts
+
+def save_cached_pair_counts(session, generations, pair_counts):
+    """ Save {(taxon digest 1 id, taxon digest 2 id): (intersection count,
+    union count)} pair counts, for the generations in a {taxon digest id:
+    generation} dict. """
+    if not pair_counts:
+        return
+    pair_count_table = db.tables['RedundancyPairCount']
+    session.execute(
+        pair_count_table.delete()
+        .where(pair_count_table.c.taxon_digest1_id == bindparam('id1'))
+        .where(pair_count_table.c.taxon_digest2_id == bindparam('id2')),
+        [{'id1': id1, 'id2': id2} for id1, id2 in pair_counts])
+    session.execute(pair_count_table.insert(), [
+        {
+            'taxon_digest1_id': id1,
+            'taxon_digest2_id': id2,
+            'generation1': generations[id1],
+            'generation2': generations[id2],
+            'intersection_count': intersection_count,
+            'union_count': union_count,
+        }
+        for (id1, id2), (intersection_count, union_count)
+        in pair_counts.iteritems()
+    ])
+
+def delete_taxon_digest_cache(session, taxon_digest_id):
+    """ Delete a taxon digest's generation and cached pair counts. """
+    pair_count_table = db.tables['RedundancyPairCount']
+    session.execute(
+        pair_count_table.delete()
+        .where(or_(pair_count_table.c.taxon_digest1_id == taxon_digest_id,
+                   pair_count_table.c.taxon_digest2_id == taxon_digest_id)))
+    generation_table = db.tables['TaxonDigestGeneration']
+    session.execute(
+        generation_table.delete()
+        .where(generation_table.c.taxon_digest_id == taxon_digest_id))
@@ -0,0 +1,62 @@
+from proteomics.models import (TaxonDigestPeptide, TaxonDigestBitmap)
+from proteomics import db
+from proteomics.util.bitmap import (get_bitmap, serialize_bitmap,
+                                    deserialize_bitmap, FORMAT_TAG)
+
+
+def save_taxon_digest_bitmap(session, taxon_digest_id, peptide_ids):
+    """ Save the bitmap of a taxon digest's peptide ids. """
+    bitmap_table = db.tables['TaxonDigestBitmap']
+    session.execute(
+        bitmap_table.delete()
+        .where(bitmap_table.c.taxon_digest_id == taxon_digest_id))
+    session.execute(bitmap_table.insert(), [{
+        'taxon_digest_id': taxon_digest_id,
+        'bitmap': serialize_bitmap(get_bitmap(peptide_ids)),
+    }])
+
+def delete_taxon_digest_bitmap(session, taxon_digest_id):
+    bitmap_table = db.tables['TaxonDigestBitmap']
+    session.execute(
+        bitmap_table.delete()
+        .where(bitmap_table.c.taxon_digest_id == taxon_digest_id))
+
+def get_taxon_digest_bitmaps(session, taxon_digest_ids, logger=None):
+    """ Get {taxon digest id: bitmap} for the given taxon digests.
+    Bitmaps are normally saved at ingest. Bitmaps for taxon digests which
+    were ingested before bitmaps existed are built from their taxon digest
+    peptides, and saved. Bitmaps saved in an older format are re-saved in
+    the current format. """
+    taxon_digest_ids = list(taxon_digest_ids)
+    bitmaps = {}
+    old_format_ids = []
+    for i in range(0, len(taxon_digest_ids), 500):
+        q = (
+            session.query(TaxonDigestBitmap.taxon_digest_id,
+                          TaxonDigestBitmap.bitmap)
+            .filter(TaxonDigestBitmap.taxon_digest_id.in_(
+                taxon_digest_ids[i:i+500]))
+        )
+        for taxon_digest_id, data in q:
+            bitmaps[taxon_digest_id] = deserialize_bitmap(data)
+            if not data.startswith(FORMAT_TAG):
+                old_format_ids.append(taxon_digest_id)
+    for taxon_digest_id in old_format_ids:
+        save_taxon_digest_bitmap(session, taxon_digest_id,
+                                 bitmaps[taxon_digest_id])
+    missing_ids = [taxon_digest_id for taxon_digest_id in taxon_digest_ids
+                   if taxon_digest_id not in bitmaps]
+    for taxon_digest_id in missing_ids:
+        if logger:
+            logger.info("Building peptide bitmap for taxon digest '%s'" % (
+                taxon_digest_id))
+        peptide_ids = [
+            row[0] for row in
+            session.query(TaxonDigestPeptide.peptide_id)
+            .filter(TaxonDigestPeptide.taxon_digest_id == taxon_digest_id)
+        ]
+        save_taxon_digest_bitmap(session, taxon_digest_id, peptide_ids)
+        bitmaps[taxon_digest_id] = get_bitmap(peptide_ids)
+    if missing_ids or old_format_ids:
+        session.commit()
+    return bitmaps
@@ -0,0 +1,62 @@
+from proteomics.models import (TaxonDigestPeptide, TaxonDigestSketch)
+from proteomics import db
+from proteomics.util.sketch import MinHashSignature, HyperLogLog
+
+
+def save_taxon_digest_sketch(session, taxon_digest_id, peptide_ids):
+    """ Save MinHash and HyperLogLog sketches of a taxon digest's peptide
+    ids. """
+    peptide_ids = list(peptide_ids)
+    sketch_table = db.tables['TaxonDigestSketch']
+    session.execute(
+        sketch_table.delete()
+        .where(sketch_table.c.taxon_digest_id == taxon_digest_id))
+    session.execute(sketch_table.insert(), [{
+        'taxon_digest_id': taxon_digest_id,
+        'minhash': MinHashSignature.from_ids(peptide_ids).serialize(),
+        'hll': HyperLogLog.from_ids(peptide_ids).serialize(),
+    }])
+
+def delete_taxon_digest_sketch(session, taxon_digest_id):
+    sketch_table = db.tables['TaxonDigestSketch']
+    session.execute(
+        sketch_table.delete()
+        .where(sketch_table.c.taxon_digest_id == taxon_digest_id))
+
+def get_taxon_digest_sketches(session, taxon_digest_ids, logger=None):
+    """ Get {taxon digest id: (MinHash signature, HyperLogLog)} for the
+    given taxon digests. Sketches are normally saved at ingest. Sketches
+    for taxon digests which were ingested before sketches existed are built
+    from their taxon digest peptides, and saved. """
+    taxon_digest_ids = list(taxon_digest_ids)
+    sketches = {}
+    for i in range(0, len(taxon_digest_ids), 500):
+        q = (
+            session.query(TaxonDigestSketch.taxon_digest_id,
+                          TaxonDigestSketch.minhash,
+                          TaxonDigestSketch.hll)
+            .filter(TaxonDigestSketch.taxon_digest_id.in_(
+                taxon_digest_ids[i:i+500]))
+        )
+        for taxon_digest_id, minhash, hll in q:
+            sketches[taxon_digest_id] = (
+                MinHashSignature.deserialize(str(minhash)),
+                HyperLogLog.deserialize(str(hll)))
+    missing_ids = [taxon_digest_id for taxon_digest_id in taxon_digest_ids
+                   if taxon_digest_id not in sketches]
+    for taxon_digest_id in missing_ids:
+        if logger:
+            logger.info("Building peptide sketches for taxon digest '%s'" % (
+                taxon_digest_id))
+        peptide_ids = [
+            row[0] for row in
+            session.query(TaxonDigestPeptide.peptide_id)
+            .filter(TaxonDigestPeptide.taxon_digest_id == taxon_digest_id)
+        ]
+        save_taxon_digest_sketch(session, taxon_digest_id, peptide_ids)
+        sketches[taxon_digest_id] = (
+            MinHashSignature.from_ids(peptide_ids),
+            HyperLogLog.from_ids(peptide_ids))
+    if missing_ids:
+        session.commit()
+    return sketches
@@ -4,6 +4,7 @@ from proteomics.models import (Protease, Digest, TaxonDigest,
                                TaxonDigestPeptide, TaxonProtein, Taxon)
 from proteomics.services.digest_and_ingest import DigestAndIngestTask
 from proteomics.services.clear_taxon_data import ClearTaxonDataTask
+from proteomics.services import peptide_taxon_count
 from proteomics.config import CLEAVAGE_RULES as expasy_rules
 from sqlalchemy import create_engine
 import tempfile
@@ -55,6 +56,14 @@ class ClearTaxonDataTaskTestCase(unittest.TestCase):
         ingest_task.run()
 
         assert self.session.query(TaxonDigestPeptide).count() == 98
+        assert self.session.query(db.tables['TaxonDigestBitmap']).count() \
+                == 1
+        assert self.session.query(db.tables['TaxonDigestSketch']).count() \
+                == 1
+        assert self.session.query(
+            db.tables['TaxonDigestGeneration']).count() == 1
+        assert self.session.query(
+            db.tables['PeptideTaxonCount']).count() == 98
         assert self.session.query(TaxonDigest).count() == 1
         assert self.session.query(TaxonProtein).count() == 4
         assert self.session.query(Taxon).count() == 1
@@ -67,10 +76,41 @@ class ClearTaxonDataTaskTestCase(unittest.TestCase):
         clear_task.run()
 
         assert self.session.query(TaxonDigestPeptide).count() == 0
+        assert self.session.query(db.tables['TaxonDigestBitmap']).count() \
+                == 0
+        assert self.session.query(db.tables['TaxonDigestSketch']).count() \
+                == 0
+        assert self.session.query(
+            db.tables['TaxonDigestGeneration']).count() == 0
+        assert self.session.query(
+            db.tables['PeptideTaxonCount']).count() == 0
         assert self.session.query(TaxonDigest).count() == 0
         assert self.session.query(TaxonProtein).count() == 0
         assert self.session.query(Taxon).count() == 0
 
+    def test_clear_updates_peptide_taxon_counts(self):
+        logger = logging.getLogger('testLogger')
+        hndl, other_fasta_file = tempfile.mkstemp(suffix=".fasta")
+        os.close(hndl)
+        with open(other_fasta_file, 'wb') as fh:
+            fh.write(self.get_mock_fasta())
+        DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=[self.fasta_file, other_fasta_file],
+            digest=self.digest,
+            get_connection=self.get_connection
+        ).run()
+        ClearTaxonDataTask(
+            logger=logger,
+            get_connection=self.get_connection,
+            taxon_ids=[self.taxon_id]
+        ).run()
+        os.remove(other_fasta_file)
+        taxon_digest = self.session.query(TaxonDigest).one()
+        unique_peptides = list(peptide_taxon_count.get_taxon_digest_peptides(
+            self.session, taxon_digest, sharing='unique'))
+        self.assertEquals(len(unique_peptides), 98)
+
     def tearDown(self):
         os.remove(self.fasta_file)
 
@@ -0,0 +1,105 @@
+import unittest
+from proteomics import db
+from proteomics.models import (Digest, Taxon, TaxonDigest, Peptide,
+                               TaxonDigestPeptide)
+from proteomics.services import columnar_export
+from sqlalchemy import create_engine
+import tempfile
+import shutil
+import os
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def get_parquet_dictionary_columns(path):
+    import pyarrow.parquet as pq
+    metadata = pq.ParquetFile(path).metadata
+    row_group = metadata.row_group(0)
+    return [row_group.column(i).path_in_schema
+            for i in range(metadata.num_columns)
+            if 'PLAIN_DICTIONARY' in row_group.column(i).encodings or
+            'RLE_DICTIONARY' in row_group.column(i).encodings]
+
+
+class ColumnarExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        db.metadata.create_all(bind=self.engine)
+        self.session = db.get_session(bind=self.engine.connect())
+        digest = Digest(id=1)
+        self.taxon_digests = [
+            TaxonDigest(id=i, taxon=Taxon(id='taxon%s' % i), digest=digest)
+            for i in range(1, 2+1)]
+        peptides = [Peptide(id=i, sequence='PEP%s' % i, mass=float(i))
+                    for i in range(1, 5+1)]
+        self.session.add_all(self.taxon_digests + peptides)
+        self.session.add_all([
+            TaxonDigestPeptide(taxon_digest=td, peptide=peptide, count=td.id)
+            for td in self.taxon_digests for peptide in reversed(peptides)
+            if peptide.id % td.id == 0])
+        self.session.commit()
+        self.tmp_dir = tempfile.mkdtemp(prefix="colTest.")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_peptide_batches(self):
+        batches = list(columnar_export.get_peptide_batches(
+            self.session, batch_size=2))
+        self.assertEquals(batches, [
+            [[1, 2], ['PEP1', 'PEP2'], [1.0, 2.0]],
+            [[3, 4], ['PEP3', 'PEP4'], [3.0, 4.0]],
+            [[5], ['PEP5'], [5.0]]])
+
+    def test_get_taxon_digest_peptide_batches(self):
+        batches = list(columnar_export.get_taxon_digest_peptide_batches(
+            self.session, self.taxon_digests[1], batch_size=10))
+        self.assertEquals(batches, [[['taxon2', 'taxon2'], [2, 4], [2, 2]]])
+
+    def test_get_taxon_digest_path(self):
+        self.assertEquals(
+            columnar_export.get_taxon_digest_path(
+                'out', self.taxon_digests[0], format='arrow'),
+            os.path.join('out', 'taxon_digest_peptides', 'digest_id=1',
+                         'taxon_id=taxon1', 'part-0.arrow'))
+
+    @unittest.skipUnless(pyarrow, "requires pyarrow")
+    def test_export_columnar(self):
+        import pyarrow.parquet as pq
+        for format in columnar_export.FORMATS:
+            output_dir = os.path.join(self.tmp_dir, format)
+            columnar_export.export_columnar(
+                self.session, output_dir, self.taxon_digests, format=format,
+                batch_size=2)
+            peptides_path = os.path.join(
+                output_dir, 'peptides' + columnar_export.FORMATS[format])
+            path = columnar_export.get_taxon_digest_path(
+                output_dir, self.taxon_digests[1], format=format)
+            if format == 'parquet':
+                peptides = pq.read_table(peptides_path)
+                tdps = pq.read_table(path)
+            else:
+                peptides = pyarrow.ipc.open_file(
+                    pyarrow.memory_map(peptides_path)).read_all()
+                tdps = pyarrow.ipc.open_file(
+                    pyarrow.memory_map(path)).read_all()
+            self.assertEquals(peptides.to_pydict()['id'], [1, 2, 3, 4, 5])
+            self.assertEquals(tdps.to_pydict(), {
+                'taxon_id': ['taxon2', 'taxon2'], 'peptide_id': [2, 4],
+                'count': [2, 2]})
+            # Only the low-cardinality taxon_id column is dictionary-encoded.
+            self.assertTrue(pyarrow.types.is_dictionary(
+                tdps.schema.field('taxon_id').type))
+            self.assertFalse(pyarrow.types.is_dictionary(
+                tdps.schema.field('peptide_id').type))
+            if format == 'parquet':
+                self.assertEquals(get_parquet_dictionary_columns(path),
+                                  ['taxon_id'])
+                self.assertEquals(
+                    get_parquet_dictionary_columns(peptides_path), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,20 @@
 import unittest
 from proteomics import db
-from proteomics.models import Protease, Digest
+from proteomics.models import (Protease, Digest, Protein, Peptide, 
+                               TaxonProtein, TaxonDigest, TaxonDigestPeptide)
 from proteomics.services.digest_and_ingest import DigestAndIngestTask
+from proteomics.services.taxon_digest_bitmap import get_taxon_digest_bitmaps
+from proteomics.services import peptide_taxon_count
+from proteomics.util.bitmap import get_bitmap
+from proteomics.util.digest import cleave
 from proteomics.config import CLEAVAGE_RULES as expasy_rules
 from sqlalchemy import create_engine
+from collections import defaultdict
 import tempfile
+import gzip
 import os
 import logging
+import multiprocessing.pool
 
 
 class IngestAndDigestTestCase(unittest.TestCase):
@@ -56,6 +64,196 @@ class IngestAndDigestTestCase(unittest.TestCase):
         )
         stats = task.run()
 
+    def test_ingest_and_digest_w_workers(self):
+        logger = logging.getLogger('testLogger')
+        task = DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=[self.fasta_file],
+            digest=self.digest,
+            get_connection=self.get_connection,
+            num_workers=2,
+            bulk_load=True,
+        )
+        stats = task.run()
+        session = db.get_session(bind=self.get_connection())
+        self.assertEquals(session.query(Protein).count(), 3)
+        self.assertEquals(session.query(TaxonProtein).count(), 4)
+        self.assertEquals(session.query(Peptide).count(), 98)
+        self.assertEquals(session.query(TaxonDigestPeptide).count(), 98)
+        # Peptide compositions are added at ingest.
+        self.assertEquals(
+            session.query(db.tables['PeptideComposition']).count(), 98)
+
+    def test_ingest_w_workers_error(self):
+        logger = logging.getLogger('testLogger')
+        task = DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=[self.fasta_file + '.missing'],
+            digest=self.digest,
+            get_connection=self.get_connection,
+            num_workers=2,
+        )
+        self.assertRaises(OSError, task.run)
+        self.assertEquals(task.pool._state, multiprocessing.pool.TERMINATE)
+
+    def test_ingest_w_deferred_indexes(self):
+        logger = logging.getLogger('testLogger')
+        index_names = db.get_existing_index_names(bind=self.engine)
+        # Simulate an interrupted run, which left indexes dropped.
+        db.drop_deferrable_indexes(bind=self.engine)
+        task = DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=[self.fasta_file],
+            digest=self.digest,
+            get_connection=self.get_connection,
+            defer_indexes=True,
+        )
+        stats = task.run()
+        self.assertEquals(stats['TaxonDigestPeptide'], 98)
+        self.assertEquals(db.get_existing_index_names(bind=self.engine),
+                          index_names)
+
+    def test_ingest_into_db_w_earlier_schema(self):
+        logger = logging.getLogger('testLogger')
+        # Remove the tables and columns which were added to the schema
+        # after the db was created.
+        for table_name in ['peptide_composition', 'peptide_taxon_count',
+                           'taxon_digest_bitmap', 'taxon_digest_sketch',
+                           'taxon_digest_generation', 'redundancy_pair_count']:
+            self.engine.execute("DROP TABLE %s" % table_name)
+        for table_name in ['protein', 'peptide']:
+            self.engine.execute("DROP TABLE %s" % table_name)
+            self.engine.execute("CREATE TABLE %s (id INTEGER PRIMARY KEY,"
+                                " sequence VARCHAR, mass FLOAT)" % table_name)
+        self.engine.execute("INSERT INTO peptide (id, sequence, mass)"
+                            " VALUES (1, 'AAAAK', 0.0)")
+        task = DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=[self.fasta_file],
+            digest=self.digest,
+            get_connection=self.get_connection,
+        )
+        stats = task.run()
+        self.assertEquals(stats['TaxonDigestPeptide'], 98)
+        session = db.get_session(bind=self.get_connection())
+        self.assertEquals(session.query(Peptide).count(), 99)
+        self.assertEquals(session.query(Peptide)
+                          .filter(Peptide.sequence_hash == None).count(), 0)
+        self.assertEquals(
+            session.query(db.tables['PeptideComposition']).count(), 99)
+        self.assertEquals(
+            session.query(db.tables['PeptideTaxonCount']).count(), 98)
+
+    def test_taxon_digest_peptide_counts(self):
+        logger = logging.getLogger('testLogger')
+        # Second taxon has the same proteins, so its peptide counts
+        # come from proteins which were digested for the first taxon.
+        d = tempfile.mkdtemp(prefix="tst.")
+        fasta_files = []
+        for taxon_id in ['taxon1', 'taxon2']:
+            fasta_file = os.path.join(d, taxon_id + '.fasta')
+            with open(fasta_file, 'wb') as fh:
+                fh.write(self.get_mock_fasta())
+            fasta_files.append(fasta_file)
+        task = DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=fasta_files,
+            digest=self.digest,
+            get_connection=self.get_connection,
+        )
+        stats = task.run()
+        session = db.get_session(bind=self.get_connection())
+        counts = {}
+        for taxon_id in ['taxon1', 'taxon2']:
+            counts[taxon_id] = dict(
+                session.query(TaxonDigestPeptide.peptide_id,
+                              TaxonDigestPeptide.count)
+                .join(TaxonDigest)
+                .filter(TaxonDigest.taxon_id == taxon_id)
+            )
+        self.assertEquals(len(counts['taxon1']), 98)
+        self.assertEquals(sum(counts['taxon1'].values()), 163)
+        self.assertEquals(counts['taxon1'], counts['taxon2'])
+        # Bitmaps of each taxon digest's peptides are saved at ingest.
+        taxon_digest_ids = [td.id for td in session.query(TaxonDigest)]
+        self.assertEquals(session.query(db.tables['TaxonDigestBitmap'])
+                          .count(), 2)
+        bitmaps = get_taxon_digest_bitmaps(session, taxon_digest_ids)
+        for taxon_digest_id in taxon_digest_ids:
+            self.assertEquals(bitmaps[taxon_digest_id],
+                              get_bitmap(counts['taxon1'].keys()))
+        # Both taxons contain every peptide, so none are unique.
+        taxon_digest = session.query(TaxonDigest).first()
+        self.assertEquals(len(list(
+            peptide_taxon_count.get_taxon_digest_peptides(
+                session, taxon_digest, sharing='unique'))), 0)
+        shared_peptides = list(peptide_taxon_count.get_taxon_digest_peptides(
+            session, taxon_digest, sharing='shared'))
+        self.assertEquals(len(shared_peptides), 98)
+        self.assertEquals(set([row[2] for row in shared_peptides]), set([2]))
+        for fasta_file in fasta_files:
+            os.remove(fasta_file)
+
+    def test_taxon_digest_peptide_counts_w_repeated_protein(self):
+        logger = logging.getLogger('testLogger')
+        # The first protein is listed three times in one taxon's FASTA.
+        # Each entry counts once, rather than once per pair of entries.
+        protein_sequences = [
+            'MAKRAGKLLRAKPGGRMK',
+            'MAKRAGKLLRAKPGGRMK',
+            'GGKAKRMAKPL',
+            'MAKRAGKLLRAKPGGRMK',
+        ]
+        hndl, fasta_file = tempfile.mkstemp(prefix="taxon1.fasta.")
+        os.close(hndl)
+        with open(fasta_file, 'wb') as fh:
+            for i, sequence in enumerate(protein_sequences):
+                fh.write(">protein%s\n%s\n" % (i, sequence))
+        session = db.get_session(bind=self.get_connection())
+        digest = Digest(protease=session.query(Protease).one(),
+                        max_missed_cleavages=2)
+        session.add(digest)
+        session.commit()
+        task = DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=[fasta_file],
+            digest=digest,
+            get_connection=self.get_connection,
+        )
+        stats = task.run()
+        os.remove(fasta_file)
+        expected = defaultdict(int)
+        for sequence in protein_sequences:
+            for peptide in cleave(sequence, expasy_rules['trypsin'], 2):
+                expected[peptide] += 1
+        actual = dict(
+            session.query(Peptide.sequence, TaxonDigestPeptide.count)
+            .join(TaxonDigestPeptide)
+            .join(TaxonDigest)
+            .filter(TaxonDigest.digest_id == digest.id)
+        )
+        self.assertEquals(actual, dict(expected))
+        self.assertEquals(actual['MAKR'], 3)
+        self.assertEquals(actual['AK'], 1)
+
+    def test_ingest_gzipped_fasta(self):
+        logger = logging.getLogger('testLogger')
+        gz_file = self.fasta_file + '.gz'
+        with open(self.fasta_file, 'rb') as f_in:
+            f_out = gzip.open(gz_file, 'wb')
+            f_out.write(f_in.read())
+            f_out.close()
+        task = DigestAndIngestTask(
+            logger=logger,
+            fasta_paths=[gz_file],
+            digest=self.digest,
+            get_connection=self.get_connection,
+        )
+        stats = task.run()
+        os.remove(gz_file)
+        self.assertEquals(stats['TaxonProtein'], 4)
+        self.assertEquals(stats['TaxonDigestPeptide'], 98)
+
     def tearDown(self):
         os.remove(self.fasta_file)
 
@@ -0,0 +1,40 @@
+import unittest
+from proteomics import db
+from proteomics.models import Peptide
+from proteomics.services.peptide_id_cache import PeptideIdCache
+from sqlalchemy import create_engine
+
+
+class PeptideIdCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        db.metadata.create_all(bind=self.engine)
+        self.session = db.get_session(bind=self.engine.connect())
+        self.session.add_all([Peptide(id=i, sequence='PEP%s' % i)
+                              for i in range(1, 10+1)])
+        self.session.commit()
+
+    def test_warm_complete(self):
+        cache = PeptideIdCache(max_size=20)
+        self.assertEquals(cache.warm(self.session), 10)
+        self.assertTrue(cache.complete)
+        self.assertEquals(cache.get('PEP3'), 3)
+        self.assertEquals(cache.get('FOO'), None)
+
+    def test_warm_partial(self):
+        cache = PeptideIdCache(max_size=4)
+        self.assertEquals(cache.warm(self.session), 4)
+        self.assertFalse(cache.complete)
+        self.assertEquals(len(cache), 4)
+
+    def test_eviction(self):
+        cache = PeptideIdCache(max_size=4)
+        cache.warm(self.session)
+        cache.set('NEW1', 11)
+        cache.set('NEW2', 12)
+        self.assertTrue('NEW1' in cache)
+        self.assertTrue(len(cache) <= 4)
+        self.assertFalse(cache.complete)
+
+if __name__ == '__main__':
+    unittest.main()
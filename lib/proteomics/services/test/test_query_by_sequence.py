@@ -0,0 +1,171 @@
+import unittest
+from proteomics import db
+from proteomics.models import (Digest, Taxon, TaxonDigest)
+from proteomics.services import query_by_sequence
+from proteomics.util.sequence_hash import get_sequence_hash
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import logging
+import tempfile
+import shutil
+import os
+
+
+class QueryBySequenceTestCase(unittest.TestCase):
+    def setUp(self):
+
+        # Setup DB.
+        self.engine = create_engine('sqlite://')
+        db.metadata.create_all(bind=self.engine)
+        self.connection = self.engine.connect()
+        self.session = sessionmaker(bind=self.connection)()
+        self.index_dir = tempfile.mkdtemp(prefix="tidx.")
+
+        # Setup mock data.
+        taxon_digests = []
+        digest = Digest(id=1)
+        for t in range(1, 2+1):
+            taxon_digests.append(TaxonDigest(id=t, taxon=Taxon(id=t),
+                                             digest=digest))
+        self.session.add_all(taxon_digests)
+        self.session.commit()
+        self.add_peptides(self.get_peptide_sequences())
+
+    def add_peptides(self, sequences):
+        first_id = self.session.execute(
+            "SELECT COUNT(*) FROM peptide").scalar()
+        peptide_dicts = []
+        tdp_dicts = []
+        for i, sequence in enumerate(sequences):
+            peptide_id = first_id + i + 1
+            peptide_dicts.append({
+                'id': peptide_id, 'sequence': sequence,
+                'sequence_hash': get_sequence_hash(sequence)})
+            # Peptides with even ids are in taxon 2, all are in taxon 1.
+            for taxon_digest_id in [1, 2]:
+                if taxon_digest_id == 1 or (peptide_id % 2) == 0:
+                    tdp_dicts.append({'peptide_id': peptide_id,
+                                      'taxon_digest_id': taxon_digest_id})
+        self.session.execute(db.tables['Peptide'].insert(), peptide_dicts)
+        self.session.execute(db.tables['TaxonDigestPeptide'].insert(),
+                             tdp_dicts)
+        self.session.commit()
+
+    def get_peptide_sequences(self):
+        return ['PEPTIDE', 'PEPTIDES', 'PEPTYDE', 'PEPIDE', 'TIDE',
+                'ACDEFGHIK', 'ACDEFGHIR', 'MGLRSTLR', 'MGLRSTLRR']
+
+    def get_engine(self, engine_id):
+        return query_by_sequence.ENGINES[engine_id](
+            self.session, logger=logging.getLogger('testLogger'),
+            index_path=os.path.join(self.index_dir, engine_id))
+
+    def query(self, engine, sequences, max_distance, metric='levenshtein'):
+        return sorted(query_by_sequence.query_by_sequence(
+            self.session, sequences, max_distance=max_distance, 
+            engine=engine, metric=metric))
+
+    def test_scan(self):
+        engine = self.get_engine('scan')
+        actual = self.query(engine, ['PEPTIDE'], 1)
+        expected = [
+            ['PEPTIDE', '1', 0, 'PEPTIDE'],
+            ['PEPTIDE', '1', 1, 'PEPIDE'],
+            ['PEPTIDE', '1', 1, 'PEPTIDES'],
+            ['PEPTIDE', '1', 1, 'PEPTYDE'],
+            ['PEPTIDE', '2', 1, 'PEPIDE'],
+            ['PEPTIDE', '2', 1, 'PEPTIDES'],
+        ]
+        self.assertEquals(actual, expected)
+
+    def test_exact_matches(self):
+        actual = list(query_by_sequence.query_exact_matches(
+            self.session, ['PEPTIDES', 'XXXX', 'PEPTIDE', 'PEPTIDES']))
+        expected = [
+            ['PEPTIDES', '1', 0, 'PEPTIDES'],
+            ['PEPTIDES', '2', 0, 'PEPTIDES'],
+            ['PEPTIDE', '1', 0, 'PEPTIDE'],
+            ['PEPTIDES', '1', 0, 'PEPTIDES'],
+            ['PEPTIDES', '2', 0, 'PEPTIDES'],
+        ]
+        self.assertEquals(sorted(actual), sorted(expected))
+        # The temporary table is dropped after use.
+        self.assertEquals(len(list(query_by_sequence.query_exact_matches(
+            self.session, ['PEPTIDE']))), 1)
+
+    def test_engines_match_scan(self):
+        queries = ['PEPTIDE', 'ACDEFGHIK', 'MGLRSTLR', 'TIDE', 'XXXX']
+        scan_engine = self.get_engine('scan')
+        for engine_id in query_by_sequence.ENGINES:
+            engine = self.get_engine(engine_id)
+            if engine.metric != 'levenshtein':
+                continue
+            for max_distance in range(0, 4):
+                self.assertEquals(
+                    self.query(engine, queries, max_distance),
+                    self.query(scan_engine, queries, max_distance),
+                    "engine '%s', max_distance %s" % (engine_id, 
+                                                      max_distance))
+
+    def test_hamming(self):
+        engine = self.get_engine('hamming')
+        actual = self.query(engine, ['PEPTIDE'], 1, metric='hamming')
+        expected = [
+            ['PEPTIDE', '1', 0, 'PEPTIDE'],
+            ['PEPTIDE', '1', 1, 'PEPTYDE'],
+        ]
+        self.assertEquals(actual, expected)
+
+    def test_hamming_engines_match_scan(self):
+        queries = ['PEPTIDE', 'ACDEFGHIK', 'MGLRSTLR', 'TIDE', 'XXXX']
+        scan_engine = self.get_engine('scan')
+        for engine_id in query_by_sequence.ENGINES:
+            engine = self.get_engine(engine_id)
+            for max_distance in range(0, 5):
+                self.assertEquals(
+                    self.query(engine, queries, max_distance, 'hamming'),
+                    self.query(scan_engine, queries, max_distance, 'hamming'),
+                    "engine '%s', max_distance %s" % (engine_id, 
+                                                      max_distance))
+
+    def test_hamming_engine_requires_hamming_metric(self):
+        engine = self.get_engine('hamming')
+        self.assertRaises(ValueError, self.query, engine, ['PEPTIDE'], 1)
+        self.assertRaises(ValueError, self.query, engine, ['PEPTIDE'], 0)
+
+    def test_search_many(self):
+        queries = ['TIDE', 'PEPTIDE', 'XXXX', 'PEPTIDE']
+        for engine_id in query_by_sequence.ENGINES:
+            engine = self.get_engine(engine_id)
+            results = list(engine.search_many(queries, 1))
+            self.assertEquals([sequence for sequence, matches in results],
+                              queries)
+            self.assertEquals(
+                [sorted(matches) for sequence, matches in results],
+                [sorted(engine.search(query, 1)) for query in queries])
+
+    def test_bucket_engine_read_only(self):
+        # Peptides without compositions can't be synced in a read-only db,
+        # so the bucket engine falls back to a scan.
+        self.connection.execute("PRAGMA query_only = ON")
+        engine = self.get_engine('bucket')
+        self.assertEquals(sorted(engine.search('PEPTIDE', 1)),
+                          sorted(self.get_engine('scan').search('PEPTIDE', 1)))
+        self.assertTrue(engine.fallback_engine is not None)
+
+    def test_index_update(self):
+        # Build indexes, then add a peptide and check that new engines
+        # pick it up.
+        for engine_id in query_by_sequence.ENGINES:
+            engine = self.get_engine(engine_id)
+            self.assertEquals(list(engine.search('ACDEFGHIW', 0)), [])
+        self.add_peptides(['ACDEFGHIW'])
+        for engine_id in query_by_sequence.ENGINES:
+            engine = self.get_engine(engine_id)
+            self.assertEquals(len(list(engine.search('ACDEFGHIW', 0))), 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+if __name__ == '__main__':
+    unittest.main()
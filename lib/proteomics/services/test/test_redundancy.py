@@ -3,12 +3,17 @@ from proteomics import db
 from proteomics.models import (Digest, Taxon, TaxonDigest, Peptide, 
                                TaxonDigestPeptide)
 from proteomics.services import redundancy
+from proteomics.services import redundancy_cache
+from proteomics.util import bitmap
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
 import itertools
 import tempfile
+import shutil
 import os
 import logging
+import zlib
 
 
 class RedundancyTestCase(unittest.TestCase):
@@ -84,6 +89,200 @@ class RedundancyTestCase(unittest.TestCase):
             taxon_digests=taxon_digests
         )
 
+    def test_generate_redundancy_rows(self):
+        taxon_digests = self.session.query(TaxonDigest).all()
+        rows = redundancy.generate_redundancy_rows(
+            session=self.session, taxon_digests=taxon_digests)
+        self.assertEquals(rows.next(), ('individual_counts', ['|1|', 12]))
+        tables = redundancy.generate_redundancy_tables(
+            session=self.session, taxon_digests=taxon_digests)
+        self.assertEquals(sorted(tables.keys()),
+                          sorted(redundancy.get_table_ids()))
+        self.assertEquals(tables['individual_percents'], [
+            ['|1 ^ 2|/|1|', 50.0], ['|2 ^ 1|/|2|', 100.0],
+            ['|1 ^ 3|/|1|', 100.0/3], ['|3 ^ 1|/|3|', 100.0],
+            ['|2 ^ 3|/|2|', 100.0/3], ['|3 ^ 2|/|3|', 50.0]])
+
+    def test_generate_redundancy_rows_order(self):
+        td1, td2, td3 = self.session.query(TaxonDigest).order_by(
+            TaxonDigest.id).all()
+        tables = redundancy.generate_redundancy_tables(
+            session=self.session, taxon_digests=[td3, td1, td2])
+        # Individual counts are ordered by taxon id.
+        self.assertEquals(tables['individual_counts'],
+                          [['|1|', 12], ['|2|', 6], ['|3|', 4]])
+        # Pairs follow the order of the given taxon digests.
+        self.assertEquals(tables['intersection_counts'], [
+            ['|3 ^ 1|', 4], ['|3 ^ 2|', 2], ['|1 ^ 2|', 6]])
+        self.assertEquals(tables['union_percents'], [
+            ['|3 ^ 1|/|3 U 1|', 100.0 * 4/12],
+            ['|3 ^ 2|/|3 U 2|', 100.0 * 2/8],
+            ['|1 ^ 2|/|1 U 2|', 100.0 * 6/12]])
+        # Individual percents come in both directions for each pair.
+        self.assertEquals(tables['individual_percents'], [
+            ['|3 ^ 1|/|3|', 100.0], ['|1 ^ 3|/|1|', 100.0 * 4/12],
+            ['|3 ^ 2|/|3|', 50.0], ['|2 ^ 3|/|2|', 100.0 * 2/6],
+            ['|1 ^ 2|/|1|', 50.0], ['|2 ^ 1|/|2|', 100.0]])
+
+    def test_engines_match_sql(self):
+        taxon_digests = self.session.query(TaxonDigest).all()
+        expected = redundancy.generate_redundancy_tables(
+            session=self.session, taxon_digests=taxon_digests, engine='sql')
+        self.assertEquals(expected['intersection_counts'],
+                          [['|1 ^ 2|', 6], ['|1 ^ 3|', 4], ['|2 ^ 3|', 2]])
+        for engine in redundancy.COUNTERS:
+            actual = redundancy.generate_redundancy_tables(
+                session=self.session, taxon_digests=taxon_digests,
+                engine=engine)
+            self.assertEquals(expected, actual, "engine '%s'" % engine)
+
+    def test_sparse_counter(self):
+        empty_td = TaxonDigest(id=4, taxon=Taxon(id=4),
+                               digest=self.session.query(Digest).one())
+        self.session.add(empty_td)
+        self.session.commit()
+        td1, td2, td3 = self.session.query(TaxonDigest).filter(
+            TaxonDigest.id != 4).order_by(TaxonDigest.id).all()
+        counter = redundancy.SparseCounter(
+            self.session, [td1, td2, td3, empty_td])
+        self.assertEquals(counter.count_individual(td2), 6)
+        # |1 U 3| = |1| + |3| - |1 ^ 3|
+        self.assertEquals(counter.count_intersection_and_union((td3, td1)),
+                          (4, 12))
+        self.assertEquals(counter.count_individual(empty_td), 0)
+        self.assertEquals(
+            counter.count_intersection_and_union((td1, empty_td)), (0, 12))
+        self.assertFalse(4 in counter.individual_counts)
+        self.assertRaises(ValueError, counter.count_intersection_and_union,
+                          (td1, td2, td3))
+
+    def test_minhash_exact_pairs(self):
+        taxon_digests = self.session.query(TaxonDigest).all()
+        td1, td2 = taxon_digests[:2]
+        counter = redundancy.MinHashCounter(
+            self.session, taxon_digests, exact_pairs=[(td2, td1)])
+        self.assertEquals(counter.count_intersection_and_union((td1, td2)),
+                          (6, 12))
+        self.assertEquals(counter.count_individual(td1), 12)
+
+    def test_count_peptide_sharing(self):
+        taxon_digests = self.session.query(TaxonDigest).all()
+        histogram, subset_counts = redundancy.count_peptide_sharing(
+            self.session, taxon_digests)
+        self.assertEquals(histogram, {1: 4, 2: 6, 3: 2})
+        self.assertEquals(subset_counts, {
+            (1,): 4, (1, 2): 4, (1, 3): 2, (1, 2, 3): 2})
+
+    def test_sharing_tables(self):
+        taxon_digests = self.session.query(TaxonDigest).all()
+        tables = redundancy.generate_redundancy_tables(
+            session=self.session, taxon_digests=taxon_digests,
+            sharing_tables=True)
+        self.assertEquals(tables['sharing_histogram'], [
+            ['|in 1 of 3|', 4], ['|in 2 of 3|', 6], ['|in 3 of 3|', 2]])
+        self.assertEquals(tables['exclusive_intersection_counts'], [
+            ['|1| only', 4], ['|1 ^ 2| only', 4], ['|1 ^ 3| only', 2],
+            ['|1 ^ 2 ^ 3| only', 2]])
+        tables = redundancy.generate_redundancy_tables(
+            session=self.session, taxon_digests=taxon_digests)
+        self.assertFalse('sharing_histogram' in tables)
+
+    def test_bitmap_counter_resaves_int_bitmaps(self):
+        # Bitmaps used to be saved as the little-endian bytes of an int.
+        bitmap_table = db.tables['TaxonDigestBitmap']
+        self.session.execute(bitmap_table.insert(), [{
+            'taxon_digest_id': 1,
+            'bitmap': zlib.compress(bitmap.int_to_bytes(
+                sum([1 << i for i in range(1, 12+1)])))}])
+        self.session.commit()
+        taxon_digests = self.session.query(TaxonDigest).all()
+        counter = redundancy.BitmapCounter(self.session, taxon_digests)
+        self.assertEquals(counter.count_individual(taxon_digests[0]), 12)
+        data = self.session.execute(
+            select([bitmap_table.c.bitmap])
+            .where(bitmap_table.c.taxon_digest_id == 1)).scalar()
+        self.assertTrue(data.startswith(bitmap.FORMAT_TAG))
+
+    def test_sql_counter_cache(self):
+        taxon_digests = self.session.query(TaxonDigest).all()
+        td1, td2, td3 = taxon_digests
+        pair_count_table = db.tables['RedundancyPairCount']
+        counter = redundancy.SqlCounter(self.session, [td1, td2])
+        self.assertEquals(
+            self.session.query(pair_count_table).count(), 2)
+        self.assertEquals(list(counter.iter_pair_counts([(td1, td2)])),
+                          [((td1, td2), (6, 12))])
+        self.assertEquals(
+            self.session.query(pair_count_table).count(), 3)
+
+        # Adding a taxon digest only counts its pairs.
+        counter = redundancy.SqlCounter(self.session, taxon_digests)
+        pair_counts = dict(counter.iter_pair_counts(
+            itertools.combinations(taxon_digests, 2)))
+        self.assertEquals(
+            self.session.query(pair_count_table).count(), 6)
+        cached_counts = redundancy_cache.get_cached_pair_counts(
+            self.session, redundancy_cache.get_taxon_digest_generations(
+                self.session, [1, 2, 3]))
+        expected = dict([((td.id, td.id), (count, count)) for td, count in [
+            (td1, 12), (td2, 6), (td3, 4)]])
+        for (td_a, td_b), counts in pair_counts.iteritems():
+            expected[(td_a.id, td_b.id)] = counts
+        self.assertEquals(cached_counts, expected)
+        self.assertEquals(
+            redundancy_cache.get_cached_pair_counts(
+                self.session, redundancy_cache.get_taxon_digest_generations(
+                    self.session, [1, 2, 3]), keys=[(1, 3), (2, 2)]),
+            {(1, 3): (4, 12), (2, 2): (6, 6)})
+
+        # A new generation invalidates a taxon digest's cached counts.
+        redundancy_cache.set_taxon_digest_generation(self.session, 3)
+        cached_counts = redundancy_cache.get_cached_pair_counts(
+            self.session, redundancy_cache.get_taxon_digest_generations(
+                self.session, [1, 2, 3]))
+        self.assertEquals(sorted(cached_counts.keys()),
+                          [(1, 1), (1, 2), (2, 2)])
+
+    def test_sql_counter_counts_pairs_in_blocks(self):
+        taxon_digests = self.session.query(TaxonDigest).all()
+        pair_count_table = db.tables['RedundancyPairCount']
+        counter = redundancy.SqlCounter(self.session, taxon_digests,
+                                        block_size=2)
+        pair_counts = counter.iter_pair_counts(
+            itertools.combinations(taxon_digests, 2))
+        self.assertEquals(pair_counts.next()[1], (6, 12))
+        # Only the first block of pairs has been counted.
+        self.assertEquals(
+            self.session.query(pair_count_table).count(), 5)
+        self.assertEquals([counts for pair, counts in pair_counts],
+                          [(4, 12), (2, 8)])
+        self.assertEquals(
+            self.session.query(pair_count_table).count(), 6)
+
+    def test_sql_counter_w_workers(self):
+        d = tempfile.mkdtemp(prefix="trd.")
+        db_file = os.path.join(d, "redundancy.db.sqlite")
+        engine = create_engine('sqlite:///%s' % db_file)
+        db.metadata.create_all(bind=engine)
+        for table in db.metadata.sorted_tables:
+            rows = [dict(row) for row in self.session.execute(table.select())]
+            if rows:
+                engine.execute(table.insert(), rows)
+        session = db.get_session(bind=engine.connect())
+        taxon_digests = session.query(TaxonDigest).all()
+        counter = redundancy.SqlCounter(session, taxon_digests,
+                                        num_workers=2, block_size=2)
+        expected = redundancy.SqlCounter(self.session, taxon_digests,
+                                         use_cache=False)
+        self.assertEquals(counter.individual_counts,
+                          expected.individual_counts)
+        pairs = list(itertools.combinations(taxon_digests, 2))
+        self.assertEquals(list(counter.iter_pair_counts(pairs)),
+                          list(expected.iter_pair_counts(pairs)))
+        self.assertEquals(counter.pool, None)
+        session.close()
+        shutil.rmtree(d)
+
     def tearDown(self):
         pass
 
@@ -0,0 +1,146 @@
+import unittest
+from proteomics import db
+from proteomics.models import Peptide, TaxonDigestPeptide
+from proteomics.util.sequence_hash import get_sequence_hash
+from sqlalchemy import create_engine
+from sqlalchemy.sql import func
+import tempfile
+import shutil
+import os
+
+
+class DBTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        db.metadata.create_all(bind=self.engine)
+        self.session = db.get_session(bind=self.engine.connect())
+        self.session.add_all([Peptide(id=i, sequence='PEP%s' % i)
+                              for i in range(1, 25+1)])
+        self.session.execute(
+            db.tables['TaxonDigestPeptide'].insert(),
+            [{'peptide_id': i % 7, 'count': 1} for i in range(1, 25+1)])
+        self.session.commit()
+
+    def test_get_keyset_batched_results(self):
+        q = self.session.query(Peptide).order_by(Peptide.sequence)
+        actual = [peptide.id for peptide in 
+                  db.get_keyset_batched_results(q, Peptide.id, 10)]
+        self.assertEquals(actual, range(1, 25+1))
+
+    def test_get_keyset_batched_results_for_grouped_query(self):
+        q = (
+            self.session.query(TaxonDigestPeptide.peptide_id,
+                               func.sum(TaxonDigestPeptide.count))
+            .group_by(TaxonDigestPeptide.peptide_id)
+        )
+        actual = dict(db.get_keyset_batched_results(
+            q, TaxonDigestPeptide.peptide_id, 2))
+        self.assertEquals(actual, {0: 3, 1: 4, 2: 4, 3: 4, 4: 4, 5: 3, 6: 3})
+
+    def test_drop_and_ensure_indexes(self):
+        all_index_names = db.get_existing_index_names(bind=self.engine)
+        dropped_indexes = db.drop_deferrable_indexes(bind=self.engine)
+        self.assertTrue(dropped_indexes)
+        remaining_index_names = db.get_existing_index_names(bind=self.engine)
+        self.assertEquals(remaining_index_names, db.ingest_lookup_indexes)
+        created_indexes = db.ensure_indexes(bind=self.engine)
+        self.assertEquals(len(created_indexes), len(dropped_indexes))
+        self.assertEquals(db.get_existing_index_names(bind=self.engine),
+                          all_index_names)
+
+    def test_init_db_adds_sequence_hashes(self):
+        engine = create_engine('sqlite://')
+        connection = engine.connect()
+        # Create a db with tables from before sequence hashes existed.
+        connection.execute("CREATE TABLE protein (id INTEGER PRIMARY KEY,"
+                           " sequence VARCHAR, mass FLOAT)")
+        connection.execute("CREATE TABLE peptide (id INTEGER PRIMARY KEY,"
+                           " sequence VARCHAR, mass FLOAT)")
+        connection.execute("INSERT INTO peptide (id, sequence)"
+                           " VALUES (1, 'AAK'), (2, 'GGR')")
+        db.init_db(bind=connection)
+        actual = connection.execute(
+            "SELECT sequence, sequence_hash FROM peptide ORDER BY id"
+        ).fetchall()
+        expected = [(sequence, get_sequence_hash(sequence)) 
+                    for sequence in ['AAK', 'GGR']]
+        self.assertEquals(actual, expected)
+        self.assertTrue('ix_peptide_sequence_hash' in 
+                        db.get_existing_index_names(bind=connection))
+
+    def test_init_db_adds_peptide_taxon_counts(self):
+        engine = create_engine('sqlite://')
+        connection = engine.connect()
+        db.metadata.create_all(bind=connection)
+        connection.execute(
+            "CREATE INDEX ix_peptide_taxon_count_digest_id_taxon_count"
+            " ON peptide_taxon_count (digest_id, taxon_count)")
+        connection.execute(db.tables['TaxonDigest'].insert(), [
+            {'id': 1, 'taxon_id': 't1', 'digest_id': 1},
+            {'id': 2, 'taxon_id': 't2', 'digest_id': 1},
+        ])
+        connection.execute(db.tables['TaxonDigestPeptide'].insert(), [
+            {'taxon_digest_id': 1, 'peptide_id': 1},
+            {'taxon_digest_id': 1, 'peptide_id': 2},
+            {'taxon_digest_id': 2, 'peptide_id': 2},
+        ])
+        db.init_db(bind=connection)
+        actual = connection.execute(
+            "SELECT digest_id, peptide_id, taxon_count"
+            " FROM peptide_taxon_count ORDER BY peptide_id"
+        ).fetchall()
+        self.assertEquals(actual, [(1, 1, 1), (1, 2, 2)])
+        self.assertFalse('ix_peptide_taxon_count_digest_id_taxon_count' in
+                         db.get_existing_index_names(bind=connection))
+
+    def test_bulk_load_mode(self):
+        d = tempfile.mkdtemp(prefix="tdb.")
+        engine = create_engine('sqlite:///%s' % os.path.join(d, "foo"))
+        db.apply_sqlite_profile(engine, {'journal_mode': 'WAL', 
+                                         'synchronous': 'FULL'})
+        connection = engine.connect()
+        def get_synchronous():
+            return connection.execute("PRAGMA synchronous").scalar()
+        self.assertEquals(
+            connection.execute("PRAGMA journal_mode").scalar(), 'wal')
+        self.assertEquals(get_synchronous(), 2)
+        with db.bulk_load_mode(connection, {'synchronous': 'OFF'}):
+            self.assertEquals(get_synchronous(), 0)
+        self.assertEquals(get_synchronous(), 2)
+        connection.close()
+        shutil.rmtree(d)
+
+    def test_bulk_load_mode_w_transaction(self):
+        d = tempfile.mkdtemp(prefix="tdb.")
+        engine = create_engine('sqlite:///%s' % os.path.join(d, "foo"))
+        db.metadata.create_all(bind=engine)
+        connection = engine.connect()
+        def count_peptides():
+            return engine.execute("SELECT count(*) FROM peptide").scalar()
+        # Switching would commit an open transaction.
+        trans = connection.begin()
+        connection.execute("INSERT INTO peptide (id) VALUES (1)")
+        def enter_bulk_load_mode():
+            with db.bulk_load_mode(connection, {'synchronous': 'OFF'}):
+                pass
+        self.assertRaises(ValueError, enter_bulk_load_mode)
+        trans.rollback()
+        self.assertEquals(count_peptides(), 0)
+        # A transaction left open by an error is not committed on exit, and
+        # the error is not replaced by one from restoring the settings.
+        class BulkLoadError(Exception):
+            pass
+        transactions = []
+        def fail_bulk_load():
+            with db.bulk_load_mode(connection, {'synchronous': 'OFF'}):
+                transactions.append(connection.begin())
+                connection.execute("INSERT INTO peptide (id) VALUES (1)")
+                raise BulkLoadError()
+        self.assertRaises(BulkLoadError, fail_bulk_load)
+        transactions[0].rollback()
+        self.assertEquals(count_peptides(), 0)
+        connection.close()
+        shutil.rmtree(d)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+"""
+Compressed bitmaps over integer ids, e.g. peptide ids.
+
+As in Roaring bitmaps (Chambi et al., 'Better bitmap performance with
+Roaring bitmaps', 2016), ids are split into chunks of 2**16 ids by their
+high bits, and each non-empty chunk has a container for the low 16 bits of
+its ids:
+    - sparse chunks, with at most 4096 ids, have a sorted array('H') of
+      ids, 2 bytes per id.
+    - dense chunks have an int with bit i set for id i, 8 KB per chunk.
+Empty chunks take no space, so memory is proportional to the number of ids
+rather than to the largest id. The number of ids in each container is
+cached, so individual counts are free, and union counts follow from
+intersection counts by inclusion-exclusion. Intersections only visit
+chunks which are in both bitmaps.
+
+For storage, bitmaps are serialized as a format tag followed by their
+zlib-compressed containers. Bitmaps saved in the older format, as
+zlib-compressed little-endian bytes of a single int, can still be read.
+"""
+from array import array
+import binascii
+import itertools
+import struct
+import zlib
+
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+CHUNK_NUM_BYTES = (1 << CHUNK_BITS)/8
+MAX_ARRAY_SIZE = 4096
+FORMAT_TAG = 'RBM1'
+POPCOUNT_TABLE = ''.join([chr(bin(i).count('1')) for i in range(256)])
+
+def popcount(bits):
+    """ Count the bits set in an int, with a byte lookup table. """
+    return sum(bytearray(int_to_bytes(bits).translate(POPCOUNT_TABLE)))
+
+def int_to_bytes(bits):
+    """ Get the little-endian bytes of an int. """
+    hex_str = '%x' % bits
+    if len(hex_str) % 2:
+        hex_str = '0' + hex_str
+    return binascii.unhexlify(hex_str)[::-1]
+
+def bytes_to_int(buf):
+    """ Get the int for little-endian bytes. """
+    buf = str(buf)
+    if not buf:
+        return 0
+    return int(binascii.hexlify(buf[::-1]), 16)
+
+def get_set_bits(buf, offset=0):
+    """ Yields offset + i for each bit i set in little-endian bytes. """
+    for byte_index, byte in enumerate(bytearray(buf)):
+        if byte:
+            for bit in range(8):
+                if byte & (1 << bit):
+                    yield offset + (byte_index << 3) + bit
+
+def get_container(low_ids):
+    """ Get a container for a sorted list of distinct low ids. """
+    if len(low_ids) <= MAX_ARRAY_SIZE:
+        return array('H', low_ids)
+    buf = bytearray(CHUNK_NUM_BYTES)
+    for i in low_ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return bytes_to_int(buf)
+
+def get_bits_container(bits):
+    """ Get a container for the ids set in an int. """
+    if popcount(bits) <= MAX_ARRAY_SIZE:
+        return array('H', get_set_bits(int_to_bytes(bits)))
+    return bits
+
+def get_container_ids(container):
+    if isinstance(container, array):
+        return container
+    return list(get_set_bits(int_to_bytes(container)))
+
+def get_container_size(container):
+    if isinstance(container, array):
+        return len(container)
+    return popcount(container)
+
+def count_container_intersection(container1, container2):
+    is_array1 = isinstance(container1, array)
+    is_array2 = isinstance(container2, array)
+    if is_array1 and is_array2:
+        if len(container1) > len(container2):
+            container1, container2 = container2, container1
+        return len(set(container1).intersection(container2))
+    if is_array2:
+        container1, container2 = container2, container1
+    elif not is_array1:
+        return popcount(container1 & container2)
+    # Look up the array's ids in the bitset's bytes.
+    buf = bytearray(int_to_bytes(container2))
+    buf.extend('\x00' * (CHUNK_NUM_BYTES - len(buf)))
+    return len([i for i in container1 if buf[i >> 3] & (1 << (i & 7))])
+
+class Bitmap(object):
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+        self.sizes = dict([(key, get_container_size(container))
+                           for key, container in self.containers.iteritems()])
+        self.size = sum(self.sizes.values())
+
+    @classmethod
+    def from_ids(cls, ids):
+        containers = {}
+        for key, chunk_ids in itertools.groupby(
+            sorted(set(ids)), key=lambda i: i >> CHUNK_BITS):
+            containers[key] = get_container(
+                [i & CHUNK_MASK for i in chunk_ids])
+        return cls(containers)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for key in sorted(self.containers.keys()):
+            offset = key << CHUNK_BITS
+            for i in get_container_ids(self.containers[key]):
+                yield offset + i
+
+    def __eq__(self, other):
+        return (isinstance(other, Bitmap) and
+                self.sizes == other.sizes and
+                self.containers == other.containers)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def intersection_count(self, other):
+        """ Count the ids in both this bitmap and another bitmap. """
+        if len(self.containers) > len(other.containers):
+            return other.intersection_count(self)
+        count = 0
+        for key, container in self.containers.iteritems():
+            other_container = other.containers.get(key)
+            if other_container is not None:
+                count += count_container_intersection(
+                    container, other_container)
+        return count
+
+    def union_count(self, other):
+        """ Count the ids in either this bitmap or another bitmap. """
+        return len(self) + len(other) - self.intersection_count(other)
+
+    def __and__(self, other):
+        containers = {}
+        for key, container in self.containers.iteritems():
+            other_container = other.containers.get(key)
+            if other_container is None:
+                continue
+            if not (isinstance(container, array) or
+                    isinstance(other_container, array)):
+                new_container = get_bits_container(container & other_container)
+            else:
+                new_container = get_container(sorted(
+                    set(get_container_ids(container)).intersection(
+                        get_container_ids(other_container))))
+            if not (isinstance(new_container, array) and
+                    len(new_container) == 0):
+                containers[key] = new_container
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for key, other_container in other.containers.iteritems():
+            container = containers.get(key)
+            if container is None:
+                containers[key] = other_container
+            elif not (isinstance(container, array) or
+                      isinstance(other_container, array)):
+                containers[key] = container | other_container
+            else:
+                containers[key] = get_container(sorted(
+                    set(get_container_ids(container)).union(
+                        get_container_ids(other_container))))
+        return Bitmap(containers)
+
+def get_bitmap(ids):
+    """ Get a bitmap of the given ids. """
+    return Bitmap.from_ids(ids)
+
+def serialize_bitmap(bitmap):
+    parts = [struct.pack('<I', len(bitmap.containers))]
+    for key in sorted(bitmap.containers.keys()):
+        container = bitmap.containers[key]
+        if isinstance(container, array):
+            parts.append(struct.pack('<IBI', key, 0, len(container)))
+            parts.append(container.tostring())
+        else:
+            parts.append(struct.pack('<IBI', key, 1, CHUNK_NUM_BYTES))
+            buf = int_to_bytes(container)
+            parts.append(buf + '\x00' * (CHUNK_NUM_BYTES - len(buf)))
+    return FORMAT_TAG + zlib.compress(''.join(parts))
+
+def deserialize_bitmap(data):
+    if not data.startswith(FORMAT_TAG):
+        # Bitmap saved as the bytes of a single int.
+        return Bitmap.from_ids(get_set_bits(zlib.decompress(data)))
+    buf = zlib.decompress(data[len(FORMAT_TAG):])
+    num_containers = struct.unpack_from('<I', buf)[0]
+    pos = 4
+    containers = {}
+    header_size = struct.calcsize('<IBI')
+    for i in range(num_containers):
+        key, kind, length = struct.unpack_from('<IBI', buf, pos)
+        pos += header_size
+        if kind == 0:
+            container = array('H')
+            container.fromstring(buf[pos:pos + 2 * length])
+            pos += 2 * length
+        else:
+            container = bytes_to_int(buf[pos:pos + length])
+            pos += length
+        containers[key] = container
+    return Bitmap(containers)
@@ -0,0 +1,90 @@
+"""
+BK-trees: a metric index for finding terms within a given distance of a
+query term. See Burkhard & Keller, 'Some approaches to best-match file
+searching', CACM 1973.
+"""
+from proteomics.util.distance import levenshtein
+import marshal
+import os
+
+
+class BKTree(object):
+    """ A BK-tree over sequence terms. Each term carries a value, e.g. a
+    peptide id.
+
+    Nodes are stored in parallel lists, with the children of node i
+    stored in children[i] as a {distance: child node} dict. This keeps the
+    tree compact, and lets it be saved with marshal.
+    """
+    def __init__(self, distance=levenshtein):
+        self.distance = distance
+        self.terms = []
+        self.values = []
+        self.children = []
+
+    def __len__(self):
+        return len(self.terms)
+
+    def add(self, term, value=None):
+        """ Add a term to the tree. Terms which are already in the tree
+        are ignored. """
+        if not self.terms:
+            self._add_node(term, value)
+            return
+        node = 0
+        while True:
+            d = self.distance(term, self.terms[node])
+            if d == 0:
+                return
+            child = self.children[node].get(d)
+            if child is None:
+                self.children[node][d] = self._add_node(term, value)
+                return
+            node = child
+
+    def _add_node(self, term, value):
+        self.terms.append(term)
+        self.values.append(value)
+        self.children.append({})
+        return len(self.terms) - 1
+
+    def search(self, term, max_distance):
+        """ Find terms within max_distance of a term. Yields (value,
+        matched term, distance) tuples. Only subtrees which can contain
+        matches are visited, per the triangle inequality. """
+        if not self.terms:
+            return
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            d = self.distance(term, self.terms[node])
+            if d <= max_distance:
+                yield (self.values[node], self.terms[node], d)
+            for child_distance, child in self.children[node].iteritems():
+                if d - max_distance <= child_distance <= d + max_distance:
+                    stack.append(child)
+
+    def save(self, path, **attrs):
+        """ Save the tree to a file, along with any extra attributes. """
+        data = {
+            'terms': self.terms,
+            'values': self.values,
+            'children': self.children,
+            'attrs': attrs,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(data, f)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, distance=levenshtein):
+        """ Load a tree from a file. Returns the tree and its saved
+        attributes. """
+        with open(path, 'rb') as f:
+            data = marshal.load(f)
+        tree = cls(distance=distance)
+        tree.terms = data['terms']
+        tree.values = data['values']
+        tree.children = data['children']
+        return tree, data['attrs']
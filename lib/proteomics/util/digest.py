@@ -1,12 +1,108 @@
-from collections import deque
-from itertools import chain
+from array import array
+from itertools import islice, izip
 import re
 
 
+# Rules which cleave after a single residue, e.g. 'arg-c' ('R'). These
+# can be cleaved with str.find instead of a regular expression.
+SINGLE_RESIDUE_RULE = re.compile(r'^[A-Z]$')
+
+class Cleaver(object):
+    """ Cleaves polypeptide sequences using a given rule.
+    The rule is compiled once, so a cleaver should be reused for all
+    proteins in a digest.
+
+    Parameters
+    ----------
+    rule : str    
+        A string with a regular expression describing the C-terminal site of
+        cleavage.    
+    max_missed_cleavages : int, optional
+        The maximal number of allowed missed cleavages. Defaults to 0.
+    min_acids : int, optional
+        Ignore peptides shorter than this.
+    max_acids : int, optional
+        Ignore peptides longer than this.
+    """
+    def __init__(self, rule, max_missed_cleavages=0, min_acids=None,
+                 max_acids=None):
+        self.rule = rule
+        self.max_missed_cleavages = max_missed_cleavages or 0
+        self.min_acids = min_acids or 1
+        self.max_acids = max_acids
+        if SINGLE_RESIDUE_RULE.match(rule):
+            self.residue = rule
+            self.regex = None
+        else:
+            self.residue = None
+            self.regex = re.compile(rule)
+
+    def get_cleavage_sites(self, sequence):
+        """ Get cleavage sites for a sequence, as an array of ints.
+        The array starts with 0 and ends with len(sequence), and a peptide
+        spans sequence[sites[i]:sites[j]]. """
+        sites = array('l', [0])
+        if self.residue:
+            find = sequence.find
+            residue = self.residue
+            i = find(residue)
+            while i != -1:
+                sites.append(i + 1)
+                i = find(residue, i + 1)
+        else:
+            sites.extend([match.end() for match in 
+                          self.regex.finditer(sequence)])
+        # The rule can match at the end of the sequence, e.g. 'K' for a
+        # sequence ending in K, which already makes the terminal site.
+        if sites[-1] != len(sequence):
+            sites.append(len(sequence))
+        return sites
+
+    def get_peptide_spans(self, sequence):
+        """ Get (start, end) spans of peptides in a sequence. Peptides are
+        filtered by length before any substrings are made. """
+        sites = self.get_cleavage_sites(sequence)
+        min_acids = self.min_acids
+        max_acids = self.max_acids
+        if max_acids is None:
+            max_acids = len(sequence)
+        # Fast path for digests without missed cleavages: peptides span
+        # consecutive sites.
+        if not self.max_missed_cleavages:
+            return [(start, end) for start, end in 
+                    izip(sites, islice(sites, 1, None))
+                    if min_acids <= end - start <= max_acids]
+        spans = []
+        window = self.max_missed_cleavages + 1
+        for k in xrange(1, len(sites)):
+            end = sites[k]
+            for j in xrange(max(0, k - window), k):
+                start = sites[j]
+                if min_acids <= end - start <= max_acids:
+                    spans.append((start, end,))
+        return spans
+
+    def cleave(self, sequence):
+        """ Get a list of peptides for a sequence. """
+        return [sequence[start:end] for start, end in 
+                self.get_peptide_spans(sequence)]
+
+_cleavers = {}
+
+def get_cleaver(rule, max_missed_cleavages=0, min_acids=None,
+                max_acids=None):
+    """ Get a cached Cleaver for the given parameters. """
+    key = (rule, max_missed_cleavages, min_acids, max_acids)
+    cleaver = _cleavers.get(key)
+    if cleaver is None:
+        cleaver = Cleaver(*key)
+        _cleavers[key] = cleaver
+    return cleaver
+
 def cleave(sequence, rule, max_missed_cleavages=0, min_acids=None,
            max_acids=None):
     """Cleaves a polypeptide sequence using a given rule.
-    Taken from pyteomics.parser .
+    Adapted from pyteomics.parser .
     
     Parameters
     ----------
@@ -30,18 +126,5 @@ def cleave(sequence, rule, max_missed_cleavages=0, min_acids=None,
     >>> cleave('AKAKBKCK', expasy_rules['trypsin'], 2)
     ['AK', 'AKAK', 'AK', 'AKAKBK', 'AKBK', 'BK', 'AKBKCK', 'BKCK', 'CK']
     """
-    peptides = []
-    cleavage_sites = deque([0], maxlen=max_missed_cleavages+2)
-    for i in chain(map(lambda x: x.end(), re.finditer(rule, sequence)),
-                   [None]):
-        cleavage_sites.append(i)
-        for j in range(0, len(cleavage_sites)-1):
-            peptide = sequence[cleavage_sites[j]:cleavage_sites[-1]]
-            if peptide == '': 
-                continue
-            if min_acids is not None and len(peptide) < min_acids:
-                continue
-            if max_acids is not None and len(peptide) > max_acids:
-                continue
-            peptides.append(peptide)
-    return peptides
+    return get_cleaver(rule, max_missed_cleavages, min_acids=min_acids,
+                       max_acids=max_acids).cleave(sequence)
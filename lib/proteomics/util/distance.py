@@ -0,0 +1,123 @@
+from itertools import izip
+
+
+# Residues counted in composition signatures. Residues outside of this
+# alphabet are not counted, which keeps composition distances a lower bound
+# on edit distances.
+COMPOSITION_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_composition_indices = dict(
+    (residue, i) for i, residue in enumerate(COMPOSITION_ALPHABET))
+
+def get_match_vectors(pattern):
+    """ Get a {residue: bit vector} dict, in which bit i of a residue's
+    vector is set if pattern[i] is that residue. """
+    match_vectors = {}
+    for i, residue in enumerate(pattern):
+        match_vectors[residue] = match_vectors.get(residue, 0) | (1 << i)
+    return match_vectors
+
+def _levenshtein(match_vectors, pattern_length, text, max_distance=None):
+    """ Myers' bit-parallel edit distance, in the global form given by
+    Hyyro. Column j of the DP matrix is encoded as bit vectors of its
+    vertical +1/-1 deltas (pv/mv). Python ints serve as bit vectors of any
+    length, so patterns are not limited to the machine word size. """
+    text_length = len(text)
+    if max_distance is not None and \
+       abs(pattern_length - text_length) > max_distance:
+        return max_distance + 1
+    if pattern_length == 0:
+        return text_length
+    mask = (1 << pattern_length) - 1
+    high_bit = 1 << (pattern_length - 1)
+    pv = mask
+    mv = 0
+    score = pattern_length
+    for j, residue in enumerate(text):
+        eq = match_vectors.get(residue, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high_bit:
+            score += 1
+        elif mh & high_bit:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+        # The score changes by at most 1 per remaining text residue.
+        if max_distance is not None and \
+           score - (text_length - j - 1) > max_distance:
+            return max_distance + 1
+    return score
+
+def levenshtein(s1, s2, max_distance=None):
+    """ Get the Levenshtein (edit) distance between two sequences.
+    If max_distance is given, returns max_distance + 1 as soon as the
+    distance is known to exceed max_distance. """
+    return _levenshtein(get_match_vectors(s1), len(s1), s2,
+                        max_distance=max_distance)
+
+def levenshtein_many(query, sequences, max_distance=None):
+    """ Get the Levenshtein distances between a query and each of a list of
+    sequences. The query's bit vectors are computed once and shared. """
+    match_vectors = get_match_vectors(query)
+    query_length = len(query)
+    return [_levenshtein(match_vectors, query_length, sequence,
+                         max_distance=max_distance)
+            for sequence in sequences]
+
+def hamming(s1, s2, max_distance=None):
+    """ Get the Hamming distance (number of substitutions) between two
+    sequences of the same length. If max_distance is given, returns
+    max_distance + 1 as soon as the distance is known to exceed
+    max_distance. """
+    if len(s1) != len(s2):
+        raise ValueError("Hamming distance is only defined for sequences of"
+                         " the same length")
+    distance = 0
+    for c1, c2 in izip(s1, s2):
+        if c1 != c2:
+            distance += 1
+            if max_distance is not None and distance > max_distance:
+                return distance
+    return distance
+
+def get_deletion_neighborhood(sequence, max_deletions):
+    """ Get the set of sequences which can be made by deleting at most
+    max_deletions residues from a sequence. Two sequences are within edit
+    distance k of each other only if their k-deletion neighborhoods
+    intersect, so neighborhoods can serve as candidate keys. """
+    neighborhood = set([sequence])
+    frontier = neighborhood
+    for i in range(max_deletions):
+        next_frontier = set()
+        for variant in frontier:
+            for j in range(len(variant)):
+                next_frontier.add(variant[:j] + variant[j+1:])
+        next_frontier -= neighborhood
+        neighborhood |= next_frontier
+        frontier = next_frontier
+    return neighborhood
+
+def get_composition(sequence):
+    """ Get a list of residue counts for a sequence. """
+    counts = [0] * len(COMPOSITION_ALPHABET)
+    for residue in sequence:
+        i = _composition_indices.get(residue)
+        if i is not None:
+            counts[i] += 1
+    return counts
+
+def format_composition(counts):
+    return ','.join([str(count) for count in counts])
+
+def parse_composition(composition):
+    return [int(count) for count in composition.split(',')]
+
+def composition_distance(counts1, counts2):
+    """ Get the L1 distance between two composition count lists.
+    A single edit changes the L1 distance by at most 2, so two sequences
+    within edit distance k have a composition distance of at most 2k. """
+    return sum([abs(c1 - c2) for c1, c2 in izip(counts1, counts2)])
@@ -0,0 +1,87 @@
+"""
+Segment indexes: find candidate terms within a given Hamming distance of a
+query term.
+
+Each term is split into n + 1 segments. By the pigeonhole principle, a
+term of the same length which differs from a query in at most n positions
+matches at least one of the query's segments exactly. Segments are keyed
+by term length and segment number, so each key only covers terms of one
+length.
+"""
+from collections import defaultdict
+from array import array
+import marshal
+import os
+
+
+def get_segment_bounds(length, num_segments):
+    """ Get (start, end) bounds of num_segments near-equal segments of a
+    term of the given length. """
+    return [(i * length / num_segments, (i + 1) * length / num_segments)
+            for i in range(num_segments)]
+
+def get_segment_keys(term, num_segments):
+    return ['%s:%s:%s' % (len(term), i, term[start:end])
+            for i, (start, end) in enumerate(
+                get_segment_bounds(len(term), num_segments))]
+
+class HammingIndex(object):
+    """ An index from segment keys to the values (e.g. peptide ids) of the
+    terms which contain them. Supports queries with max distances up to
+    max_distance.
+
+    Posting lists are stored as unsigned int arrays, so values must be
+    non-negative integers below 2**32.
+    """
+    def __init__(self, max_distance=2):
+        self.max_distance = max_distance
+        self.postings = defaultdict(lambda: array('I'))
+        self.num_terms = 0
+
+    def __len__(self):
+        return self.num_terms
+
+    def add(self, term, value):
+        for key in get_segment_keys(term, self.max_distance + 1):
+            self.postings[key].append(value)
+        self.num_terms += 1
+
+    def get_candidates(self, term, max_distance):
+        """ Get the values of terms which may be within max_distance of a
+        term. Returns None if max_distance is greater than the index's max
+        distance. """
+        if max_distance > self.max_distance:
+            return None
+        candidates = set()
+        for key in get_segment_keys(term, self.max_distance + 1):
+            candidates.update(self.postings.get(key, ()))
+        return list(candidates)
+
+    def save(self, path, **attrs):
+        """ Save the index to a file, along with any extra attributes. """
+        data = {
+            'max_distance': self.max_distance,
+            'num_terms': self.num_terms,
+            'postings': dict([
+                (key, posting.tostring())
+                for key, posting in self.postings.iteritems()]),
+            'attrs': attrs,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(data, f)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Load an index from a file. Returns the index and its saved
+        attributes. """
+        with open(path, 'rb') as f:
+            data = marshal.load(f)
+        index = cls(max_distance=data['max_distance'])
+        index.num_terms = data['num_terms']
+        for key, posting_str in data['postings'].iteritems():
+            posting = array('I')
+            posting.fromstring(posting_str)
+            index.postings[key] = posting
+        return index, data['attrs']
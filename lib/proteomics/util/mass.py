@@ -1,14 +1,49 @@
 from proteomics import config
-from collections import defaultdict
+from array import array
 
 
 default_aa_masses = getattr(config, 'AA_MASSES', {})
 
+# Residue masses are summed as integers, in units of 10^-MASS_DECIMALS Da.
+# This makes sequence masses independent of the order residues are summed
+# in, so that a peptide mass computed from a protein's prefix masses is the
+# same as the mass computed from the peptide itself.
+MASS_DECIMALS = 5
+MASS_SCALE = float(10**MASS_DECIMALS)
+
+def get_scaled_aa_masses(aa_masses=default_aa_masses):
+    scaled_aa_masses = {}
+    for residue, mass in aa_masses.items():
+        scaled_aa_masses[residue] = int(round(mass * MASS_SCALE))
+    return scaled_aa_masses
+
+default_scaled_aa_masses = get_scaled_aa_masses(default_aa_masses)
+
+def _get_scaled_aa_masses(aa_masses):
+    if aa_masses is default_aa_masses:
+        return default_scaled_aa_masses
+    return get_scaled_aa_masses(aa_masses)
+
 def get_aa_sequence_mass(sequence, aa_masses=default_aa_masses):
-    residue_histogram = defaultdict(int)
-    for residue in sequence:
-        residue_histogram[residue] += 1
-    mass = 0.0
-    for residue, count in residue_histogram.items():
-        mass += count * aa_masses[residue]
-    return mass
+    return get_aa_sequence_masses([sequence], aa_masses=aa_masses)[0]
+
+def get_aa_sequence_masses(sequences, aa_masses=default_aa_masses):
+    """ Get masses for a list of sequences. """
+    get_residue_mass = _get_scaled_aa_masses(aa_masses).__getitem__
+    return [sum(map(get_residue_mass, sequence)) / MASS_SCALE 
+            for sequence in sequences]
+
+def get_prefix_masses(sequence, aa_masses=default_aa_masses):
+    """ Get scaled prefix masses for a sequence, such that the mass of
+    sequence[start:end] is get_span_mass(prefix_masses, start, end).
+    Raises a KeyError if the sequence contains an unknown residue. """
+    get_residue_mass = _get_scaled_aa_masses(aa_masses).__getitem__
+    prefix_masses = array('d', [0])
+    total = 0
+    for residue_mass in map(get_residue_mass, sequence):
+        total += residue_mass
+        prefix_masses.append(total)
+    return prefix_masses
+
+def get_span_mass(prefix_masses, start, end):
+    return (prefix_masses[end] - prefix_masses[start]) / MASS_SCALE
@@ -0,0 +1,87 @@
+"""
+q-gram inverted indexes: find candidate terms within a given edit distance
+of a query term, by counting the q-grams (substrings of length q) they share.
+
+Per the q-gram lemma, each edit to a term removes at most q of its
+q-grams. So a term within edit distance k of a query must contain at least
+(number of distinct q-grams in the query) - k * q of the query's distinct
+q-grams. See Ukkonen, 'Approximate string-matching with q-grams and maximal
+matches', Theoretical Computer Science 1992.
+"""
+from collections import defaultdict
+from array import array
+import marshal
+import os
+
+
+def get_qgrams(term, q):
+    """ Get the set of distinct q-grams in a term. """
+    return set([term[i:i+q] for i in range(len(term) - q + 1)])
+
+class QGramIndex(object):
+    """ An inverted index from q-grams to the values (e.g. peptide ids) of
+    the terms which contain them.
+
+    Posting lists are stored as unsigned int arrays, so values must be
+    non-negative integers below 2**32.
+    """
+    def __init__(self, q=3):
+        self.q = q
+        self.postings = defaultdict(lambda: array('I'))
+        self.num_terms = 0
+
+    def __len__(self):
+        return self.num_terms
+
+    def add(self, term, value):
+        for qgram in get_qgrams(term, self.q):
+            self.postings[qgram].append(value)
+        self.num_terms += 1
+
+    def get_candidates(self, term, max_distance):
+        """ Get the values of terms which may be within max_distance of a
+        term. Returns None if the q-gram lemma can not rule out any terms,
+        e.g. for short terms or large distances. In that case callers
+        should fall back to checking every term. """
+        qgrams = get_qgrams(term, self.q)
+        threshold = len(qgrams) - max_distance * self.q
+        if threshold <= 0:
+            return None
+        counts = defaultdict(int)
+        for qgram in qgrams:
+            posting = self.postings.get(qgram)
+            if posting is None:
+                continue
+            for value in posting:
+                counts[value] += 1
+        return [value for value, count in counts.iteritems()
+                if count >= threshold]
+
+    def save(self, path, **attrs):
+        """ Save the index to a file, along with any extra attributes. """
+        data = {
+            'q': self.q,
+            'num_terms': self.num_terms,
+            'postings': dict([
+                (qgram, posting.tostring())
+                for qgram, posting in self.postings.iteritems()]),
+            'attrs': attrs,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(data, f)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Load an index from a file. Returns the index and its saved
+        attributes. """
+        with open(path, 'rb') as f:
+            data = marshal.load(f)
+        index = cls(q=data['q'])
+        index.num_terms = data['num_terms']
+        for qgram, posting_str in data['postings'].iteritems():
+            posting = array('I')
+            posting.fromstring(posting_str)
+            index.postings[qgram] = posting
+        return index, data['attrs']
@@ -0,0 +1,8 @@
+import hashlib
+import struct
+
+
+def get_sequence_hash(sequence):
+    """ Get a fixed-width hash of an amino acid sequence, as a signed 64-bit
+    integer (so that it fits in a SQLite INTEGER column). """
+    return struct.unpack('<q', hashlib.md5(sequence).digest()[:8])[0]
@@ -0,0 +1,114 @@
+"""
+Sketches of sets of integer ids, e.g. peptide ids, for approximate set
+comparisons.
+
+- MinHashSignature: a bottom-k MinHash signature, which keeps the k
+  smallest hashes of a set's ids. The Jaccard similarity of two sets is
+  estimated from the fraction of the k smallest hashes of their union
+  which occur in both signatures, with a standard error of about
+  1/sqrt(k). See Broder, 'On the resemblance and containment of documents',
+  1997.
+- HyperLogLog: estimates the number of distinct ids in a set, with a
+  standard error of about 1.04/sqrt(2**p). HyperLogLogs of two sets can be
+  merged to estimate the size of their union. See Flajolet et al.,
+  'HyperLogLog: the analysis of a near-optimal cardinality estimation
+  algorithm', 2007.
+"""
+import heapq
+import math
+import struct
+
+
+MASK_64 = (1 << 64) - 1
+
+def hash64(value):
+    """ Hash an integer to 64 bits, with the splitmix64 finalizer. """
+    z = (value + 0x9E3779B97F4A7C15) & MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return z ^ (z >> 31)
+
+class MinHashSignature(object):
+    def __init__(self, k=256, hashes=None):
+        self.k = k
+        self.hashes = sorted(hashes or [])[:k]
+
+    @classmethod
+    def from_ids(cls, ids, k=256):
+        return cls(k=k, hashes=heapq.nsmallest(
+            k, set([hash64(i) for i in ids])))
+
+    def jaccard(self, other):
+        """ Estimate the Jaccard similarity of this signature's set with
+        another signature's set. """
+        k = min(self.k, other.k)
+        hashes = set(self.hashes)
+        other_hashes = set(other.hashes)
+        union_hashes = heapq.nsmallest(k, hashes | other_hashes)
+        if not union_hashes:
+            return 0.0
+        num_in_both = len([h for h in union_hashes
+                           if h in hashes and h in other_hashes])
+        return float(num_in_both)/len(union_hashes)
+
+    def serialize(self):
+        return struct.pack('<I%dQ' % len(self.hashes), self.k, *self.hashes)
+
+    @classmethod
+    def deserialize(cls, data):
+        num_hashes = (len(data) - 4)/8
+        values = struct.unpack('<I%dQ' % num_hashes, data)
+        return cls(k=values[0], hashes=values[1:])
+
+class HyperLogLog(object):
+    def __init__(self, p=12, registers=None):
+        self.p = p
+        self.m = 1 << p
+        if registers is None:
+            registers = bytearray(self.m)
+        self.registers = registers
+
+    @classmethod
+    def from_ids(cls, ids, p=12):
+        hll = cls(p=p)
+        for i in ids:
+            hll.add(i)
+        return hll
+
+    def add(self, value):
+        h = hash64(value)
+        index = h >> (64 - self.p)
+        w = (h << self.p) & MASK_64
+        if w:
+            rank = 64 - w.bit_length() + 1
+        else:
+            rank = 64 - self.p + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        """ Estimate the number of distinct values added. """
+        m = self.m
+        alpha = 0.7213/(1 + 1.079/m)
+        estimate = alpha * m * m / sum([2.0 ** -r for r in self.registers])
+        if estimate <= 2.5 * m:
+            num_zeros = self.registers.count('\x00')
+            if num_zeros:
+                estimate = m * math.log(float(m)/num_zeros)
+        return estimate
+
+    def union(self, other):
+        """ Get a HyperLogLog of the union of this sketch's values and
+        another sketch's values. """
+        if self.p != other.p:
+            raise ValueError("Can not merge HyperLogLogs with different"
+                             " precisions")
+        return HyperLogLog(p=self.p, registers=bytearray(
+            [max(r1, r2) for r1, r2 in zip(self.registers, other.registers)]))
+
+    def serialize(self):
+        return chr(self.p) + str(self.registers)
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(p=ord(data[0]), registers=bytearray(data[1:]))
@@ -0,0 +1,61 @@
+import unittest
+from proteomics.util import bitmap
+import random
+import zlib
+
+
+class BitmapTestCase(unittest.TestCase):
+    def get_id_sets(self):
+        r = random.Random(0)
+        return [
+            [],
+            [0],
+            [1, 2, 3],
+            [7, 8, 65535, 65536, 1 << 20],
+            # Dense chunks.
+            range(0, 100000, 7),
+            range(60000, 140000),
+            # Sparse chunks.
+            r.sample(xrange(1 << 22), 5000),
+        ]
+
+    def test_get_bitmap(self):
+        self.assertEquals(len(bitmap.get_bitmap([])), 0)
+        b = bitmap.get_bitmap([9, 0, 3, 3])
+        self.assertEquals(len(b), 3)
+        self.assertEquals(list(b), [0, 3, 9])
+        for ids in self.get_id_sets():
+            b = bitmap.get_bitmap(ids)
+            self.assertEquals(len(b), len(set(ids)))
+            self.assertEquals(list(b), sorted(set(ids)))
+
+    def test_popcount(self):
+        self.assertEquals(bitmap.popcount(0), 0)
+        self.assertEquals(bitmap.popcount(0b1000001001), 3)
+        self.assertEquals(bitmap.popcount((1 << 70000) - 1), 70000)
+
+    def test_set_operations(self):
+        id_sets = [set(ids) for ids in self.get_id_sets()]
+        bitmaps = [bitmap.get_bitmap(ids) for ids in id_sets]
+        for ids1, b1 in zip(id_sets, bitmaps):
+            for ids2, b2 in zip(id_sets, bitmaps):
+                self.assertEquals(b1.intersection_count(b2),
+                                  len(ids1 & ids2))
+                self.assertEquals(b1.union_count(b2), len(ids1 | ids2))
+                self.assertEquals(b1 & b2, bitmap.get_bitmap(ids1 & ids2))
+                self.assertEquals(b1 | b2, bitmap.get_bitmap(ids1 | ids2))
+
+    def test_serialize(self):
+        for ids in self.get_id_sets():
+            b = bitmap.get_bitmap(ids)
+            self.assertEquals(
+                bitmap.deserialize_bitmap(bitmap.serialize_bitmap(b)), b)
+
+    def test_deserialize_int_bitmap(self):
+        # Bitmaps used to be saved as the little-endian bytes of an int.
+        data = zlib.compress(bitmap.int_to_bytes(0b1000001001))
+        self.assertEquals(bitmap.deserialize_bitmap(data),
+                          bitmap.get_bitmap([0, 3, 9]))
+
+if __name__ == '__main__':
+    unittest.main()
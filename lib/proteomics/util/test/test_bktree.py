@@ -0,0 +1,36 @@
+import unittest
+from proteomics.util.bktree import BKTree
+from proteomics.util.distance import levenshtein
+import tempfile
+import os
+
+
+class BKTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.terms = ['PEPTIDE', 'PEPTIDES', 'PEPTYDE', 'PEPIDE', 'TIDE',
+                      'ACDEFGHIK', 'ACDEFGHIR', 'MGLRSTLR', 'MGLRSTLRR']
+        self.tree = BKTree()
+        for i, term in enumerate(self.terms):
+            self.tree.add(term, i)
+
+    def test_search(self):
+        for query in ['PEPTIDE', 'ACDEFGHIK', 'XXXX']:
+            for max_distance in range(0, 5):
+                actual = sorted(self.tree.search(query, max_distance))
+                expected = sorted([
+                    (i, term, levenshtein(query, term)) 
+                    for i, term in enumerate(self.terms)
+                    if levenshtein(query, term) <= max_distance])
+                self.assertEquals(actual, expected)
+
+    def test_save_and_load(self):
+        hndl, path = tempfile.mkstemp(prefix="tbk.")
+        self.tree.save(path, foo='bar')
+        tree, attrs = BKTree.load(path)
+        os.remove(path)
+        self.assertEquals(attrs, {'foo': 'bar'})
+        self.assertEquals(sorted(tree.search('PEPTIDE', 1)),
+                          sorted(self.tree.search('PEPTIDE', 1)))
+
+if __name__ == '__main__':
+    unittest.main()
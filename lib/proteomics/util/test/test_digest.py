@@ -0,0 +1,48 @@
+import unittest
+from proteomics.util import digest
+from proteomics.config import CLEAVAGE_RULES as expasy_rules
+
+
+class DigestTestCase(unittest.TestCase):
+    def test_cleave(self):
+        self.assertEquals(
+            digest.cleave('AKAKBK', expasy_rules['trypsin'], 0),
+            ['AK', 'AK', 'BK'])
+        self.assertEquals(
+            digest.cleave('AKAKBKCK', expasy_rules['trypsin'], 2),
+            ['AK', 'AKAK', 'AK', 'AKAKBK', 'AKBK', 'BK', 'AKBKCK', 'BKCK',
+             'CK'])
+
+    def test_cleave_w_lengths(self):
+        self.assertEquals(
+            digest.cleave('AKAAKBBBBKPAC', expasy_rules['trypsin'], 1,
+                          min_acids=3, max_acids=5),
+            ['AKAAK', 'AAK'])
+
+    def test_single_residue_rule(self):
+        cleaver = digest.Cleaver(expasy_rules['lysc'], 1)
+        self.assertEquals(cleaver.regex, None)
+        self.assertEquals(list(cleaver.get_cleavage_sites('AKAAKBK')),
+                          [0, 2, 5, 7])
+        self.assertEquals(cleaver.cleave('AKAAKBK'),
+                          ['AK', 'AKAAK', 'AAK', 'AAKBK', 'BK'])
+        self.assertEquals(list(cleaver.get_cleavage_sites('AKAAKB')),
+                          [0, 2, 5, 6])
+        self.assertEquals(list(cleaver.get_cleavage_sites('')), [0])
+        self.assertEquals(cleaver.cleave(''), [])
+
+    def test_cleave_sequence_ending_in_site(self):
+        # The terminal peptide is only made once, with or without missed
+        # cleavages, and for compiled rules as well as single residues.
+        for rule in [expasy_rules['lysc'], 'K(?=.|$)']:
+            self.assertEquals(digest.cleave('AKBK', rule, 0), ['AK', 'BK'])
+            self.assertEquals(digest.cleave('AKBK', rule, 2),
+                              ['AK', 'AKBK', 'BK'])
+
+    def test_get_cleaver(self):
+        cleaver = digest.get_cleaver(expasy_rules['trypsin'], 0, 6)
+        self.assertTrue(
+            cleaver is digest.get_cleaver(expasy_rules['trypsin'], 0, 6))
+
+if __name__ == '__main__':
+    unittest.main()
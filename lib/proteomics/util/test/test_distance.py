@@ -0,0 +1,95 @@
+import unittest
+from proteomics.util import distance
+import random
+
+
+def reference_levenshtein(s1, s2):
+    previous_row = range(len(s1) + 1)
+    for j in range(len(s2)):
+        row = [j + 1]
+        for i in range(len(s1)):
+            row.append(min(row[i] + 1, previous_row[i+1] + 1,
+                           previous_row[i] + (s1[i] != s2[j])))
+        previous_row = row
+    return previous_row[-1]
+
+def get_random_sequence(rng, max_length):
+    return ''.join([rng.choice('ACDE')
+                    for i in range(rng.randint(0, max_length))])
+
+
+class DistanceTestCase(unittest.TestCase):
+    def test_levenshtein(self):
+        cases = [
+            ('', '', 0),
+            ('', 'ABC', 3),
+            ('ABC', '', 3),
+            ('PEPTIDE', 'PEPTIDE', 0),
+            ('PEPTIDE', 'PEPTYDE', 1),
+            ('PEPTIDE', 'PEPIDE', 1),
+            ('PEPTIDE', 'PEPTIDES', 1),
+            ('KITTEN', 'SITTING', 3),
+            ('ACDEFGHIK', 'KIHGFEDCA', 8),
+        ]
+        for s1, s2, expected in cases:
+            self.assertEquals(distance.levenshtein(s1, s2), expected)
+            self.assertEquals(distance.levenshtein(s2, s1), expected)
+
+    def test_levenshtein_matches_reference(self):
+        rng = random.Random(0)
+        for i in range(500):
+            s1 = get_random_sequence(rng, 80)
+            s2 = get_random_sequence(rng, 80)
+            self.assertEquals(distance.levenshtein(s1, s2),
+                              reference_levenshtein(s1, s2))
+
+    def test_levenshtein_max_distance(self):
+        rng = random.Random(1)
+        for i in range(500):
+            s1 = get_random_sequence(rng, 12)
+            s2 = get_random_sequence(rng, 12)
+            max_distance = rng.randint(0, 4)
+            expected = min(reference_levenshtein(s1, s2), max_distance + 1)
+            self.assertEquals(
+                distance.levenshtein(s1, s2, max_distance=max_distance),
+                expected)
+
+    def test_levenshtein_many(self):
+        sequences = ['PEPTIDE', 'PEPTYDE', 'PEPIDE', 'TIDE', '', 'ACDEFGHIK']
+        self.assertEquals(
+            distance.levenshtein_many('PEPTIDE', sequences),
+            [reference_levenshtein('PEPTIDE', s) for s in sequences])
+        self.assertEquals(
+            distance.levenshtein_many('PEPTIDE', sequences, max_distance=1),
+            [0, 1, 1, 2, 2, 2])
+
+    def test_hamming(self):
+        self.assertEquals(distance.hamming('PEPTIDE', 'PEPTIDE'), 0)
+        self.assertEquals(distance.hamming('PEPTIDE', 'PEPTYDE'), 1)
+        self.assertEquals(distance.hamming('PEPTIDE', 'EPTIDEP'), 7)
+        self.assertEquals(
+            distance.hamming('PEPTIDE', 'EPTIDEP', max_distance=2), 3)
+        self.assertRaises(ValueError, distance.hamming, 'PEPTIDE', 'PEPIDE')
+
+    def test_get_deletion_neighborhood(self):
+        self.assertEquals(distance.get_deletion_neighborhood('ABC', 1),
+                          set(['ABC', 'BC', 'AC', 'AB']))
+        self.assertEquals(len(distance.get_deletion_neighborhood('ABC', 2)),
+                          7)
+
+    def test_composition_distance(self):
+        pairs = [('PEPTIDE', 'PEPTYDE'), ('PEPTIDE', 'PEPIDE'),
+                 ('KITTEN', 'SITTING'), ('ACDEFGHIK', 'KIHGFEDCA'),
+                 ('', 'ABC')]
+        for s1, s2 in pairs:
+            c1 = distance.get_composition(s1)
+            c2 = distance.parse_composition(distance.format_composition(
+                distance.get_composition(s2)))
+            self.assertTrue(distance.composition_distance(c1, c2) <=
+                            2 * distance.levenshtein(s1, s2))
+        self.assertEquals(distance.composition_distance(
+            distance.get_composition('PEPTIDE'),
+            distance.get_composition('PEPTYDE')), 2)
+
+if __name__ == '__main__':
+    unittest.main()
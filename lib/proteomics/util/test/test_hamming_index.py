@@ -0,0 +1,47 @@
+import unittest
+from proteomics.util.hamming_index import (HammingIndex, get_segment_keys)
+from proteomics.util.distance import hamming
+import tempfile
+import os
+
+
+class HammingIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.terms = ['PEPTIDE', 'PEPTYDE', 'PAPTIDA', 'TIDE', 'TADE',
+                      'ACDEFGHIK', 'ACDEFGHIR', 'KCDEFGHIA']
+        self.index = HammingIndex(max_distance=2)
+        for i, term in enumerate(self.terms):
+            self.index.add(term, i)
+
+    def test_get_segment_keys(self):
+        self.assertEquals(get_segment_keys('PEPTIDE', 3),
+                          ['7:0:PE', '7:1:PT', '7:2:IDE'])
+
+    def test_candidates_include_matches(self):
+        for query in ['PEPTIDE', 'TIDE', 'ACDEFGHIK', 'XCDEFGHIX']:
+            for max_distance in range(0, 3):
+                candidates = self.index.get_candidates(query, max_distance)
+                for i, term in enumerate(self.terms):
+                    if len(term) == len(query) and \
+                       hamming(query, term) <= max_distance:
+                        self.assertTrue(i in candidates)
+
+    def test_candidates_are_pruned(self):
+        self.assertEquals(
+            sorted(self.index.get_candidates('PEPTIDE', 1)), [0, 1, 2])
+
+    def test_no_candidates_above_max_distance(self):
+        self.assertEquals(self.index.get_candidates('PEPTIDE', 3), None)
+
+    def test_save_and_load(self):
+        hndl, path = tempfile.mkstemp(prefix="thi.")
+        self.index.save(path, foo='bar')
+        index, attrs = HammingIndex.load(path)
+        os.remove(path)
+        self.assertEquals(attrs, {'foo': 'bar'})
+        self.assertEquals(index.max_distance, 2)
+        self.assertEquals(sorted(index.get_candidates('PEPTIDE', 1)),
+                          sorted(self.index.get_candidates('PEPTIDE', 1)))
+
+if __name__ == '__main__':
+    unittest.main()
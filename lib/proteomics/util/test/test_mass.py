@@ -31,5 +31,24 @@ class MassTestCase(unittest.TestCase):
         expected = 2376.11432
         self.assertEquals(actual, expected)
 
+    def test_get_aa_sequence_masses(self):
+        sequences = ['PEPTIDE', 'AK', '']
+        actual = mass.get_aa_sequence_masses(sequences)
+        expected = [mass.get_aa_sequence_mass(sequence) 
+                    for sequence in sequences]
+        self.assertEquals(actual, expected)
+        self.assertEquals(actual[1], 199.13207)
+
+    def test_get_span_mass(self):
+        sequence = 'MGLRSTLRYAALALLK'
+        prefix_masses = mass.get_prefix_masses(sequence)
+        for start, end in [(0, len(sequence)), (0, 4), (4, 8), (8, 16)]:
+            self.assertEquals(
+                mass.get_span_mass(prefix_masses, start, end),
+                mass.get_aa_sequence_mass(sequence[start:end]))
+
+    def test_unknown_residue(self):
+        self.assertRaises(KeyError, mass.get_prefix_masses, 'PEPXIDE')
+
 if __name__ == '__main__':
     unittest.main()
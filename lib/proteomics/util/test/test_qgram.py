@@ -0,0 +1,48 @@
+import unittest
+from proteomics.util.qgram import QGramIndex, get_qgrams
+from proteomics.util.distance import levenshtein
+import tempfile
+import os
+
+
+class QGramIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.terms = ['PEPTIDE', 'PEPTIDES', 'PEPTYDE', 'PEPIDE', 'TIDE',
+                      'ACDEFGHIK', 'ACDEFGHIR', 'MGLRSTLR', 'MGLRSTLRR']
+        self.index = QGramIndex(q=3)
+        for i, term in enumerate(self.terms):
+            self.index.add(term, i)
+
+    def test_get_qgrams(self):
+        self.assertEquals(get_qgrams('AAAAB', 3), set(['AAA', 'AAB']))
+        self.assertEquals(get_qgrams('AB', 3), set())
+
+    def test_candidates_include_matches(self):
+        for query in ['PEPTIDE', 'ACDEFGHIK', 'MGLRSTLRK']:
+            for max_distance in range(0, 3):
+                candidates = self.index.get_candidates(query, max_distance)
+                if candidates is None:
+                    continue
+                for i, term in enumerate(self.terms):
+                    if levenshtein(query, term) <= max_distance:
+                        self.assertTrue(i in candidates)
+
+    def test_candidates_are_pruned(self):
+        self.assertEquals(
+            sorted(self.index.get_candidates('ACDEFGHIK', 1)), [5, 6])
+
+    def test_no_candidates_for_short_queries(self):
+        self.assertEquals(self.index.get_candidates('TIDE', 1), None)
+
+    def test_save_and_load(self):
+        hndl, path = tempfile.mkstemp(prefix="tqg.")
+        self.index.save(path, foo='bar')
+        index, attrs = QGramIndex.load(path)
+        os.remove(path)
+        self.assertEquals(attrs, {'foo': 'bar'})
+        self.assertEquals(len(index), len(self.terms))
+        self.assertEquals(sorted(index.get_candidates('PEPTIDE', 1)),
+                          sorted(self.index.get_candidates('PEPTIDE', 1)))
+
+if __name__ == '__main__':
+    unittest.main()
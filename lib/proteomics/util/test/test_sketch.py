@@ -0,0 +1,39 @@
+import unittest
+from proteomics.util.sketch import MinHashSignature, HyperLogLog
+
+
+class SketchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ids1 = range(0, 20000)
+        self.ids2 = range(10000, 40000)
+
+    def test_minhash_jaccard(self):
+        minhash1 = MinHashSignature.from_ids(self.ids1)
+        minhash2 = MinHashSignature.from_ids(self.ids2)
+        expected = 10000.0/40000
+        self.assertTrue(abs(minhash1.jaccard(minhash2) - expected) < 0.1)
+        self.assertEquals(minhash1.jaccard(minhash1), 1.0)
+
+    def test_minhash_small_sets_are_exact(self):
+        minhash1 = MinHashSignature.from_ids(range(0, 10))
+        minhash2 = MinHashSignature.from_ids(range(5, 20))
+        self.assertEquals(minhash1.jaccard(minhash2), 5.0/20)
+
+    def test_hll_count(self):
+        hll1 = HyperLogLog.from_ids(self.ids1)
+        hll2 = HyperLogLog.from_ids(self.ids2)
+        self.assertTrue(abs(hll1.count() - 20000) < 20000 * 0.05)
+        self.assertTrue(abs(hll1.union(hll2).count() - 40000) < 40000 * 0.05)
+        self.assertEquals(round(HyperLogLog.from_ids(range(10)).count()), 10)
+
+    def test_serialize(self):
+        minhash = MinHashSignature.from_ids(self.ids1)
+        self.assertEquals(
+            MinHashSignature.deserialize(minhash.serialize()).hashes,
+            minhash.hashes)
+        hll = HyperLogLog.from_ids(self.ids1)
+        self.assertEquals(HyperLogLog.deserialize(hll.serialize()).count(),
+                          hll.count())
+
+if __name__ == '__main__':
+    unittest.main()